@@ -0,0 +1,300 @@
+"""压缩包 (zip / tar) 的输入和输出
+
+源和输出都可以是压缩包: 源压缩包中的成员逐个读入内存交给工作进程解码、编码，
+输出不落地，直接追加到输出压缩包中，不需要先解压到磁盘、转换后再重新打包。
+同时在途的成员数由执行引擎的任务窗口限制，内存占用与压缩包大小无关。
+
+tar 以流式模式 ('r|*') 读取，gz / bz2 / xz 压缩的 tar 也不需要随机访问；
+输出压缩包先写入同目录下的临时文件，完成后再重命名。
+压缩包中的目录结构与 keep_structure 时输出目录中的结构相同。
+"""
+import io
+import os
+import tarfile
+import time
+import zipfile
+from dataclasses import replace
+
+from img_to_webp_core import (FILE_MODE, SUPPORTED_FORMATS, TARGET_FORMATS, WAITING, ConvertResult,
+                              FileDiscovery, OutputNameRegistry, SourceFile, atomic_write, convert_file,
+                              create_engine, estimate_memory, make_job, temp_path)
+
+ZIP_SUFFIXES = ('.zip',)
+TAR_SUFFIXES = {
+    '.tar': '', '.tar.gz': 'gz', '.tgz': 'gz', '.tar.bz2': 'bz2', '.tbz2': 'bz2',
+    '.tar.xz': 'xz', '.txz': 'xz',
+}
+
+
+def archive_kind(path):
+    """根据扩展名判断压缩包类型: 'zip'、'tar' 或 None"""
+    name = path.lower()
+    if name.endswith(ZIP_SUFFIXES):
+        return 'zip'
+    if name.endswith(tuple(TAR_SUFFIXES)):
+        return 'tar'
+    return None
+
+
+def is_archive(path):
+    return archive_kind(path) is not None and not os.path.isdir(path)
+
+
+def _tar_compression(path):
+    name = path.lower()
+    for suffix, compression in sorted(TAR_SUFFIXES.items(), key=lambda item: -len(item[0])):
+        if name.endswith(suffix):
+            return compression
+    return ''
+
+
+def _member_path(name):
+    """把成员名拆分为 (相对目录, 文件名)，绝对路径或包含 .. 的成员返回 None"""
+    parts = [part for part in name.replace('\\', '/').split('/') if part not in ('', '.')]
+    if not parts or '..' in parts or name.startswith('/') or ':' in parts[0]:
+        return None
+    rel_path = os.path.join(*parts[:-1]) if len(parts) > 1 else '.'
+    return rel_path, parts[-1]
+
+
+def _wanted(rel_path, filename, recursive):
+    ext = os.path.splitext(filename)[1].lower()
+    if ext not in SUPPORTED_FORMATS and ext not in TARGET_FORMATS:
+        return False
+    return recursive or rel_path == '.'
+
+
+def iter_archive(path, recursive=True):
+    """逐个产生压缩包中的图片成员 (SourceFile, 内容)
+
+    SourceFile.filepath 为 "压缩包路径/成员名"，仅用于显示。成员内容在迭代到时才读取。
+    """
+    if archive_kind(path) == 'zip':
+        with zipfile.ZipFile(path) as archive:
+            for info in archive.infolist():
+                if info.is_dir():
+                    continue
+                member = _member_path(info.filename)
+                if member is None or not _wanted(*member, recursive):
+                    continue
+                rel_path, filename = member
+                mtime = time.mktime(info.date_time + (0, 0, -1))
+                item = SourceFile(f"{path}/{info.filename}", filename, rel_path, info.file_size,
+                                  int(mtime * 1e9))
+                yield item, archive.read(info)
+    else:
+        # 流式读取: 只能按顺序访问成员，必须在读取下一个成员之前读完当前成员
+        with tarfile.open(path, 'r|*') as archive:
+            for info in archive:
+                if not info.isfile():
+                    continue
+                member = _member_path(info.name)
+                if member is None or not _wanted(*member, recursive):
+                    continue
+                rel_path, filename = member
+                item = SourceFile(f"{path}/{info.name}", filename, rel_path, info.size,
+                                  int(info.mtime * 1e9))
+                with archive.extractfile(info) as f:
+                    yield item, f.read()
+
+
+class ArchiveWriter:
+    """把输出文件逐个追加到 zip / tar 压缩包中
+
+    WebP / AVIF 已经是压缩格式，zip 中以不压缩 (ZIP_STORED) 方式存储。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        fd, self._tmp_path = temp_path(path)
+        os.close(fd)
+        self.count = 0
+        try:
+            if archive_kind(path) == 'zip':
+                self._zip = zipfile.ZipFile(self._tmp_path, 'w', zipfile.ZIP_STORED)
+                self._tar = None
+            else:
+                self._zip = None
+                self._tar = tarfile.open(self._tmp_path, 'w:' + _tar_compression(path))
+        except BaseException:
+            os.remove(self._tmp_path)
+            raise
+
+    def add(self, name, data, mtime=None):
+        """name: 以 / 分隔的成员名"""
+        mtime = time.time() if mtime is None else mtime
+        if self._zip is not None:
+            info = zipfile.ZipInfo(name, time.localtime(max(mtime, 315532800))[:6])
+            info.compress_type = zipfile.ZIP_STORED
+            info.external_attr = 0o644 << 16
+            self._zip.writestr(info, data)
+        else:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            info.mtime = int(mtime)
+            info.mode = 0o644
+            self._tar.addfile(info, io.BytesIO(data))
+        self.count += 1
+
+    def commit(self):
+        """写完压缩包并替换输出文件"""
+        (self._zip or self._tar).close()
+        os.chmod(self._tmp_path, FILE_MODE)
+        os.replace(self._tmp_path, self.path)
+
+    def abort(self):
+        try:
+            (self._zip or self._tar).close()
+        finally:
+            if os.path.exists(self._tmp_path):
+                os.remove(self._tmp_path)
+
+
+class DirectoryWriter:
+    """输出到目录 (源为压缩包时)"""
+
+    def __init__(self, path):
+        self.path = path
+        self.count = 0
+
+    def add(self, name, data, mtime=None):
+        path = os.path.join(self.path, *name.split('/'))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        atomic_write(path, data)
+        if mtime is not None:
+            os.utime(path, (mtime, mtime))
+        self.count += 1
+
+    def commit(self):
+        pass
+
+    def abort(self):
+        pass
+
+
+class ArchiveNames(OutputNameRegistry):
+    """压缩包中的输出文件名登记表: 与目录相同的命名规则，但不读取磁盘"""
+
+    def _load(self, out_dir):
+        return self._dirs.setdefault(out_dir, (set(), {}))
+
+
+class MemorySink:
+    """转换的输入和输出都在内存中: 源文件来自 job.data (或读取 job.filepath)，
+    输出保存在 payloads 中随结果返回主进程"""
+
+    def __init__(self, job):
+        self.job = job
+        self.data = job.data
+        self.digest = None  # 压缩包不做内容去重，不计算哈希
+        self.payloads = []  # [(输出路径, 内容)]
+
+    def open(self):
+        return io.BytesIO(self.data)
+
+    def prepare(self):
+        if self.data is None:
+            with open(self.job.filepath, 'rb') as f:
+                self.data = f.read()
+        return len(self.data)
+
+    def copy(self, path):
+        self.payloads.append((path, self.data))
+        return None
+
+    def write(self, path, data):
+        self.payloads.append((path, bytes(data)))
+
+    def finish(self, outputs):
+        pass
+
+
+def convert_member(job):
+    """转换单个文件并把输出返回主进程 (可在工作进程中运行)，返回 (ConvertResult, payloads)"""
+    sink = MemorySink(job)
+    result = convert_file(job, sink)
+    if result.status == 'error':
+        return result, []
+    return result, sink.payloads
+
+
+def _source_items(source, recursive):
+    """产生 (SourceFile, 内容或 None)；源为目录时由工作进程自己读取文件，扫描中的 WAITING 原样产生"""
+    if is_archive(source):
+        yield from iter_archive(source, recursive)
+        return
+    discovery = FileDiscovery(source, recursive)
+    try:
+        for item in discovery:
+            yield item, None
+    finally:
+        discovery.close()
+
+
+def convert_archive(source, output, settings, should_stop=None, on_discovered=None):
+    """源或输出为压缩包时的转换，按完成顺序逐个返回 ConvertResult
+
+    参数与 convert_tree 相同。压缩包不是增量转换的对象: 转换清单、内容去重、
+    编码强度控制和 cProfile 采样在此模式下不使用。
+    停止时已转换的文件仍会写入输出压缩包；出现异常或被中断时不生成输出压缩包。
+    """
+    if should_stop is None:
+        should_stop = lambda: False
+    archive_output = is_archive(output)
+    if archive_output:
+        writer = ArchiveWriter(output)
+        names = ArchiveNames()
+        root = ''
+    else:
+        os.makedirs(output, exist_ok=True)
+        writer = DirectoryWriter(output)
+        names = OutputNameRegistry()
+        root = output
+    # 估算内存由下面根据内容计算，make_job 不读取文件头
+    job_settings = replace(settings, memory_budget=0)
+    mtimes = {}  # 源文件 -> 修改时间 (秒)，输出文件沿用源文件的修改时间
+    count = 0
+
+    def jobs():
+        nonlocal count
+        for item, data in _source_items(source, settings.recursive):
+            if item is WAITING:
+                yield item
+                continue
+            count += 1
+            if on_discovered is not None:
+                on_discovered(count, False)
+            job = make_job(item.filepath, item.filename, item.rel_path, root, job_settings, names)
+            job = job._replace(data=data)
+            if settings.memory_budget and settings.workers > 1 and job.targets:
+                src = item.filepath if data is None else io.BytesIO(data)
+                job = job._replace(mem_cost=estimate_memory(src, settings.max_size if settings.resize_large else None))
+            mtimes[item.filepath] = item.mtime_ns / 1e9
+            yield job
+
+    def member_name(path):
+        if not archive_output:
+            path = os.path.relpath(path, root)
+        return path.replace(os.sep, '/')
+
+    engine = create_engine(settings.workers, settings.memory_budget * 1024 * 1024)
+    try:
+        for result, payloads in engine.run(jobs(), should_stop, convert_member):
+            mtime = mtimes.pop(result.filepath, None)
+            try:
+                for path, data in payloads:
+                    writer.add(member_name(path), data, mtime)
+            except OSError as e:
+                result = ConvertResult('error', result.filepath, result.filename, None, None,
+                                       result.original_size, 0, None, str(e), reason=type(e).__name__)
+            yield result
+        if on_discovered is not None:
+            on_discovered(count, True)
+    except BaseException:
+        writer.abort()
+        raise
+    else:
+        writer.commit()
+    finally:
+        engine.close()
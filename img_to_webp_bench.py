@@ -0,0 +1,309 @@
+"""转换性能基准测试
+
+生成可复现的合成图片集 (照片、纯色 PNG、透明 PNG、调色板 GIF、16 位 TIFF、
+超大图片)，按 输出格式 × 质量预设 (95/85/75/60) × 无损 × 进程数 的组合运行
+convert_tree，统计每秒图片数、MB/s、峰值内存和压缩率。
+结果可以保存为基准文件，之后与基准比较以发现性能退化。
+
+用法示例:
+    python img_to_webp_bench.py --workers 1,4 --save-baseline baseline.json
+    python img_to_webp_bench.py --workers 1,4 --compare baseline.json
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import unicodedata
+from array import array
+
+from PIL import Image, ImageDraw
+
+from img_to_webp_core import (AVIF_SUPPORTED, ConvertSettings, ConversionStats,
+                              convert_tree, format_size, parse_formats, peak_rss)
+
+# 图片集版本，生成规则变化时递增，旧的图片集会被重新生成
+CORPUS_VERSION = 1
+CORPUS_INFO = 'corpus.json'
+
+QUALITY_PRESETS = (95, 85, 75, 60)
+
+# (类型, 数量, 宽, 高)，尺寸按 --scale 缩放
+CORPUS_SPEC = (
+    ('photo', 8, 1600, 1200),
+    ('flat', 6, 1200, 900),
+    ('alpha', 6, 800, 800),
+    ('palette', 4, 640, 480),
+    ('tiff16', 3, 1024, 768),
+    ('giant', 1, 6000, 4000),
+)
+
+
+def _photo(rng, size):
+    """类似照片的图像: 平滑的色块加上细节噪声"""
+    width, height = size
+    small = (width // 48 + 2, height // 48 + 2)
+    base = Image.frombytes('RGB', small, rng.randbytes(small[0] * small[1] * 3))
+    base = base.resize(size, Image.Resampling.BICUBIC)
+    half = (max(1, width // 2), max(1, height // 2))
+    detail = Image.frombytes('L', half, rng.randbytes(half[0] * half[1]))
+    detail = detail.resize(size, Image.Resampling.BILINEAR).convert('RGB')
+    return Image.blend(base, detail, 0.15)
+
+
+def _flat(rng, size):
+    """大面积纯色的图像 (截图、图表一类)"""
+    img = Image.new('RGB', size, tuple(rng.randrange(256) for _ in range(3)))
+    draw = ImageDraw.Draw(img)
+    for _ in range(12):
+        x0, y0 = rng.randrange(size[0]), rng.randrange(size[1])
+        x1, y1 = x0 + rng.randrange(size[0] // 2 + 1), y0 + rng.randrange(size[1] // 2 + 1)
+        draw.rectangle((x0, y0, x1, y1), fill=tuple(rng.randrange(256) for _ in range(3)))
+    return img
+
+
+def _alpha(rng, size):
+    """透明背景上的半透明图形"""
+    img = Image.new('RGBA', size, (0, 0, 0, 0))
+    draw = ImageDraw.Draw(img)
+    for _ in range(10):
+        x0, y0 = rng.randrange(size[0]), rng.randrange(size[1])
+        x1, y1 = x0 + rng.randrange(size[0] // 3 + 1), y0 + rng.randrange(size[1] // 3 + 1)
+        draw.ellipse((x0, y0, x1, y1), fill=tuple(rng.randrange(256) for _ in range(3)) + (rng.randrange(64, 256),))
+    return img
+
+
+def _tiff16(rng, size):
+    """16 位灰度渐变加噪声 (逐像素计算，不依赖只在较新的 Pillow 中才有的 ImageMath 接口)"""
+    gradient = Image.linear_gradient('L').resize(size).tobytes()
+    noise = rng.randbytes(size[0] * size[1])
+    values = array('H', [g * 250 + n * 4 for g, n in zip(gradient, noise)])
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return Image.frombytes('I;16', size, values.tobytes())
+
+
+def _make_image(kind, rng, size):
+    if kind in ('photo', 'giant'):
+        return _photo(rng, size), '.jpg', {'quality': 90}
+    if kind == 'flat':
+        return _flat(rng, size), '.png', {}
+    if kind == 'alpha':
+        return _alpha(rng, size), '.png', {}
+    if kind == 'palette':
+        return _photo(rng, size).quantize(64), '.gif', {}
+    return _tiff16(rng, size), '.tif', {}
+
+
+def generate_corpus(directory, scale=1.0, seed=0):
+    """生成基准测试图片集，参数相同时结果相同；目录中已有相同参数的图片集时直接复用
+
+    返回图片集的总大小 (字节)。
+    """
+    info = {'version': CORPUS_VERSION, 'scale': scale, 'seed': seed}
+    info_path = os.path.join(directory, CORPUS_INFO)
+    try:
+        with open(info_path, encoding='utf-8') as f:
+            existing = json.load(f)
+        if {key: existing.get(key) for key in info} == info:
+            return existing['size']
+    except (OSError, ValueError, KeyError):
+        pass
+
+    if os.path.exists(directory):
+        # 只清空由本工具生成的图片集目录
+        if os.listdir(directory) and not os.path.exists(info_path):
+            raise ValueError(f"目录不为空且不是基准测试图片集: {directory}")
+        shutil.rmtree(directory)
+    os.makedirs(directory)
+    rng = random.Random(seed)
+    total = 0
+    for kind, count, width, height in CORPUS_SPEC:
+        size = (max(16, int(width * scale)), max(16, int(height * scale)))
+        for index in range(count):
+            img, ext, options = _make_image(kind, rng, size)
+            path = os.path.join(directory, f"{kind}_{index:02d}{ext}")
+            img.save(path, **options)
+            total += os.path.getsize(path)
+
+    info['size'] = total
+    with open(info_path, 'w', encoding='utf-8') as f:
+        json.dump(info, f)
+    return total
+
+
+def case_name(output_format, quality, lossless, workers):
+    return f"{output_format}-{'lossless' if lossless else f'q{quality}'}-j{workers}"
+
+
+def run_case(corpus, output_format, quality, lossless, workers):
+    """运行一个组合，返回统计结果 (在独立进程中调用，峰值内存互不影响)"""
+    output = tempfile.mkdtemp(prefix='img_to_webp_bench_')
+    settings = ConvertSettings(output_formats=(output_format,), quality=quality, lossless=lossless,
+                               workers=workers, incremental=False)
+    stats = ConversionStats()
+    try:
+        start = time.perf_counter()
+        for result in convert_tree(corpus, output, settings):
+            stats.add(result)
+        elapsed = time.perf_counter() - start
+    finally:
+        shutil.rmtree(output, ignore_errors=True)
+
+    images = stats.done - stats.errors
+    return {
+        'elapsed': round(elapsed, 4),
+        'images': images,
+        'errors': stats.errors,
+        'images_per_second': round(images / elapsed, 3),
+        'mb_per_second': round(stats.original_size / 1024 / 1024 / elapsed, 3),
+        'peak_rss': max(stats.peak_rss, peak_rss() or 0),
+        'compression_ratio': round(stats.new_size / stats.original_size, 4) if stats.original_size else None,
+    }
+
+
+def _run_case_child(conn, args):
+    try:
+        conn.send((True, run_case(*args)))
+    except Exception as e:
+        conn.send((False, e))
+    finally:
+        conn.close()
+
+
+def run_isolated(*args):
+    """在新的进程中运行一个组合，组合中的异常在主进程中重新抛出"""
+    receiver, sender = multiprocessing.Pipe(duplex=False)
+    process = multiprocessing.Process(target=_run_case_child, args=(sender, args))
+    process.start()
+    sender.close()
+    try:
+        ok, value = receiver.recv()
+    except EOFError:
+        value = None
+    finally:
+        receiver.close()
+        process.join()
+    if value is None:
+        raise RuntimeError(f"基准测试进程异常退出 (退出码 {process.exitcode})")
+    if not ok:
+        raise value
+    return value
+
+
+def compare(results, baseline, tolerance):
+    """与基准比较，返回退化说明列表 (每秒图片数下降超过 tolerance 比例的组合)"""
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        change = result['images_per_second'] / base['images_per_second'] - 1
+        if change < -tolerance:
+            regressions.append(f"{name}: {base['images_per_second']:.2f} → "
+                               f"{result['images_per_second']:.2f} 张/秒 ({change * 100:+.1f}%)")
+    return regressions
+
+
+def _pad(text, width, left=False):
+    """按显示宽度对齐 (中文字符占两列)"""
+    size = sum(2 if unicodedata.east_asian_width(ch) in 'WF' else 1 for ch in text)
+    padding = ' ' * max(0, width - size)
+    return text + padding if left else padding + text
+
+
+def _int_list(text):
+    try:
+        values = [int(part) for part in text.split(',') if part.strip()]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"无效的数字列表: {text}")
+    if not values or min(values) <= 0:
+        raise argparse.ArgumentTypeError(f"无效的数字列表: {text}")
+    return values
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="图片转换性能基准测试")
+    parser.add_argument('--corpus', default=os.path.join(tempfile.gettempdir(), 'img_to_webp_bench_corpus'),
+                        help="图片集目录，不存在或参数不同时重新生成 (默认: 系统临时目录)")
+    parser.add_argument('--scale', type=float, default=1.0, help="图片尺寸缩放比例 (默认: 1.0)")
+    parser.add_argument('--seed', type=int, default=0, help="生成图片集的随机种子 (默认: 0)")
+    parser.add_argument('-f', '--format', dest='output_formats', type=parse_formats,
+                        default=('webp', 'avif') if AVIF_SUPPORTED else ('webp',),
+                        help="输出格式，以逗号分隔 (默认: 全部可用格式)")
+    parser.add_argument('--qualities', type=_int_list, default=list(QUALITY_PRESETS),
+                        help="质量预设，以逗号分隔 (默认: 95,85,75,60)")
+    parser.add_argument('--no-lossless', dest='lossless', action='store_false', help="不测试无损模式")
+    parser.add_argument('-j', '--workers', type=_int_list, default=[1, os.cpu_count() or 1],
+                        help="进程数，以逗号分隔 (默认: 1 和 CPU 核心数)")
+    parser.add_argument('--repeat', type=int, default=1, help="每个组合重复次数，取最快的一次 (默认: 1)")
+    parser.add_argument('--save-baseline', metavar='PATH', help="把结果保存为基准文件")
+    parser.add_argument('--compare', metavar='PATH', help="与基准文件比较，发现退化时返回 1")
+    parser.add_argument('--tolerance', type=float, default=0.10,
+                        help="允许的每秒图片数下降比例 (默认: 0.10)")
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if "avif" in args.output_formats and not AVIF_SUPPORTED:
+        parser.error("AVIF 格式需要安装 pillow-avif-plugin (pip install pillow-avif-plugin)")
+
+    print(f"生成图片集: {args.corpus}", flush=True)
+    try:
+        corpus_size = generate_corpus(args.corpus, args.scale, args.seed)
+    except ValueError as e:
+        parser.error(str(e))
+    print(f"图片集大小: {format_size(corpus_size)}", flush=True)
+
+    cases = []
+    for output_format in args.output_formats:
+        modes = [(quality, False) for quality in args.qualities]
+        if args.lossless:
+            modes.append((100, True))
+        for quality, lossless in modes:
+            for workers in dict.fromkeys(args.workers):
+                cases.append((output_format, quality, lossless, workers))
+
+    results = {}
+    print(_pad('组合', 22, left=True) + _pad('张/秒', 10) + _pad('MB/秒', 10)
+          + _pad('峰值内存', 12) + _pad('压缩率', 10), flush=True)
+    for case in cases:
+        name = case_name(*case)
+        runs = [run_isolated(args.corpus, *case) for _ in range(max(1, args.repeat))]
+        result = max(runs, key=lambda run: run['images_per_second'])
+        results[name] = result
+        ratio = f"{result['compression_ratio']:.3f}" if result['compression_ratio'] is not None else '-'
+        print(f"{name:<22}{result['images_per_second']:>10.2f}{result['mb_per_second']:>10.2f}"
+              f"{format_size(result['peak_rss']):>12}{ratio:>10}", flush=True)
+
+    if args.save_baseline:
+        baseline = {'corpus': {'scale': args.scale, 'seed': args.seed, 'version': CORPUS_VERSION},
+                    'results': results}
+        with open(args.save_baseline, 'w', encoding='utf-8') as f:
+            json.dump(baseline, f, ensure_ascii=False, indent=2)
+        print(f"基准已保存: {args.save_baseline}")
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        if baseline.get('corpus') != {'scale': args.scale, 'seed': args.seed, 'version': CORPUS_VERSION}:
+            print("警告: 基准文件使用的图片集参数不同，结果可能不可比较", file=sys.stderr)
+        regressions = compare(results, baseline.get('results', {}), args.tolerance)
+        if regressions:
+            print("性能退化:", file=sys.stderr)
+            for line in regressions:
+                print(f"  {line}", file=sys.stderr)
+            return 1
+        print("未发现性能退化")
+    return 0
+
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    sys.exit(main())
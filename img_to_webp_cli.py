@@ -0,0 +1,227 @@
+"""图片格式转换器 - 命令行版本
+
+不导入 tkinter，适合批处理任务、定时任务和容器环境。
+
+用法示例:
+    python img_to_webp_cli.py 源目录 输出目录 --format avif --quality 75 --workers 8
+"""
+import argparse
+import multiprocessing
+import os
+import signal
+import sys
+
+from img_to_webp_archive import convert_archive, is_archive
+from img_to_webp_core import (AVIF_SUPPORTED, PASSTHROUGH_STRATEGIES, ConvertSettings,
+                              ConversionStats, check_name_template, convert_tree, describe_result,
+                              format_label, parse_deadline, parse_formats, parse_widths)
+from img_to_webp_report import RunReport
+from img_to_webp_watch import DEFAULT_POLL_INTERVAL, DEFAULT_SETTLE, watch_tree
+
+# 监视模式下运行报告最多保留的文件明细数 (长时间运行时内存占用不随文件数增长)
+WATCH_REPORT_ROWS = 10000
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="批量将图片转换为 WebP / AVIF 格式")
+    parser.add_argument('source', help="源目录，或 zip / tar 压缩包")
+    parser.add_argument('output', help="输出目录，或 zip / tar 压缩包 (如 out.zip、out.tar.gz)")
+    parser.add_argument('-f', '--format', dest='output_formats', type=parse_formats,
+                        default=('webp',), help="输出格式，多个格式以逗号分隔，如 webp,avif (默认: webp)")
+    parser.add_argument('--widths', type=parse_widths, default=(),
+                        help="响应式输出宽度，以逗号分隔，如 320,640,1280 (默认: 只输出原始尺寸)")
+    parser.add_argument('--name-template', default='',
+                        help="输出文件命名规则，可用 {name} {width} {ext} "
+                             "(默认: {name}.{ext}，指定宽度时为 {name}-{width}w.{ext})")
+    parser.add_argument('-q', '--quality', type=int, default=85,
+                        help="压缩质量 1-100 (默认: 85)")
+    parser.add_argument('--lossless', action='store_true', help="无损压缩")
+    parser.add_argument('--no-recursive', dest='recursive', action='store_false',
+                        help="不包含子目录")
+    parser.add_argument('--keep-structure', action='store_true', help="保持目录结构")
+    parser.add_argument('--no-skip-larger', dest='skip_larger', action='store_false',
+                        help="即使转换后更大也保留转换结果")
+    parser.add_argument('--resize-large', action='store_true', help="缩小大图片 (默认 >4K)")
+    parser.add_argument('--max-size', type=int, default=3840,
+                        help="缩小大图片时的最大边长，像素 (默认: 3840)")
+    parser.add_argument('--no-incremental', dest='incremental', action='store_false',
+                        help="忽略转换清单，重新转换所有文件")
+    parser.add_argument('-j', '--workers', type=int, default=os.cpu_count() or 1,
+                        help="并行进程数 (默认: CPU 核心数)")
+    parser.add_argument('--target-rate', type=float, default=0, metavar='N',
+                        help="目标速度 (张/秒)，达不到时自动降低编码强度 (默认: 0 始终最高强度)")
+    parser.add_argument('--deadline', type=parse_deadline, default=0,
+                        help="完成期限，如 30m、2h 或 18:30，根据剩余文件数自动调整编码强度")
+    parser.add_argument('--predict-skip', type=float, default=0, metavar='THRESHOLD',
+                        help="根据文件头预测转换后不会变小的文件并直接复制，参数为置信度阈值 0-1，"
+                             "如 0.8 (默认: 0 关闭)")
+    parser.add_argument('--verify-prediction', action='store_true',
+                        help="仍然编码所有文件，在汇总和运行报告中统计预测的准确率")
+    parser.add_argument('--dedup', choices=('link', 'copy', 'off'), default='link',
+                        help="内容相同的源文件只编码一次，其余文件硬链接 (link) 或复制 (copy) 输出 (默认: link)")
+    parser.add_argument('--passthrough', choices=PASSTHROUGH_STRATEGIES, default='auto',
+                        help="已是目标格式和转换后变大的文件原样复制的方式 (默认: auto，依次尝试 reflink、"
+                             "copy_range、sendfile、copy；hardlink 使输出与源文件共享同一个文件，需明确指定)")
+    parser.add_argument('--memory-budget', type=int, default=0, metavar='MB',
+                        help="并行解码的内存预算，超大图片会被单独执行 (默认: 0 不限制)")
+    parser.add_argument('--report', metavar='PATH',
+                        help="保存 JSON 运行报告 (各阶段耗时百分位数、最慢的文件、跳过/错误原因)")
+    parser.add_argument('--report-csv', metavar='PATH',
+                        help=f"保存每个文件一行的 CSV 耗时明细 (监视模式下只保留最近 {WATCH_REPORT_ROWS} 个文件)")
+    parser.add_argument('--profile-dir', default='', metavar='DIR',
+                        help="对抽样的文件运行 cProfile，结果 (.prof) 保存到此目录")
+    parser.add_argument('--profile-every', type=int, default=20, metavar='N',
+                        help="每 N 个转换任务采样一个 (默认: 20)")
+    parser.add_argument('--watch', action='store_true',
+                        help="转换已有文件后继续监视源目录，新图片写入完成后立即转换，按 Ctrl+C 结束")
+    parser.add_argument('--settle', type=float, default=DEFAULT_SETTLE, metavar='SECONDS',
+                        help=f"监视模式下文件多少秒内没有变化才视为写入完成 (默认: {DEFAULT_SETTLE})")
+    parser.add_argument('--poll-interval', type=float, default=DEFAULT_POLL_INTERVAL, metavar='SECONDS',
+                        help=f"监视模式下轮询目录的间隔，inotify 可用时只影响响应 Ctrl+C 的速度 "
+                             f"(默认: {DEFAULT_POLL_INTERVAL})")
+    parser.add_argument('--polling', action='store_true', help="监视模式下不使用 inotify，始终轮询")
+    parser.add_argument('--quiet', action='store_true', help="只输出错误和汇总")
+    return parser
+
+
+def settings_from_args(args):
+    return ConvertSettings(
+        output_formats=args.output_formats,
+        widths=args.widths,
+        name_template=args.name_template,
+        quality=max(1, min(100, args.quality)),
+        lossless=args.lossless,
+        recursive=args.recursive,
+        keep_structure=args.keep_structure,
+        skip_larger=args.skip_larger,
+        resize_large=args.resize_large,
+        max_size=max(1, args.max_size),
+        workers=max(1, args.workers),
+        memory_budget=max(0, args.memory_budget),
+        incremental=args.incremental,
+        profile_dir=args.profile_dir,
+        profile_every=max(1, args.profile_every),
+        target_rate=max(0.0, args.target_rate),
+        deadline=args.deadline,
+        predict_threshold=max(0.0, min(1.0, args.predict_skip)),
+        verify_prediction=args.verify_prediction,
+        dedup=args.dedup,
+        passthrough=args.passthrough,
+    )
+
+
+class StopRequest:
+    """Ctrl+C 和 SIGTERM (systemd、docker stop 等) 的处理
+
+    第一次只请求停止: 不再开始新的文件，等待正在转换的文件完成并记入转换清单，然后输出汇总；
+    再次收到时抛出 KeyboardInterrupt 立即退出 (正在转换的文件不记入转换清单)。
+    """
+
+    def __init__(self):
+        self.requested = False
+
+    def __call__(self):
+        return self.requested
+
+    def handle(self, signum, frame):
+        if self.requested:
+            raise KeyboardInterrupt
+        self.requested = True
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    try:
+        args.name_template = check_name_template(args.name_template, args.widths, args.output_formats)
+    except ValueError as e:
+        parser.error(str(e))
+    settings = settings_from_args(args)
+
+    archive = is_archive(args.source) or is_archive(args.output)
+    if not (os.path.isdir(args.source) or (archive and os.path.isfile(args.source))):
+        parser.error("源目录不存在!")
+    if archive and args.watch:
+        parser.error("监视模式只支持目录，不支持压缩包")
+    if "avif" in settings.output_formats and not AVIF_SUPPORTED:
+        parser.error("AVIF 格式需要安装 pillow-avif-plugin (pip install pillow-avif-plugin)")
+
+    stats = ConversionStats()
+    report = RunReport(settings, max_rows=WATCH_REPORT_ROWS if args.watch else None)
+    stop = StopRequest()
+    signal.signal(signal.SIGINT, stop.handle)
+    signal.signal(signal.SIGTERM, stop.handle)
+
+    def on_discovered(count, finished):
+        if finished:
+            print(f"文件扫描完成，共找到 {count} 个图片文件", flush=True)
+
+    def on_watching(method):
+        print(f"已有文件转换完成，正在监视 {args.source} ({method})，按 Ctrl+C 结束...", flush=True)
+
+    if args.watch:
+        results = watch_tree(args.source, args.output, settings, should_stop=stop,
+                             settle=max(0.0, args.settle), poll_interval=max(0.05, args.poll_interval),
+                             polling=args.polling, on_watching=on_watching)
+    elif archive:
+        results = convert_archive(args.source, args.output, settings, should_stop=stop,
+                                  on_discovered=on_discovered)
+    else:
+        results = convert_tree(args.source, args.output, settings, should_stop=stop,
+                               on_discovered=on_discovered)
+
+    print(f"开始转换为 {format_label(settings.output_formats)} (进程数: {settings.workers})...", flush=True)
+    try:
+        for result in results:
+            stats.add(result)
+            report.add(result)
+            for message, tag in describe_result(result, settings.output_formats):
+                if tag == 'error':
+                    print(message, file=sys.stderr, flush=True)
+                elif not args.quiet:
+                    print(message, flush=True)
+    except KeyboardInterrupt:
+        results.close()
+        print("转换已中断!", file=sys.stderr)
+        return 130
+    if args.watch:
+        print("监视已结束", flush=True)
+    elif stop.requested:
+        print("转换已停止!", file=sys.stderr)
+    report.finish()
+
+    print("-" * 60)
+    print(f"转换完成! 格式: {format_label(settings.output_formats)}")
+    print(f"  转换: {stats.converted} | 复制: {stats.copied} | 跳过: {stats.skipped} | 未变: {stats.unchanged} | 错误: {stats.errors}")
+    if stats.original_size > 0:
+        print(f"  总大小: {stats.size_summary()}")
+    memory = stats.memory_summary()
+    if memory:
+        print(f"  峰值内存: {memory}")
+    if settings.target_rate or settings.deadline:
+        print(f"  编码强度: {report.effort_summary() or '-'}")
+    if settings.verify_prediction and report.predictions:
+        summary = report.prediction_summary()
+        print(f"  预测检验: {summary['files']} 个文件中 {summary['larger']} 个转换后不会变小")
+        for row in summary['thresholds']:
+            precision = f"{row['precision'] * 100:.0f}%" if row['precision'] is not None else '-'
+            recall = f"{row['recall'] * 100:.0f}%" if row['recall'] is not None else '-'
+            print(f"    阈值 {row['threshold']:.1f}: 预测 {row['predicted']} 个，正确 {row['correct']} 个 "
+                  f"(准确率 {precision}，召回率 {recall})")
+    timing = report.stage_summary()
+    if timing:
+        print(f"  耗时: {report.elapsed:.1f}s ({timing})")
+    if args.report:
+        report.write_json(args.report)
+        print(f"  运行报告: {args.report}")
+    if args.report_csv:
+        report.write_csv(args.report_csv)
+        print(f"  耗时明细: {args.report_csv}")
+    if stop.requested and not args.watch:
+        return 130
+    return 1 if stats.errors else 0
+
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    sys.exit(main())
@@ -0,0 +1,1630 @@
+"""图片转换核心 (WebP / AVIF)
+
+不依赖 tkinter，只导入 PIL；pillow_avif 仅在需要输出 AVIF 时才导入。
+图形界面 (img_to_webp_gui.py) 与命令行 (img_to_webp_cli.py) 都基于此模块。
+"""
+import io
+import os
+import errno
+import sys
+import queue
+import multiprocessing
+import shutil
+import signal
+import string
+import tempfile
+import threading
+import time
+import importlib.util
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from dataclasses import dataclass
+
+import PIL
+from PIL import Image
+
+from img_to_webp_dedup import ContentIndex, content_hash
+from img_to_webp_manifest import ConversionManifest
+from img_to_webp_report import StageTimer
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+# 是否可以输出 AVIF (只检查插件是否存在，不在启动时导入)
+AVIF_SUPPORTED = importlib.util.find_spec('pillow_avif') is not None
+
+# 支持的图片格式
+SUPPORTED_FORMATS = {'.jpg', '.jpeg', '.png', '.bmp', '.gif', '.tiff', '.tif', '.ico', '.ppm', '.pgm', '.pbm'}
+TARGET_FORMATS = {'.webp', '.avif'}
+
+# 编码强度: 0 最快 ~ 6 压缩最好，即 WebP 的 method；AVIF 的 speed 由下表换算
+MAX_EFFORT = 6
+AVIF_SPEED = {6: 6, 5: 7, 4: 8, 3: 8, 2: 9, 1: 10, 0: 10}
+# 小于此大小的文件编码很快，始终使用最高强度
+TINY_FILE_SIZE = 100 * 1024
+# 动画 WebP 的最高 method: 更高的强度逐帧编码慢数倍，体积几乎不变
+ANIMATION_WEBP_EFFORT = 4
+# 逐帧编码动画 (AnimationFrames) 需要的最低 Pillow 版本，更低的版本只转换第一帧
+ANIMATION_MIN_PILLOW = (10, 1)
+ANIMATION_SUPPORTED = tuple(int(part) for part in PIL.__version__.split('.')[:2]) >= ANIMATION_MIN_PILLOW
+
+
+@dataclass
+class ConvertSettings:
+    """转换设置"""
+    output_formats: tuple = ("webp",)  # 输出格式，"webp" 和/或 "avif"
+    widths: tuple = ()  # 响应式输出宽度 (像素)，为空时只输出原始尺寸
+    name_template: str = ""  # 输出文件命名规则，为空时使用 default_name_template()
+    quality: int = 85
+    lossless: bool = False
+    recursive: bool = True
+    keep_structure: bool = False
+    skip_larger: bool = True
+    resize_large: bool = False
+    max_size: int = 3840  # 缩小大图片时的最大边长 (默认 4K)
+    workers: int = 1
+    memory_budget: int = 0  # 并行解码的内存预算 (MB)，0 表示不限制
+    incremental: bool = True  # 根据输出目录中的转换清单跳过未变化的文件
+    profile_dir: str = ""  # 保存 cProfile 采样结果的目录，为空时不采样
+    profile_every: int = 20  # 每多少个转换任务采样一个
+    target_rate: float = 0  # 目标速度 (张/秒)，0 表示始终使用最高编码强度
+    deadline: float = 0  # 完成期限 (time.time() 时间戳)，0 表示没有期限
+    predict_threshold: float = 0  # 预测转换后不会变小的置信度阈值 (0 ~ 1)，0 表示关闭预测
+    verify_prediction: bool = False  # 只记录预测结果，仍然编码所有文件，用于检验预测准确率
+    dedup: str = "link"  # 内容相同的源文件只编码一次: "link" 硬链接输出 / "copy" 复制输出 / "off" 关闭
+    passthrough: str = "auto"  # 原样复制文件的方式，见 PASSTHROUGH_STRATEGIES
+
+
+# 单个文件的转换任务 (只包含可 pickle 的基本类型，可直接发送到子进程)
+# targets: ((格式, 宽度或 None, 输出路径), ...)，按宽度从大到小排列，None 表示原始尺寸
+# output_path: 已是目标格式时直接复制的路径；fallback_path: 转换后变大时复制原文件的路径
+# profile_path: 不为 None 时用 cProfile 分析该任务，结果保存到此路径
+# effort: 编码强度 (0 ~ MAX_EFFORT)
+# predict_threshold / verify_prediction / passthrough: 见 ConvertSettings
+# data: 源文件内容 (压缩包中的成员)，为 None 时从 filepath 读取
+# hash_content: 转换前分块计算源文件内容的哈希，随结果返回 (用于内容去重，只用于需要编码的文件)
+ConvertJob = namedtuple('ConvertJob', [
+    'filepath', 'filename', 'out_dir', 'targets', 'output_path', 'fallback_path',
+    'quality', 'lossless', 'skip_larger', 'resize_large', 'max_size',
+    'previous_outputs', 'mem_cost', 'profile_path', 'effort',
+    'predict_threshold', 'verify_prediction', 'passthrough', 'data', 'hash_content',
+], defaults=(None, MAX_EFFORT, 0, False, "auto", None, False))
+
+# 文件扫描暂时没有新文件时产生的占位值，经任务迭代器原样传给执行引擎，
+# 引擎借此在等待扫描期间返回已完成的结果并检查停止请求
+WAITING = object()
+
+# 扫描到的源文件 (大小和修改时间来自 DirEntry 的 stat 缓存)
+SourceFile = namedtuple('SourceFile', ['filepath', 'filename', 'rel_path', 'size', 'mtime_ns'])
+
+# 单个输出文件
+# status: 'convert' (已写入) / 'skip' (比原文件大，path 为复制的原文件) / 'copy'
+OutputFile = namedtuple('OutputFile', ['path', 'format', 'width', 'size', 'status'])
+
+# 单个文件的转换结果，output_path / output_name 为第一个输出文件
+# status: 'convert' / 'copy' / 'skip' / 'unchanged' / 'error'
+# reason: 复制、跳过或出错的原因 ('target_format' / 'larger' / 'predicted' / 'unchanged' /
+#     'duplicate' 沿用了相同内容文件的输出 / 异常类型名)
+# metrics: 各阶段耗时和读写字节数 (FileMetrics)，未转换的文件为 None
+# effort: 编码时使用的强度，没有编码的文件为 None
+# prediction: 预测转换后不会变小的置信度 (0 ~ 1)，未预测时为 None
+# frames: 动画的帧数，静态图像为 None
+# new_size: 转换的文件为主输出 (第一个输出，即最大宽度的第一种格式) 的大小，主输出变大时为原文件大小；
+#     跳过的文件为主输出编码后的大小。多种格式和宽度的输出不相加，与原文件大小可以直接比较
+# content_hash: 源文件内容的哈希，只在 job.hash_content 时计算
+ConvertResult = namedtuple('ConvertResult', [
+    'status', 'filepath', 'filename', 'output_path', 'output_name',
+    'original_size', 'new_size', 'resized', 'error', 'outputs', 'peak_rss',
+    'reason', 'metrics', 'effort', 'prediction', 'frames', 'content_hash',
+], defaults=((), None, None, None, None, None, None, None))
+
+
+def parse_formats(text):
+    """解析以逗号分隔的输出格式，如 webp,avif"""
+    formats = []
+    for part in text.split(','):
+        fmt = part.strip().lower()
+        if not fmt:
+            continue
+        if f".{fmt}" not in TARGET_FORMATS:
+            raise ValueError(f"不支持的输出格式: {fmt}")
+        if fmt not in formats:
+            formats.append(fmt)
+    if not formats:
+        raise ValueError("至少需要一种输出格式")
+    return tuple(formats)
+
+
+def parse_widths(text):
+    """解析以逗号分隔的输出宽度，如 320,640,1280；为空时只输出原始尺寸"""
+    widths = set()
+    for part in text.replace('，', ',').split(','):
+        part = part.strip()
+        if not part:
+            continue
+        if not part.isdigit() or int(part) <= 0:
+            raise ValueError(f"无效的宽度: {part}")
+        widths.add(int(part))
+    return tuple(sorted(widths))
+
+
+def parse_deadline(text, now=None):
+    """解析完成期限，返回 time.time() 时间戳
+
+    可以是时长 (600、90s、30m、2h) 或时刻 (18:30，已过时表示第二天)。
+    """
+    now = time.time() if now is None else now
+    text = text.strip().lower()
+    if ':' in text:
+        try:
+            hour, minute = (int(part) for part in text.split(':'))
+        except ValueError:
+            raise ValueError(f"无效的完成期限: {text}")
+        if not (0 <= hour < 24 and 0 <= minute < 60):
+            raise ValueError(f"无效的完成期限: {text}")
+        local = time.localtime(now)
+        deadline = time.mktime((local.tm_year, local.tm_mon, local.tm_mday, hour, minute, 0, 0, 0, -1))
+        return deadline if deadline > now else deadline + 24 * 3600
+    units = {'s': 1, 'm': 60, 'h': 3600}
+    scale = units.get(text[-1:], None)
+    number = text[:-1] if scale else text
+    try:
+        seconds = float(number) * (scale or 1)
+    except ValueError:
+        raise ValueError(f"无效的完成期限: {text}")
+    if seconds <= 0:
+        raise ValueError(f"无效的完成期限: {text}")
+    return now + seconds
+
+
+def default_name_template(widths):
+    """默认的输出文件命名规则: {name} 原文件名，{width} 输出宽度，{ext} 输出格式"""
+    return "{name}-{width}w.{ext}" if widths else "{name}.{ext}"
+
+
+NAME_TEMPLATE_FIELDS = ('name', 'width', 'ext')
+
+
+def check_name_template(template, widths, output_formats):
+    """检查输出文件命名规则，返回去掉首尾空白的规则；为空表示使用默认规则
+
+    只能是文件名 (不能包含目录)；只能使用 {name}、{width}、{ext}，且必须包含 {name}；
+    有多个宽度时必须包含 {width}，有多个输出格式时必须包含 {ext}，
+    否则同一个源文件的多个输出只能靠 _1、_2 后缀区分。
+    """
+    template = template.strip()
+    if not template:
+        return template
+    # 输出文件只能在输出目录 (或保持结构时的对应子目录) 中，不能指定其他目录
+    if '/' in template or '\\' in template or '..' in template or os.path.splitdrive(template)[0]:
+        raise ValueError("命名规则只能是文件名，不能包含路径分隔符 (/ \\)、.. 或盘符")
+    try:
+        fields = {field for _, field, _, _ in string.Formatter().parse(template) if field is not None}
+    except ValueError as e:
+        raise ValueError(f"无效的命名规则 {template}: {e}") from None
+    unknown = sorted(fields - set(NAME_TEMPLATE_FIELDS))
+    if unknown:
+        names = "、".join(f"{{{field}}}" for field in unknown)
+        raise ValueError(f"命名规则中有未知的字段 {names}，只能使用 {{name}}、{{width}}、{{ext}}")
+    if 'name' not in fields:
+        raise ValueError("命名规则中必须包含 {name}")
+    if len(widths) > 1 and 'width' not in fields:
+        raise ValueError("指定了多个宽度时，命名规则中必须包含 {width}")
+    if len(output_formats) > 1 and 'ext' not in fields:
+        raise ValueError("指定了多种输出格式时，命名规则中必须包含 {ext}")
+    try:
+        # 格式说明 (如 {width:05d}) 要对实际使用的值都有效，未指定宽度时 width 为空字符串
+        for width in widths or ('',):
+            template.format(name='name', width=width, ext='webp')
+    except (ValueError, TypeError) as e:
+        raise ValueError(f"无效的命名规则 {template}: {e}") from None
+    return template
+
+
+def format_label(output_formats):
+    return "+".join(fmt.upper() for fmt in output_formats)
+
+
+def format_size(size):
+    """格式化文件大小"""
+    for unit in ['B', 'KB', 'MB', 'GB']:
+        if size < 1024:
+            return f"{size:.1f}{unit}"
+        size /= 1024
+    return f"{size:.1f}TB"
+
+
+class OutputNameRegistry:
+    """输出文件名登记表，为每个输出文件分配唯一的文件名
+
+    每个输出目录第一次使用时用一次 scandir 读取已有文件名，之后在内存中
+    分配 name、name_1、name_2 ...，不再逐个探测文件是否存在。
+    文件名在创建任务时按扫描顺序分配，与哪个文件先转换完成无关。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._dirs = {}  # 目录 -> (已占用的文件名集合, 文件名 -> 下一个编号)
+
+    def _load(self, out_dir):
+        entry = self._dirs.get(out_dir)
+        if entry is None:
+            names = set()
+            try:
+                with os.scandir(out_dir) as it:
+                    names.update(os.path.normcase(e.name) for e in it)
+            except OSError:
+                pass
+            entry = self._dirs[out_dir] = (names, {})
+        return entry
+
+    def reserve(self, out_dir, filename, reuse=()):
+        """在 out_dir 中登记 filename，返回唯一的输出路径
+
+        reuse: 允许再次使用的路径列表 (同一源文件上次的输出)
+        """
+        path = os.path.join(out_dir, filename)
+        base, ext = os.path.splitext(filename)
+        with self._lock:
+            names, counters = self._load(out_dir)
+            key = os.path.normcase(filename)
+            if key not in names:
+                names.add(key)
+                return path
+
+            # 上次分配给同一源文件的 name 或 name_N 可以直接沿用
+            for previous in reuse:
+                if os.path.normpath(os.path.dirname(previous)) != os.path.normpath(out_dir):
+                    continue
+                reuse_name = os.path.basename(previous)
+                reuse_base, reuse_ext = os.path.splitext(reuse_name)
+                suffix = reuse_base[len(base):]
+                if (os.path.normcase(reuse_ext) == os.path.normcase(ext)
+                        and os.path.normcase(reuse_base[:len(base)]) == os.path.normcase(base)
+                        and (suffix == '' or (suffix[:1] == '_' and suffix[1:].isdigit()))):
+                    names.add(os.path.normcase(reuse_name))
+                    return previous
+
+            counter = counters.get(key, 1)
+            while os.path.normcase(f"{base}_{counter}{ext}") in names:
+                counter += 1
+            counters[key] = counter + 1
+            unique = f"{base}_{counter}{ext}"
+            names.add(os.path.normcase(unique))
+            return os.path.join(out_dir, unique)
+
+
+def peak_rss():
+    """当前进程的峰值内存占用 (字节)，无法获取时返回 None"""
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux 上单位为 KB，macOS 上为字节
+        return peak if sys.platform == 'darwin' else peak * 1024
+    try:
+        import psutil
+    except ImportError:
+        return None
+    info = psutil.Process().memory_info()
+    return getattr(info, 'peak_wset', info.rss)
+
+
+# 每个像素在内存中占用的字节数 (Pillow 中多通道图像按 4 字节存储)
+_MODE_BYTES = {'1': 1, 'L': 1, 'P': 1, 'I;16': 2, 'I;16B': 2, 'I;16L': 2, 'I': 4, 'F': 4}
+
+
+def estimate_memory(filepath, max_size=None):
+    """根据文件头估算转换单个文件所需的内存 (字节)
+
+    Image.open 只读取文件头，不会解码像素数据。
+    """
+    try:
+        with Image.open(filepath) as img:
+            width, height = img.size
+            mode = img.mode
+            if max_size and img.format == 'JPEG' and (width > max_size or height > max_size):
+                # 与 open_image 一致: draft 最多缩小到 1/8，且不小于目标尺寸
+                ratio = min(max_size / width, max_size / height)
+                target_w, target_h = int(width * ratio), int(height * ratio)
+                scale = 1
+                while scale < 8 and width // (scale * 2) >= target_w and height // (scale * 2) >= target_h:
+                    scale *= 2
+                width, height = width // scale, height // scale
+    except Exception:
+        return 0
+    pixels = width * height
+    # 解码后的图像 + 模式转换和编码时的 RGB(A) 工作副本
+    return pixels * _MODE_BYTES.get(mode, 4) + pixels * 4 * 2
+
+
+# 新建文件的默认权限 (mkstemp 创建的临时文件只有属主可读写)
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+FILE_MODE = 0o666 & ~_UMASK
+
+
+def temp_path(path):
+    """在目标目录中创建临时文件，返回 (文件描述符, 路径)"""
+    directory, name = os.path.split(path)
+    return tempfile.mkstemp(prefix=f".{name}.", suffix='.tmp', dir=directory)
+
+
+def atomic_write(path, data):
+    """先写入同目录下的临时文件再重命名，中途出错不会留下写了一半的文件"""
+    fd, tmp_path = temp_path(path)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.chmod(tmp_path, FILE_MODE)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+# 原样复制文件的方式，按优先顺序尝试，不支持时换下一种:
+#   hardlink: 硬链接，不复制任何数据，但输出与源文件是同一个文件 (修改其一另一个也会变)，只在明确指定时使用
+#   reflink: 写时复制克隆 (btrfs / xfs 等的 FICLONE)，瞬间完成且互不影响
+#   copy_range / sendfile: 在内核中复制数据，不经过用户空间
+#   copy: shutil.copy2
+PASSTHROUGH_STRATEGIES = ('auto', 'hardlink', 'reflink', 'copy_range', 'sendfile', 'copy')
+_PASSTHROUGH_AUTO = ('reflink', 'copy_range', 'sendfile', 'copy')
+
+# Linux 的 FICLONE ioctl
+_FICLONE = 0x40049409
+# 表示当前文件系统 (或源和目标之间) 不支持某种方式的错误
+_UNSUPPORTED_ERRNOS = {errno.EXDEV, errno.EOPNOTSUPP, errno.ENOTSUP, errno.EINVAL, errno.ENOSYS,
+                       errno.EPERM, errno.EMLINK, errno.ENOTTY, errno.EBADF}
+# (源文件设备, 目标目录设备) -> 已确认不支持的方式 (每个进程各自记录)
+_passthrough_unsupported = {}
+
+
+def _copy_reflink(src_fd, dst_fd):
+    if fcntl is None or not sys.platform.startswith('linux'):
+        raise OSError(errno.ENOTSUP, "reflink 不可用")
+    fcntl.ioctl(dst_fd, _FICLONE, src_fd)
+
+
+def _check_copied(src_fd, copied, method):
+    # 有的文件系统 (部分 FUSE、NFS、procfs 等) 上返回 0 而不报错，复制的字节数必须与源文件大小一致，
+    # 否则换下一种方式 (与 shutil 的做法相同)
+    if copied != os.fstat(src_fd).st_size:
+        raise OSError(errno.ENOTSUP, f"{method} 没有复制完整个文件")
+
+
+def _copy_range(src_fd, dst_fd):
+    if not hasattr(os, 'copy_file_range'):
+        raise OSError(errno.ENOSYS, "copy_file_range 不可用")
+    copied = 0
+    while True:
+        n = os.copy_file_range(src_fd, dst_fd, 1 << 30)
+        if not n:
+            break
+        copied += n
+    _check_copied(src_fd, copied, 'copy_file_range')
+
+
+def _copy_sendfile(src_fd, dst_fd):
+    if not hasattr(os, 'sendfile') or not sys.platform.startswith('linux'):
+        raise OSError(errno.ENOSYS, "sendfile 不可用")
+    offset = 0
+    while True:
+        sent = os.sendfile(dst_fd, src_fd, offset, 1 << 30)
+        if not sent:
+            break
+        offset += sent
+    _check_copied(src_fd, offset, 'sendfile')
+
+
+_PASSTHROUGH_COPIERS = {'reflink': _copy_reflink, 'copy_range': _copy_range, 'sendfile': _copy_sendfile}
+
+
+def atomic_copy(src, dst, strategy='auto'):
+    """以临时文件 + 重命名的方式原样复制文件 (保留修改时间等元数据)，返回实际使用的方式
+
+    strategy: PASSTHROUGH_STRATEGIES 之一。指定的方式不可用时依次尝试 auto 的顺序；
+    某种方式在源和目标设备之间失败一次后，本进程内不再尝试。
+    """
+    if strategy == 'auto':
+        methods = _PASSTHROUGH_AUTO
+    else:
+        methods = (strategy,) + tuple(method for method in _PASSTHROUGH_AUTO if method != strategy)
+    try:
+        pair = (os.stat(src).st_dev, os.stat(os.path.dirname(dst) or '.').st_dev)
+    except OSError:
+        pair = None
+    unsupported = _passthrough_unsupported.setdefault(pair, set())
+
+    for method in methods:
+        if method in unsupported:
+            continue
+        fd, tmp_path = temp_path(dst)
+        try:
+            if method == 'copy':
+                os.close(fd)
+                shutil.copy2(src, tmp_path)
+            elif method == 'hardlink':
+                os.close(fd)
+                os.remove(tmp_path)
+                os.link(src, tmp_path)
+            else:
+                try:
+                    with open(src, 'rb') as f:
+                        _PASSTHROUGH_COPIERS[method](f.fileno(), fd)
+                finally:
+                    os.close(fd)
+                shutil.copystat(src, tmp_path)
+            os.replace(tmp_path, dst)
+            return method
+        except OSError as e:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            if method == 'copy' or e.errno not in _UNSUPPORTED_ERRNOS:
+                raise
+            unsupported.add(method)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+
+def _load_avif():
+    """按需导入 AVIF 插件 (注册 AVIF 编码器)"""
+    import pillow_avif  # noqa: F401
+
+
+def downscale(img, size):
+    """高质量缩小: 先用 reduce() 按 2 的幂快速缩小 (保留至少 2 倍余量)，再用 LANCZOS 精确缩放"""
+    if img.mode in ('1', 'P'):
+        # 调色板图像无法插值缩放，Pillow 对这类图像同样使用 NEAREST
+        return img.resize(size, Image.Resampling.NEAREST)
+
+    factor = min(img.width // size[0], img.height // size[1]) // 2
+    if factor >= 2:
+        factor = 1 << (factor.bit_length() - 1)
+        img = img.reduce(factor)
+    if img.size != size:
+        img = img.resize(size, Image.Resampling.LANCZOS)
+    return img
+
+
+def open_image(filepath, max_size=None, max_width=None):
+    """打开图片并按需缩小，返回 (图片, 缩小后的尺寸或 None)
+
+    max_size 限制最长边，max_width 限制宽度 (只需要较小的输出时)。
+    JPEG 通过 draft() 在 DCT 阶段直接以 1/2、1/4、1/8 分辨率解码，
+    大图不会以原始分辨率载入内存，之后再用 downscale() 缩放到目标尺寸。
+    """
+    img = Image.open(filepath)
+    if is_animation(img):
+        # 动画由 AnimationFrames 逐帧缩放
+        return img, None
+    ratio = 1.0
+    if max_size:
+        ratio = min(ratio, max_size / img.width, max_size / img.height)
+    if max_width:
+        ratio = min(ratio, max_width / img.width)
+    if ratio >= 1.0:
+        return img, None
+
+    target = (max(1, int(img.width * ratio)), max(1, int(img.height * ratio)))
+
+    # 只读取文件头时即可设置，解码尺寸不会小于 target
+    img.draft(None, target)
+    return downscale(img, target), target
+
+
+# libjpeg 标准亮度量化表 (质量 50)
+_JPEG_LUMA_TABLE = (
+    16, 11, 10, 16, 24, 40, 51, 61, 12, 12, 14, 19, 26, 58, 60, 55,
+    14, 13, 16, 24, 40, 57, 69, 56, 14, 17, 22, 29, 51, 87, 80, 62,
+    18, 22, 37, 56, 68, 109, 103, 77, 24, 35, 55, 64, 81, 104, 113, 92,
+    49, 64, 78, 87, 103, 121, 120, 101, 72, 92, 95, 98, 112, 100, 103, 99,
+)
+
+
+def jpeg_quality(img):
+    """根据亮度量化表估算 JPEG 的保存质量 (1-100)，无法估算时返回 None"""
+    tables = getattr(img, 'quantization', None)
+    if not tables or 0 not in tables:
+        return None
+    scale = sum(tables[0]) * 100 / sum(_JPEG_LUMA_TABLE)
+    quality = (200 - scale) / 2 if scale <= 100 else 5000 / scale
+    return max(1, min(100, round(quality)))
+
+
+# 小于此大小的 JPEG 不根据量化表预测
+SMALL_JPEG_SIZE = 2048
+
+
+def predict_larger(filepath, file_size, targets, quality, lossless):
+    """只根据文件头预测转换后是否不会变小，返回置信度 (0 ~ 1)
+
+    依据: 有损源文件的无损输出、1 位图像、JPEG 的量化表
+    (目标质量高于原图质量时重新编码通常更大)、每像素字节数和调色板大小。
+    需要缩小的输出不做预测。
+    """
+    with Image.open(filepath) as img:
+        width, height = img.size
+        if any(width_ and width_ < width for _, width_, _ in targets):
+            return 0.0
+        pixels = max(1, width * height)
+        bpp = file_size * 8 / pixels  # 每像素位数
+        score = 0.0
+
+        if img.format == 'JPEG':
+            if lossless:
+                # 有损图像无损重新编码几乎总是更大
+                return 0.95
+            source_quality = jpeg_quality(img)
+            # 很小的 JPEG 中量化表和哈夫曼表 (约 600 字节) 占了大部分，重新编码几乎总会变小
+            if source_quality is not None and file_size >= SMALL_JPEG_SIZE:
+                if quality >= source_quality + 10:
+                    score = max(score, 0.85)
+                elif quality >= source_quality and bpp < 0.6:
+                    score = max(score, 0.7)
+
+        if img.mode == '1':
+            # 扫描件等二值图像在 PNG / TIFF G4 中压缩得非常好
+            score = max(score, 0.9)
+        elif img.mode == 'P' and not lossless and img.palette is not None:
+            colors = len(img.palette.palette) // max(1, len(img.palette.mode))
+            if colors <= 16 and bpp < 1.0:
+                score = max(score, 0.8)
+
+        # 文件大小和像素数本身不作为依据: WebP 的文件头只有几十字节，
+        # 用 --verify-prediction 检验时极小的 JPEG / GIF / PNG 大多仍会变小
+        if not lossless and quality >= 85 and bpp < 0.3 and pixels > 32 * 32:
+            score = max(score, 0.6)
+    return score
+
+
+def normalize_mode(img):
+    """把图像转换为编码器适合的 RGB / RGBA 模式"""
+    # 处理不同的图像模式
+    if img.mode == 'P':
+        if 'transparency' in img.info:
+            img = img.convert('RGBA')
+        else:
+            img = img.convert('RGB')
+    elif img.mode == 'LA':
+        img = img.convert('RGBA')
+    elif img.mode not in ('RGB', 'RGBA'):
+        img = img.convert('RGB')
+
+    # 如果没有透明通道，转为RGB可以更好压缩
+    if img.mode == 'RGBA':
+        extrema = img.getextrema()
+        if len(extrema) >= 4 and extrema[3][0] == 255:
+            img = img.convert('RGB')
+    return img
+
+
+def encode_image(img, output_format, quality, lossless, effort=MAX_EFFORT):
+    """把图像编码到内存中，返回 BytesIO
+
+    effort: 编码强度，0 最快，MAX_EFFORT 压缩最好
+    """
+    buffer = io.BytesIO()
+    if output_format == "webp":
+        if lossless:
+            img.save(buffer, 'WEBP', lossless=True, quality=100, method=effort)
+        else:
+            img.save(buffer, 'WEBP', quality=quality, method=effort)
+    else:  # AVIF
+        _load_avif()
+        speed = AVIF_SPEED[effort]
+        if lossless:
+            # AVIF 无损
+            img.save(buffer, 'AVIF', quality=100, speed=speed)
+        else:
+            # AVIF 有损 - speed 越低压缩越好但越慢
+            img.save(buffer, 'AVIF', quality=quality, speed=speed)
+    return buffer
+
+
+def is_animation(img):
+    """是否为需要输出动画的 GIF / APNG (多页 TIFF 等仍只转换第一页)
+
+    Pillow 低于 ANIMATION_MIN_PILLOW 时不支持逐帧编码，动画只转换第一帧。
+    """
+    return ANIMATION_SUPPORTED and img.format in ('GIF', 'PNG') and getattr(img, 'is_animated', False)
+
+
+def scan_animation(img):
+    """逐帧读取动画的时长 (毫秒) 列表，并判断是否有任何一帧带透明
+
+    只解码，不做模式转换和缩放；读取后回到第一帧。
+    """
+    durations = []
+    transparent = False
+    for frame in range(img.n_frames):
+        img.seek(frame)
+        img.load()  # GIF 的帧模式在解码合成后才确定
+        durations.append(img.info.get('duration', 0))
+        transparent = transparent or 'transparency' in img.info or img.mode in ('RGBA', 'LA', 'PA')
+    img.seek(0)
+    return durations, transparent
+
+
+class AnimationFrames(Image.Image):
+    """逐帧读取的动画，作为 save(save_all=True) 的图像交给 WebP / AVIF 编码器
+
+    编码器逐帧 seek() 读取，每次只解码一帧并完成模式转换和缩放，内存中只有当前帧
+    (以及 GIF 解码器合成下一帧所需的上一帧)，与帧数无关。GIF 的处置方式 (disposal) 在
+    解码合成时已经生效，编码器再按相邻帧的差异只编码变化的区域。
+    Pillow 的编码器会把 append_images 整个转换为列表，所以不使用 append_images，
+    而是替换当前帧的图像数据 (im / _mode / _size)，需要 Pillow >= ANIMATION_MIN_PILLOW。
+
+    durations / transparent: scan_animation() 的结果；有任何一帧带透明时整个动画输出透明通道
+    """
+
+    def __init__(self, source, durations, transparent, size=None):
+        super().__init__()
+        self.source = source
+        self.n_frames = source.n_frames
+        self.is_animated = True
+        self.durations = durations
+        self._target = size if size != source.size else None
+        self._rgba = transparent
+        self._frame = None
+        self.seek(0)
+
+    @property
+    def loop(self):
+        """循环次数 (0 为无限循环)；GIF 没有 NETSCAPE 扩展时只播放一次"""
+        return self.source.info.get('loop', 1)
+
+    def seek(self, frame):
+        if frame == self._frame:
+            return
+        self.source.seek(frame)
+        img = self.source.convert('RGBA' if self._rgba else 'RGB')
+        if self._target:
+            img = downscale(img, self._target)
+        self.im = img.im
+        self._mode = img.mode
+        self._size = img.size
+        self._frame = frame
+
+    def tell(self):
+        return self._frame
+
+
+def encode_animation(frames, output_format, quality, lossless, effort=MAX_EFFORT):
+    """把 AnimationFrames 编码为动画 WebP / AVIF，返回 BytesIO"""
+    buffer = io.BytesIO()
+    if output_format == "webp":
+        # allow_mixed: 有损输出时由编码器逐帧选择有损或无损 (GIF 的色块用无损往往更小)
+        frames.save(buffer, 'WEBP', save_all=True, duration=frames.durations, loop=frames.loop,
+                    background=(0, 0, 0, 0), quality=100 if lossless else quality,
+                    lossless=lossless, allow_mixed=not lossless,
+                    method=min(effort, ANIMATION_WEBP_EFFORT))
+    else:  # AVIF (插件不支持循环次数，总是循环播放)
+        _load_avif()
+        frames.save(buffer, 'AVIF', save_all=True, duration=frames.durations,
+                    quality=100 if lossless else quality, speed=AVIF_SPEED[effort])
+    return buffer
+
+
+class FileSink:
+    """转换的输入和输出: 从 job.filepath 读取源文件，输出写入磁盘
+
+    其他输出方式 (如写入压缩包的 img_to_webp_archive.MemorySink) 实现相同的方法。
+    """
+
+    def __init__(self, job):
+        self.job = job
+        self.digest = None  # 源文件内容的哈希 (job.hash_content 时)
+
+    def open(self):
+        """源文件 (路径或文件对象)，每次调用从头读取"""
+        return self.job.filepath
+
+    def prepare(self):
+        """返回源文件大小，并准备好输出目录
+
+        需要内容哈希时分块读取计算，不在内存中保留源文件内容；解码时再从页缓存读取。
+        """
+        if self.job.hash_content:
+            self.digest = content_hash(self.job.filepath)
+        size = os.path.getsize(self.job.filepath)
+        if not os.path.exists(self.job.out_dir):
+            os.makedirs(self.job.out_dir, exist_ok=True)
+        return size
+
+    def copy(self, path):
+        """原样输出源文件，返回实际使用的复制方式"""
+        return atomic_copy(self.job.filepath, path, self.job.passthrough)
+
+    def write(self, path, data):
+        atomic_write(path, data)
+
+    def finish(self, outputs):
+        _remove_stale(self.job, outputs)
+
+
+def convert_file(job, sink=None):
+    """转换单个文件 (可在工作进程中运行)
+
+    结果附带各阶段耗时；在工作进程中时还附带该进程的峰值内存。
+    sink: 输入和输出方式，默认为 FileSink
+    """
+    timer = StageTimer()
+    if sink is None:
+        sink = FileSink(job)
+    if job.profile_path:
+        result = _profile(job, timer, sink)
+    else:
+        result = _convert_file(job, timer, sink)
+    result = result._replace(metrics=timer.metrics(), effort=job.effort if job.targets else None)
+    if result.status != 'error':
+        result = result._replace(content_hash=sink.digest)
+    if multiprocessing.parent_process() is not None:
+        result = result._replace(peak_rss=peak_rss())
+    return result
+
+
+def _profile(job, timer, sink):
+    """用 cProfile 分析单个任务，结果保存到 job.profile_path (可用 pstats 或 snakeviz 查看)"""
+    import cProfile
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        return _convert_file(job, timer, sink)
+    finally:
+        profiler.disable()
+        try:
+            profiler.dump_stats(job.profile_path)
+        except OSError:
+            pass
+
+
+def _convert_file(job, timer, sink):
+    filename = job.filename
+    ext = os.path.splitext(filename)[1]
+    original_size = 0
+
+    try:
+        original_size = sink.prepare()
+
+        # 已经是目标格式 (或另一种目标格式)，直接复制
+        if ext.lower() in TARGET_FORMATS:
+            with timer.stage('copy') as stage:
+                stage.variant = sink.copy(job.output_path)
+            timer.bytes_read += original_size
+            timer.bytes_written += original_size
+            outputs = [OutputFile(job.output_path, None, None, original_size, 'copy')]
+            sink.finish(outputs)
+            return _result('copy', job, outputs, original_size, original_size, reason='target_format')
+
+        # 根据文件头预测转换后不会变小的文件，直接复制原文件，省去解码和编码
+        prediction = None
+        if job.skip_larger and (job.predict_threshold or job.verify_prediction):
+            with timer.stage('predict'):
+                prediction = predict_larger(sink.open(), original_size, job.targets, job.quality, job.lossless)
+            if (job.predict_threshold and prediction >= job.predict_threshold
+                    and not job.verify_prediction):
+                with timer.stage('copy') as stage:
+                    stage.variant = sink.copy(job.fallback_path)
+                timer.bytes_read += original_size
+                timer.bytes_written += original_size
+                outputs = [OutputFile(job.fallback_path, output_format, width, original_size, 'skip')
+                           for output_format, width, _ in job.targets]
+                sink.finish(outputs)
+                return _result('skip', job, outputs, original_size, original_size,
+                               reason='predicted', prediction=prediction)
+
+        # 每个源文件只解码一次；只需要较小的宽度时直接按最大宽度解码
+        widths = [width for _, width, _ in job.targets]
+        max_width = None if None in widths else max(widths)
+        with timer.stage('decode'):
+            img, resized = open_image(sink.open(), job.max_size if job.resize_large else None, max_width)
+            img.load()
+        timer.bytes_read += original_size
+        frames = None
+        if is_animation(img):
+            frames = img.n_frames
+            encoded, resized = _encode_animation(job, timer, img)
+        else:
+            with timer.stage('normalize'):
+                img = normalize_mode(img)
+            encoded = _encode_levels(job, timer, img)
+
+        outputs = []
+        written = 0
+        fallback_written = False
+        for output_format, width, output_path, buffer in encoded:
+            new_size = buffer.tell()
+
+            # 检查是否变大了
+            if job.skip_larger and new_size >= original_size:
+                # 复制原文件 (多个输出都变大时只复制一次)
+                if not fallback_written:
+                    with timer.stage('copy') as stage:
+                        stage.variant = sink.copy(job.fallback_path)
+                    fallback_written = True
+                    written += original_size
+                outputs.append(OutputFile(job.fallback_path, output_format, width, new_size, 'skip'))
+            else:
+                with timer.stage('write', output_format):
+                    sink.write(output_path, buffer.getbuffer())
+                written += new_size
+                outputs.append(OutputFile(output_path, output_format, width, new_size, 'convert'))
+        img.close()
+        timer.bytes_written += written
+
+        sink.finish(outputs)
+        if any(output.status == 'convert' for output in outputs):
+            return _result('convert', job, outputs, original_size, primary_size(outputs, original_size),
+                           resized, prediction=prediction, frames=frames)
+        return _result('skip', job, outputs, original_size, outputs[0].size, resized,
+                       reason='larger', prediction=prediction, frames=frames)
+
+    except Exception as e:
+        return ConvertResult('error', job.filepath, filename, None, None, original_size, 0, None, str(e),
+                             reason=type(e).__name__)
+
+
+def _encode_levels(job, timer, img):
+    """静态图像: 按宽度从大到小逐个编码到内存中，产生 (格式, 宽度, 输出路径, BytesIO)
+
+    每一级由上一级缩小得到。
+    """
+    base_width, base_height = img.size
+    level = img
+    for output_format, width, output_path in job.targets:
+        if width and width < level.width:
+            with timer.stage('resize'):
+                level = downscale(level, (width, max(1, round(base_height * width / base_width))))
+        with timer.stage('encode', output_format):
+            buffer = encode_image(level, output_format, job.quality, job.lossless, job.effort)
+        yield output_format, width, output_path, buffer
+
+
+def _encode_animation(job, timer, img):
+    """动画: 每个输出重新逐帧解码和缩放，返回 (同 _encode_levels 的生成器, 缩小后的尺寸或 None)
+
+    先扫描一遍帧时长和透明信息 (计入解码阶段)；编码时的逐帧解码在编码器内部进行，计入编码阶段的耗时。
+    """
+    base_width, base_height = img.size
+    ratio = 1.0
+    if job.resize_large:
+        ratio = min(ratio, job.max_size / base_width, job.max_size / base_height)
+    sizes = []
+    for _, width, _ in job.targets:
+        scale = min(ratio, width / base_width) if width else ratio
+        sizes.append((max(1, round(base_width * scale)), max(1, round(base_height * scale))))
+    resized = sizes[0] if sizes[0] != img.size else None
+    # 所有输出共用一次扫描得到的帧时长和透明信息
+    with timer.stage('decode'):
+        durations, transparent = scan_animation(img)
+
+    def encoded():
+        for (output_format, width, output_path), size in zip(job.targets, sizes):
+            with timer.stage('encode', output_format):
+                buffer = encode_animation(AnimationFrames(img, durations, transparent, size), output_format,
+                                          job.quality, job.lossless, job.effort)
+            yield output_format, width, output_path, buffer
+
+    return encoded(), resized
+
+
+def primary_size(outputs, original_size):
+    """主输出 (第一个输出) 的大小，主输出变大而保留了原文件时为原文件大小"""
+    first = outputs[0]
+    return first.size if first.status == 'convert' else original_size
+
+
+def _result(status, job, outputs, original_size, new_size, resized=None, reason=None, prediction=None,
+            frames=None):
+    output_path = outputs[0].path
+    return ConvertResult(status, job.filepath, job.filename, output_path, os.path.basename(output_path),
+                         original_size, new_size, resized, None, tuple(outputs),
+                         reason=reason, prediction=prediction, frames=frames)
+
+
+def reuse_outputs(job, status, donor_outputs, link=True):
+    """相同内容的文件已经转换过: 链接或复制它的输出，不再解码和编码
+
+    status / donor_outputs: 该内容的转换状态和输出文件 (OutputFile 序列)
+    link: 优先硬链接 (输出之间共享，不影响源文件)，否则按 job.passthrough 复制
+    """
+    original_size = 0
+    strategy = 'hardlink' if link else job.passthrough
+
+    def put(src, dst):
+        if os.path.normcase(os.path.abspath(src)) != os.path.normcase(os.path.abspath(dst)):
+            atomic_copy(src, dst, strategy)
+
+    try:
+        original_size = os.path.getsize(job.filepath)
+        if not os.path.exists(job.out_dir):
+            os.makedirs(job.out_dir, exist_ok=True)
+
+        if not job.targets:
+            put(donor_outputs[0].path, job.output_path)
+            outputs = [OutputFile(job.output_path, None, None, original_size, 'copy')]
+            _remove_stale(job, outputs)
+            return _result('copy', job, outputs, original_size, original_size, reason='duplicate')
+
+        donors = {(output.format, output.width): output for output in donor_outputs}
+        outputs = []
+        fallback_written = False
+        for output_format, width, output_path in job.targets:
+            donor = donors[(output_format, width)]
+            if donor.status == 'skip':
+                if not fallback_written:
+                    put(donor.path, job.fallback_path)
+                    fallback_written = True
+                outputs.append(OutputFile(job.fallback_path, output_format, width, donor.size, 'skip'))
+            else:
+                put(donor.path, output_path)
+                outputs.append(OutputFile(output_path, output_format, width, donor.size, 'convert'))
+
+        _remove_stale(job, outputs)
+        if any(output.status == 'convert' for output in outputs):
+            return _result('convert', job, outputs, original_size, primary_size(outputs, original_size),
+                           reason='duplicate')
+        return _result('skip', job, outputs, original_size, outputs[0].size, reason='duplicate')
+
+    except Exception as e:
+        return ConvertResult('error', job.filepath, job.filename, None, None, original_size, 0, None, str(e),
+                             reason=type(e).__name__)
+
+
+def _remove_stale(job, outputs):
+    """源文件修改后输出文件名发生变化时，删除上次留下的旧输出"""
+    current = {output.path for output in outputs}
+    for previous in job.previous_outputs:
+        if previous not in current and os.path.exists(previous):
+            os.remove(previous)
+
+
+def warm_up(output_formats):
+    """预先加载图片插件和编码器 (AVIF 插件等)，使第一个文件的转换不需要等待初始化"""
+    Image.init()
+    sample = Image.new('RGB', (16, 16))
+    for output_format in output_formats:
+        encode_image(sample, output_format, 50, False, 0)
+
+
+def init_warm_worker(output_formats):
+    """常驻工作进程的初始化函数 (ProcessPoolExecutor 的 initializer)"""
+    # 常驻的工作进程由主进程负责停止，Ctrl+C 时不在每个工作进程中输出 KeyboardInterrupt；
+    # 停止服务时 (systemd 等向整个进程组发送 SIGTERM) 由主进程关闭进程池
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    warm_up(output_formats)
+
+
+class SerialEngine:
+    """单线程执行引擎: 在当前线程中逐个转换
+
+    jobs 中也可以混入已经确定的 ConvertResult (例如未变化的文件)，原样返回；
+    WAITING 表示暂时没有新任务。
+    """
+
+    def __init__(self, warm_formats=None):
+        if warm_formats:
+            warm_up(warm_formats)
+
+    def close(self):
+        pass
+
+    def run(self, jobs, should_stop, worker=convert_file):
+        for job in jobs:
+            if should_stop():
+                return
+            if job is WAITING:
+                continue
+            if isinstance(job, ConvertResult):
+                yield job
+            else:
+                yield worker(job)
+
+
+class MemoryBudget:
+    """内存预算: 按估算的内存占用决定任务能否开始
+
+    小任务可以大量并行；超出剩余预算的任务需要等待，
+    超出整个预算的巨型任务只在没有其他任务运行时单独执行。
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.used = 0
+        self.running = 0
+
+    def fits(self, cost):
+        return self.running == 0 or self.used + cost <= self.limit
+
+    def acquire(self, cost):
+        self.used += cost
+        self.running += 1
+
+    def release(self, cost):
+        self.used -= cost
+        self.running -= 1
+
+
+class EffortController:
+    """根据目标速度或完成期限调整编码强度
+
+    从最高强度开始，按最近完成的文件计算实际速度: 低于目标时降低一级，
+    明显高于目标时升高一级。每次调整后等待一个窗口的结果再判断，
+    让已提交的旧强度任务先完成。小文件始终使用最高强度。
+    """
+
+    WINDOW = 16
+    HEADROOM = 1.3  # 实际速度超过目标的该倍数时才提高强度
+
+    def __init__(self, target_rate=0, deadline=0):
+        self.target_rate = target_rate
+        self.deadline = deadline
+        self.effort = MAX_EFFORT
+        self._times = deque(maxlen=self.WINDOW)
+        self._cooldown = self.WINDOW
+
+    @property
+    def active(self):
+        return bool(self.target_rate or self.deadline)
+
+    def effort_for(self, size):
+        if size < TINY_FILE_SIZE:
+            return MAX_EFFORT
+        return self.effort
+
+    def target(self, remaining):
+        """当前需要达到的速度 (张/秒)"""
+        rate = self.target_rate
+        if self.deadline:
+            left = self.deadline - time.time()
+            rate = max(rate, remaining / left if left > 0 else float('inf'))
+        return rate
+
+    def observe(self, remaining):
+        """每完成一个需要编码的文件调用一次，remaining 为尚未完成的文件数"""
+        self._times.append(time.monotonic())
+        self._cooldown -= 1
+        if self._cooldown > 0 or len(self._times) < 2:
+            return
+        elapsed = self._times[-1] - self._times[0]
+        if elapsed <= 0:
+            return
+        rate = (len(self._times) - 1) / elapsed
+        target = self.target(remaining)
+        if rate < target and self.effort > 0:
+            self.effort -= 1
+            self._cooldown = self.WINDOW
+        elif rate > target * self.HEADROOM and self.effort < MAX_EFFORT:
+            self.effort += 1
+            self._cooldown = self.WINDOW
+
+
+class ProcessPoolEngine:
+    """多进程执行引擎: 将任务分发到进程池，按完成顺序返回结果
+
+    memory_budget: 同时运行的任务估算内存之和的上限 (字节)，0 表示不限制
+    warm_formats: 指定时创建常驻的进程池，立即启动全部工作进程并预先加载这些格式的编码器，
+        多次 run() 共用同一个进程池 (监视模式)，用完后需调用 close()
+    """
+
+    def __init__(self, workers=None, memory_budget=0, warm_formats=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.memory_budget = memory_budget
+        self._executor = None
+        if warm_formats:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers, initializer=init_warm_worker,
+                                                 initargs=(tuple(warm_formats),))
+            # 工作进程按需启动，提交与进程数相同的空任务使其全部启动
+            for future in [self._executor.submit(os.getpid) for _ in range(self.workers)]:
+                future.result()
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+    def run(self, jobs, should_stop, worker=convert_file):
+        """worker: 在工作进程中执行任务的函数 (必须可 pickle，即模块级函数)
+
+        should_stop 返回 True 后不再提交任务并取消排队中的任务，已在运行的任务完成后仍返回结果。
+        """
+        # 只保持少量任务在途，停止时排队中的任务无需等待
+        max_pending = self.workers * 2
+        budget = MemoryBudget(self.memory_budget) if self.memory_budget else None
+        jobs = iter(jobs)
+        pending = {}  # future -> 估算内存
+        held = None  # 因内存预算暂缓提交的任务
+        executor = self._executor or ProcessPoolExecutor(max_workers=self.workers)
+        completed = False  # 全部任务已完成或已取消 (未出现异常、未被强制中断)
+        try:
+            exhausted = False
+            while True:
+                while len(pending) < max_pending and not should_stop():
+                    if held is None:
+                        job = None if exhausted else next(jobs, None)
+                        if job is None:
+                            exhausted = True
+                            break
+                        if job is WAITING:
+                            # 扫描暂时没有新文件，先处理已完成的结果
+                            break
+                        if isinstance(job, ConvertResult):
+                            yield job
+                            continue
+                        held = job
+                    if budget is not None:
+                        if not budget.fits(held.mem_cost):
+                            break
+                        budget.acquire(held.mem_cost)
+                    pending[executor.submit(worker, held)] = held.mem_cost
+                    held = None
+                if should_stop():
+                    # 排队中的任务直接取消；已在工作进程中运行的任务仍会写出输出，
+                    # 等待它们完成并返回结果，使输出记入转换清单
+                    for future in [future for future in pending if future.cancel()]:
+                        del pending[future]
+                    while pending:
+                        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            del pending[future]
+                            yield future.result()
+                    completed = True
+                    return
+                if not pending:
+                    if exhausted:
+                        completed = True
+                        return
+                    continue
+                done, _ = wait(pending, timeout=0.2, return_when=FIRST_COMPLETED)
+                for future in done:
+                    cost = pending.pop(future)
+                    if budget is not None:
+                        budget.release(cost)
+                    yield future.result()
+        finally:
+            for future in pending:
+                future.cancel()
+            if executor is not self._executor:
+                # 正常完成或停止时等待工作进程退出，否则解释器退出时 concurrent.futures 的清理
+                # 可能与仍在关闭的管道竞争；出现异常或被强制中断时不等待
+                if completed:
+                    executor.shutdown(wait=True)
+                else:
+                    executor.shutdown(wait=False, cancel_futures=True)
+
+
+def create_engine(workers, memory_budget=0, warm_formats=None):
+    """根据并行进程数创建执行引擎，warm_formats 见 ProcessPoolEngine"""
+    if workers <= 1:
+        return SerialEngine(warm_formats)
+    return ProcessPoolEngine(workers, memory_budget, warm_formats)
+
+
+def iter_source_files(source, recursive=True):
+    """逐个产生源目录中的图片文件 (SourceFile)，边扫描边返回
+
+    使用 os.scandir，每个目录只读取一次，相对目录在递归时逐级拼接。
+    目录中的文件按 scandir 返回的顺序 (文件系统的目录顺序) 产生，不排序，
+    有数百万个文件的目录也不需要先读完整个目录；子目录按名称顺序处理。
+    无法访问的目录会被跳过 (与 os.walk 的默认行为一致)。
+    """
+    stack = [(source, '.')]
+    while stack:
+        dir_path, rel_path = stack.pop()
+        subdirs = []
+        try:
+            with os.scandir(dir_path) as it:
+                for entry in it:
+                    try:
+                        if entry.is_file():
+                            ext = os.path.splitext(entry.name)[1].lower()
+                            if ext in SUPPORTED_FORMATS or ext in TARGET_FORMATS:
+                                st = entry.stat()
+                                yield SourceFile(entry.path, entry.name, rel_path, st.st_size, st.st_mtime_ns)
+                        elif recursive and entry.is_dir(follow_symlinks=False):
+                            sub_rel = entry.name if rel_path == '.' else os.path.join(rel_path, entry.name)
+                            subdirs.append((entry.path, sub_rel))
+                    except OSError:
+                        continue
+        except OSError:
+            pass
+        # 倒序入栈，使子目录按名称顺序处理
+        stack.extend(sorted(subdirs, reverse=True))
+
+
+class FileDiscovery:
+    """后台扫描线程: 把扫描到的文件放入有界队列，转换可以立即开始
+
+    count 为已发现的文件数，finished 表示扫描是否结束。
+    迭代时队列中暂时没有文件则每 WAIT_TIMEOUT 秒产生一次 WAITING，不阻塞执行引擎。
+    """
+
+    QUEUE_SIZE = 1024
+    WAIT_TIMEOUT = 0.1
+    _DONE = object()
+
+    def __init__(self, source, recursive=True):
+        self.source = source
+        self.recursive = recursive
+        self.count = 0
+        self.finished = False
+        self._queue = queue.Queue(maxsize=self.QUEUE_SIZE)
+        self._closed = threading.Event()
+        self._thread = threading.Thread(target=self._scan, daemon=True)
+        self._thread.start()
+
+    def _put(self, item):
+        # 队列已满时阻塞，但消费者关闭后及时退出
+        while not self._closed.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _scan(self):
+        try:
+            for item in iter_source_files(self.source, self.recursive):
+                self.count += 1
+                if not self._put(item):
+                    return
+        finally:
+            self.finished = True
+            self._put(self._DONE)
+
+    def __iter__(self):
+        while True:
+            try:
+                item = self._queue.get(timeout=self.WAIT_TIMEOUT)
+            except queue.Empty:
+                yield WAITING
+                continue
+            if item is self._DONE:
+                return
+            yield item
+
+    def close(self):
+        self._closed.set()
+
+
+def make_job(filepath, filename, rel_path, output, settings, names, previous_outputs=()):
+    """根据设置为单个文件生成转换任务
+
+    names: OutputNameRegistry，在此处按顺序为输出文件分配文件名
+    """
+    # 确定输出路径
+    if settings.keep_structure and rel_path != '.':
+        out_dir = os.path.join(output, rel_path)
+    else:
+        out_dir = output
+
+    name, ext = os.path.splitext(filename)
+    targets = ()
+    output_path = fallback_path = None
+    if ext.lower() in TARGET_FORMATS:
+        # 已经是目标格式，直接复制
+        output_path = names.reserve(out_dir, filename, previous_outputs)
+    else:
+        template = settings.name_template or default_name_template(settings.widths)
+        widths = sorted(settings.widths, reverse=True) or [None]
+        targets = tuple(
+            (fmt, width, names.reserve(out_dir, template.format(name=name, width=width or '', ext=fmt),
+                                       previous_outputs))
+            for width in widths for fmt in settings.output_formats)
+        if settings.skip_larger:
+            # 转换后变大时复制原文件所用的文件名
+            fallback_path = names.reserve(out_dir, filename, previous_outputs)
+
+    # 只有需要按内存预算调度时才读取文件头估算内存
+    mem_cost = 0
+    if settings.memory_budget and settings.workers > 1 and targets:
+        mem_cost = estimate_memory(filepath, settings.max_size if settings.resize_large else None)
+    return ConvertJob(filepath, filename, out_dir, targets, output_path, fallback_path,
+                      settings.quality, settings.lossless,
+                      settings.skip_larger, settings.resize_large, settings.max_size,
+                      tuple(previous_outputs), mem_cost,
+                      predict_threshold=settings.predict_threshold,
+                      verify_prediction=settings.verify_prediction,
+                      passthrough=settings.passthrough)
+
+
+class ConversionSession:
+    """一个输出目录上的转换状态: 转换清单、输出文件名登记、内容去重和编码强度
+
+    convert_tree 用一个会话转换整个源目录后关闭；监视模式下同一个会话多次调用
+    run() 转换陆续出现的文件，已转换的内容和已分配的文件名在各次之间保留。
+
+    source: 源目录，转换清单中的记录只对同一个源目录有效
+    engine: 执行引擎，为 None 时按设置创建，close() 时一并关闭
+    """
+
+    def __init__(self, source, output, settings, engine=None):
+        self.source = source
+        self.output = output
+        self.settings = settings
+        # 创建输出目录
+        if not os.path.exists(output):
+            os.makedirs(output)
+        if settings.profile_dir:
+            os.makedirs(settings.profile_dir, exist_ok=True)
+
+        self.manifest = ConversionManifest(output, settings, source) if settings.incremental else None
+        # 源文件路径 -> (清单键, 大小, 修改时间)，结果返回后写入清单
+        self._sources = {}
+        self._names = OutputNameRegistry()
+        self._effort = EffortController(settings.target_rate, settings.deadline)
+        # 内容相同的文件只编码一次，有转换清单时跨运行记录内容哈希
+        self._index = ContentIndex(self.manifest) if settings.dedup != "off" else None
+        self._link = settings.dedup == "link"
+        self._sampled = 0
+        self._own_engine = engine is None
+        self.engine = engine or create_engine(settings.workers, settings.memory_budget * 1024 * 1024)
+
+    def commit(self):
+        """把转换清单中尚未提交的记录写入磁盘"""
+        if self.manifest is not None:
+            self.manifest.commit()
+
+    def close(self):
+        if self._own_engine:
+            self.engine.close()
+        if self.manifest is not None:
+            self.manifest.close()
+            self.manifest = None
+
+    def run(self, files, should_stop=None, total=None):
+        """转换 files (SourceFile 的可迭代对象，可以夹有 WAITING)，按完成顺序逐个返回 ConvertResult
+
+        total: 无参数的回调，返回本次已知的文件总数，供编码强度控制估算剩余文件数
+        """
+        if should_stop is None:
+            should_stop = lambda: False
+        done = 0
+        for finished in self.engine.run(self._jobs(files), should_stop):
+            for result in self._with_duplicates(finished):
+                done += 1
+                if self._effort.active and result.effort is not None and total is not None:
+                    self._effort.observe(total() - done)
+                self._record(result)
+                yield result
+
+    def _record(self, result):
+        if self.manifest is None or result.filepath not in self._sources:
+            return
+        key, size, mtime_ns = self._sources.pop(result.filepath)
+        if result.status == 'error':
+            self.manifest.forget(key)
+        else:
+            paths = list(dict.fromkeys(output.path for output in result.outputs))
+            self.manifest.record(key, size, mtime_ns, paths, result.status)
+
+    def _jobs(self, files):
+        settings = self.settings
+        index = self._index
+        for item, job in self._convert_jobs(files):
+            if job is WAITING or isinstance(job, ConvertResult):
+                yield job
+                continue
+            if index is not None:
+                state, donor = index.classify(item, job)
+                if state == 'ready':
+                    status, outputs = donor
+                    yield reuse_outputs(job, status, [OutputFile(*output) for output in outputs], self._link)
+                    continue
+                if state == 'wait':
+                    # 相同内容正在编码，完成后在 run() 的结果循环中处理
+                    continue
+                if job.targets and index.needs_digest(item.filepath):
+                    # 大小唯一、需要编码的文件由工作进程计算哈希，与解码并行；
+                    # 只复制的文件不经过解码，由 ContentIndex 在完成后计算
+                    job = job._replace(hash_content=True)
+            # 编码强度在提交任务时决定，反映最新的速度测量
+            if self._effort.active and job.targets:
+                job = job._replace(effort=self._effort.effort_for(item.size))
+            # 按固定间隔抽样，用 cProfile 分析 (第一个任务总会被采样)
+            if settings.profile_dir:
+                if self._sampled % max(1, settings.profile_every) == 0:
+                    name = f"{self._sampled:05d}_{job.filename}.prof"
+                    job = job._replace(profile_path=os.path.join(settings.profile_dir, name))
+                self._sampled += 1
+            yield job
+
+    def _convert_jobs(self, files):
+        """产生 (源文件, 任务或未变化的结果)"""
+        manifest = self.manifest
+        for item in files:
+            if item is WAITING:
+                yield item, item
+                continue
+            if manifest is None:
+                yield item, make_job(item.filepath, item.filename, item.rel_path, self.output,
+                                     self.settings, self._names)
+                continue
+            if item.rel_path == '.':
+                key = item.filename
+            else:
+                key = item.rel_path.replace(os.sep, '/') + '/' + item.filename
+            if manifest.is_unchanged(key, item.size, item.mtime_ns):
+                previous = manifest.previous_outputs(key)[0]
+                yield item, ConvertResult('unchanged', item.filepath, item.filename, previous,
+                                          os.path.basename(previous), item.size, 0, None, None,
+                                          reason='unchanged')
+                continue
+            self._sources[item.filepath] = (key, item.size, item.mtime_ns)
+            yield item, make_job(item.filepath, item.filename, item.rel_path, self.output, self.settings,
+                                 self._names, manifest.previous_outputs(key))
+
+    def _with_duplicates(self, result):
+        """编码完成的结果，以及等待该结果的相同内容文件的结果"""
+        yield result
+        if self._index is None or result.status == 'unchanged' or result.reason == 'duplicate':
+            return
+        for job in self._index.completed(result):
+            if result.status == 'error':
+                yield ConvertResult('error', job.filepath, job.filename, None, None, 0, 0, None,
+                                    f"相同内容的 {result.filename} 转换失败: {result.error}",
+                                    reason=result.reason)
+            else:
+                yield reuse_outputs(job, result.status, result.outputs, self._link)
+
+
+def convert_tree(source, output, settings, should_stop=None, on_discovered=None):
+    """转换整个源目录，按完成顺序逐个返回 ConvertResult
+
+    文件扫描在后台线程中进行，扫描到的文件立即开始转换。
+
+    should_stop: 无参数的回调，返回 True 时停止转换
+    on_discovered: 以 (已发现文件数, 扫描是否结束) 调用，用于更新进度总数；
+        在迭代 convert_tree 的线程中调用，扫描结束时保证最后调用一次
+    """
+    session = ConversionSession(source, output, settings)
+    discovery = FileDiscovery(source, settings.recursive)
+    reported = None
+
+    def report():
+        nonlocal reported
+        state = (discovery.count, discovery.finished)
+        if on_discovered is not None and state != reported:
+            reported = state
+            on_discovered(*state)
+
+    try:
+        for result in session.run(discovery, should_stop, lambda: discovery.count):
+            report()
+            yield result
+        report()
+    finally:
+        discovery.close()
+        session.close()
+
+
+class ConversionStats:
+    """累计转换统计"""
+
+    def __init__(self):
+        self.converted = 0
+        self.copied = 0
+        self.skipped = 0
+        self.unchanged = 0
+        self.errors = 0
+        self.original_size = 0
+        self.new_size = 0
+        self.peak_rss = 0  # 工作进程中观察到的最大峰值内存
+
+    @property
+    def done(self):
+        return self.converted + self.copied + self.skipped + self.unchanged + self.errors
+
+    @property
+    def saved_ratio(self):
+        if self.original_size <= 0:
+            return 0.0
+        return (1 - self.new_size / self.original_size) * 100
+
+    def add(self, result):
+        if result.peak_rss and result.peak_rss > self.peak_rss:
+            self.peak_rss = result.peak_rss
+        if result.status == 'error':
+            self.errors += 1
+            return
+        if result.status == 'unchanged':
+            # 未变化的文件不计入本次的大小统计
+            self.unchanged += 1
+            return
+        if result.status == 'convert':
+            self.converted += 1
+            self.new_size += result.new_size
+        else:
+            if result.status == 'copy':
+                self.copied += 1
+            else:
+                self.skipped += 1
+            self.new_size += result.original_size
+        self.original_size += result.original_size
+
+    def size_summary(self):
+        ratio = self.saved_ratio
+        change = f"节省 {ratio:.1f}%" if ratio >= 0 else f"增大 {-ratio:.1f}%"
+        return f"{format_size(self.original_size)} → {format_size(self.new_size)} ({change})"
+
+    def memory_summary(self):
+        """峰值内存说明，无法获取时返回 None"""
+        main_peak = peak_rss()
+        if not main_peak:
+            return None
+        if self.peak_rss:
+            return f"工作进程 {format_size(self.peak_rss)} | 主进程 {format_size(main_peak)}"
+        return f"主进程 {format_size(main_peak)}"
+
+
+def describe_result(result, output_formats):
+    """生成单个结果的日志文本，返回 (消息, 标签) 列表"""
+    lines = []
+    filename = result.filename
+    if result.status == 'unchanged':
+        # 增量转换时未变化的文件可能很多，不逐个输出日志
+        return lines
+
+    if result.resized:
+        lines.append((f"  ↳ 缩小: {result.resized[0]}x{result.resized[1]}", 'info'))
+    if result.frames and result.status != 'error':
+        detail = f"  ↳ 动画: {result.frames} 帧"
+        if result.metrics is not None:
+            encode = sum(wall for name, _, wall, _ in result.metrics.stages if name == 'encode')
+            detail += f"，编码 {encode:.1f}s"
+        if result.peak_rss:
+            detail += f"，进程峰值内存 {format_size(result.peak_rss)}"
+        lines.append((detail, 'info'))
+
+    if result.status == 'error':
+        lines.append((f"[错误] {filename}: {result.error}", 'error'))
+    elif result.status == 'copy':
+        ext = os.path.splitext(filename)[1].lower()
+        if ext in {f".{fmt}" for fmt in output_formats}:
+            lines.append((f"[复制] {filename} (已是{ext[1:].upper()}格式)", 'copy'))
+        else:
+            lines.append((f"[复制] {filename}", 'copy'))
+    elif result.status == 'skip' and result.reason == 'predicted':
+        label = format_label(dict.fromkeys(output.format for output in result.outputs))
+        lines.append((f"[跳过] {filename} (预测{label}不会更小，置信度 {result.prediction:.2f})", 'skip'))
+    elif result.status == 'skip':
+        label = format_label(dict.fromkeys(output.format for output in result.outputs))
+        lines.append((f"[跳过] {filename} ({label}更大: "
+                      f"{format_size(result.original_size)} → {format_size(result.new_size)})", 'skip'))
+    else:
+        original_size = result.original_size
+        written = [output for output in result.outputs if output.status == 'convert']
+        if len(result.outputs) == 1:
+            message = (f"[转换] {filename} → {os.path.basename(written[0].path)} "
+                       f"({format_size(original_size)} → {format_size(result.new_size)}, "
+                       f"{_saving(original_size, result.new_size)})")
+        else:
+            # 多个格式或宽度的输出逐个与原文件比较，不把各个输出的大小相加
+            target = ", ".join(f"{os.path.basename(output.path)} {format_size(output.size)} "
+                               f"({_saving(original_size, output.size)})" for output in written)
+            message = f"[转换] {filename} ({format_size(original_size)}) → {target}"
+        if result.reason == 'duplicate':
+            message += " (内容重复，沿用已有的输出)"
+        skipped = len(result.outputs) - len(written)
+        if skipped:
+            message += f" (另有 {skipped} 个输出更大，已保留原文件)"
+        # 主输出变大时标记为警告，与统计中的 new_size 一致
+        lines.append((message, 'success' if result.new_size <= original_size else 'warning'))
+    return lines
+
+
+def _saving(original_size, new_size):
+    ratio = (1 - new_size / original_size) * 100 if original_size > 0 else 0
+    return f"节省 {ratio:.1f}%" if ratio >= 0 else f"增大 {-ratio:.1f}%"
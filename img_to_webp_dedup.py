@@ -0,0 +1,161 @@
+"""相同内容的源文件去重
+
+同一个 logo 或缩略图经常被复制到许多子目录中。ContentIndex 按内容把源文件
+分组，每种内容只编码一次，其余文件直接链接或复制第一次的输出。
+
+只有大小与其他文件相同时主进程才计算哈希 (大小唯一的文件不可能重复)，哈希以
+流式读取计算。已转换内容的哈希保存在转换清单中，文件移动或改名后也不会重新编码；
+大小唯一、需要编码的文件的哈希由工作进程在解码前计算 (ConvertJob.hash_content)，
+只复制的文件在复制完成后由主进程计算。
+"""
+import hashlib
+from collections import OrderedDict
+
+_CHUNK_SIZE = 1024 * 1024
+
+
+def content_hash(path):
+    """流式计算文件内容的哈希 (BLAKE2b，160 位)"""
+    digest = hashlib.blake2b(digest_size=20)
+    with open(path, 'rb') as f:
+        while chunk := f.read(_CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ContentIndex:
+    """按内容分组的源文件
+
+    cache: ConversionManifest，用于查找和记录以前运行中转换过的内容；为 None 时只在本次会话中去重
+
+    监视模式下同一个 ContentIndex 长时间使用，内存占用不随转换过的文件数增长: 只有尚未完成的
+    文件保留哈希，已完成的内容只保留状态和输出列表，且只保留最近 MAX_CONTENTS 个；文件大小只保留
+    最近 MAX_SIZES 个。更早的内容有转换清单时从清单中查找，没有清单时相同内容可能再编码一次。
+    """
+
+    MAX_CONTENTS = 10000
+    MAX_SIZES = 100000
+
+    def __init__(self, cache=None):
+        self.cache = cache
+        # 大小 -> (该大小第一个未计算哈希的源文件, 是否只复制)；已计算过哈希的大小为 None
+        self._sizes = OrderedDict()
+        self._pending = {}  # 尚未完成的源文件 -> 是否只复制 (已是目标格式)
+        self._hashes = {}  # 尚未完成的源文件 -> 哈希
+        self._encoding = {}  # 内容键 -> 正在编码该内容的源文件
+        self._done = OrderedDict()  # 内容键 -> (状态, 输出列表)，最近完成的内容
+        self._waiting = {}  # 内容键 -> [等待编码结果的任务]
+        self._unhashed = OrderedDict()  # 未计算哈希的已完成源文件 -> (状态, 输出列表)
+
+    @staticmethod
+    def _key(digest, copy):
+        # 已是目标格式的文件只复制，与需要编码的文件分开分组
+        return f"{digest}:copy" if copy else digest
+
+    @staticmethod
+    def _remember(table, key, value, limit):
+        table[key] = value
+        table.move_to_end(key)
+        if len(table) > limit:
+            table.popitem(last=False)
+
+    def classify(self, item, job):
+        """判断任务是否需要编码
+
+        返回 (None, None): 需要编码；('ready', (状态, 输出列表)): 可直接沿用已有的输出；
+        ('wait', None): 相同内容正在编码，任务已加入等待列表，由 completed() 返回。
+        """
+        path = item.filepath
+        copy = not job.targets
+        size = item.size
+        if size in self._sizes:
+            first = self._sizes[size]
+            self._remember(self._sizes, size, None, self.MAX_SIZES)
+            if first is not None:
+                self._adopt(*first)
+        elif self.cache is not None and self.cache.has_content_size(size):
+            self._remember(self._sizes, size, None, self.MAX_SIZES)
+        else:
+            # 大小唯一，不可能与已知文件重复
+            self._remember(self._sizes, size, (path, copy), self.MAX_SIZES)
+            self._pending[path] = copy
+            return None, None
+
+        try:
+            digest = content_hash(path)
+        except OSError:
+            # 在扫描之后被删除或无法读取: 作为普通文件编码，由 convert_file 报告错误
+            self._pending[path] = copy
+            return None, None
+        key = self._key(digest, copy)
+        done = self._done.get(key)
+        if done is not None and done[0] != 'error':
+            self._done.move_to_end(key)
+            return 'ready', done
+        encoder = self._encoding.get(key)
+        if encoder is not None and encoder != path:
+            self._waiting.setdefault(key, []).append(job)
+            return 'wait', None
+        if self.cache is not None:
+            cached = self.cache.lookup_content(key)
+            if cached is not None:
+                return 'ready', cached
+
+        self._encoding[key] = path
+        self._pending[path] = copy
+        self._hashes[path] = digest
+        return None, None
+
+    def _adopt(self, path, copy):
+        """同样大小的文件出现后，为该大小第一个 (未计算哈希的) 文件补算哈希并登记其内容"""
+        if path in self._pending:
+            # 仍在转换: 完成时由 completed() 登记结果
+            try:
+                digest = self._hashes[path] = content_hash(path)
+            except OSError:
+                return
+            self._encoding.setdefault(self._key(digest, copy), path)
+            return
+        done = self._unhashed.pop(path, None)
+        if done is None:
+            return
+        try:
+            digest = content_hash(path)
+        except OSError:
+            # 该文件已被删除或无法读取，不再作为相同内容的来源
+            return
+        key = self._key(digest, copy)
+        if key not in self._done:
+            self._remember(self._done, key, done, self.MAX_CONTENTS)
+
+    def needs_digest(self, path):
+        """是否需要工作进程在转换时计算内容哈希 (记录到清单中，而主进程没有计算过)"""
+        return self.cache is not None and path not in self._hashes
+
+    def completed(self, result):
+        """需要编码的文件完成后调用，返回等待该结果的任务列表"""
+        path = result.filepath
+        copy = self._pending.pop(path, None)
+        if copy is None:
+            return []
+        digest = self._hashes.pop(path, None) or result.content_hash
+        if digest is None and self.cache is not None and copy and result.status != 'error':
+            # 只复制的文件不在工作进程中计算哈希 (复制不读入内容)，此时流式计算
+            try:
+                digest = content_hash(path)
+            except OSError:
+                pass
+        done = (result.status, result.outputs)
+        if digest is None:
+            # 大小唯一的文件不计算哈希，不可能有等待的任务；之后出现相同大小的文件时再补算
+            self._remember(self._unhashed, path, done, self.MAX_CONTENTS)
+            return []
+        key = self._key(digest, copy)
+        encoder = self._encoding.get(key)
+        if encoder is not None and encoder != path:
+            return []
+        self._encoding.pop(key, None)
+        self._remember(self._done, key, done, self.MAX_CONTENTS)
+        if self.cache is not None and result.status != 'error':
+            self.cache.record_content(key, result.original_size, result.status, result.outputs)
+        return self._waiting.pop(key, [])
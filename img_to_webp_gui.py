@@ -1,16 +1,53 @@
 import os
-import shutil
+import sys
+import time
+import queue
 import tkinter as tk
 from tkinter import filedialog, messagebox, ttk
-from PIL import Image
 import threading
+import multiprocessing
+from collections import deque
 
-# 尝试导入 AVIF 支持
-try:
-    import pillow_avif
-    AVIF_SUPPORTED = True
-except ImportError:
-    AVIF_SUPPORTED = False
+from img_to_webp_archive import convert_archive, is_archive
+from img_to_webp_core import (AVIF_SUPPORTED, ConvertSettings, ConversionStats,
+                              check_name_template, convert_tree, describe_result, format_label,
+                              format_size, parse_widths)
+from img_to_webp_report import RunReport
+
+
+# 日志窗口最多保留的行数 (完整日志写入用户日志目录中的日志文件)
+LOG_MAX_LINES = 1000
+# 用户日志目录中保留最近多少次转换的日志和运行报告
+LOG_KEEP_RUNS = 20
+# 界面刷新间隔 (毫秒)
+UI_REFRESH_MS = 100
+
+
+def user_log_dir():
+    """当前用户的日志目录，日志和运行报告不写入输出目录 (输出目录常被直接发布)"""
+    if sys.platform == 'win32':
+        base = os.environ.get('LOCALAPPDATA') or os.path.expanduser('~\\AppData\\Local')
+        return os.path.join(base, 'img_to_webp', 'logs')
+    if sys.platform == 'darwin':
+        return os.path.expanduser('~/Library/Logs/img_to_webp')
+    base = os.environ.get('XDG_STATE_HOME') or os.path.expanduser('~/.local/state')
+    return os.path.join(base, 'img_to_webp', 'logs')
+
+
+def prune_logs(log_dir, keep):
+    """只保留最近 keep 次转换的日志和运行报告"""
+    try:
+        names = sorted(name for name in os.listdir(log_dir)
+                       if name.startswith('img_to_webp_') and name.endswith('.log'))
+    except OSError:
+        return
+    for name in names[:max(0, len(names) - keep)]:
+        stem = os.path.splitext(name)[0]
+        for path in (name, stem + '.report.json'):
+            try:
+                os.remove(os.path.join(log_dir, path))
+            except OSError:
+                pass
 
 
 class ImageConverter:
@@ -21,7 +58,17 @@ class ImageConverter:
         self.root.resizable(True, True)
         
         self.is_converting = False
+        
+        # 转换线程不直接操作界面: 日志行放入队列，进度只保存最新状态，
+        # 由主线程定时统一刷新，界面开销与文件数量无关
+        self.events = queue.Queue()
+        self.progress_state = None
+        self.shown_progress_state = None
+        self.log_file = None
+        self.log_lock = threading.Lock()
+        
         self.setup_ui()
+        self.root.after(UI_REFRESH_MS, self.process_events)
         
     def setup_ui(self):
         # 主框架
@@ -48,16 +95,18 @@ class ImageConverter:
         format_frame = ttk.LabelFrame(main_frame, text="输出格式", padding="10")
         format_frame.pack(fill=tk.X, pady=5)
         
-        self.format_var = tk.StringVar(value="webp")
+        # 可以同时输出多种格式，每个源文件只解码一次
+        self.webp_var = tk.BooleanVar(value=True)
+        self.avif_var = tk.BooleanVar(value=False)
         
         format_select_frame = ttk.Frame(format_frame)
         format_select_frame.pack(fill=tk.X)
         
         # WebP 选项
-        webp_radio = ttk.Radiobutton(format_select_frame, text="WebP", 
-                                      variable=self.format_var, value="webp",
-                                      command=self.on_format_change)
-        webp_radio.pack(side=tk.LEFT, padx=10)
+        webp_check = ttk.Checkbutton(format_select_frame, text="WebP", 
+                                     variable=self.webp_var,
+                                     command=lambda: self.on_format_change("webp"))
+        webp_check.pack(side=tk.LEFT, padx=10)
         
         ttk.Label(format_select_frame, text="(兼容性好，压缩率高)", 
                   foreground="gray").pack(side=tk.LEFT)
@@ -66,10 +115,10 @@ class ImageConverter:
         avif_frame = ttk.Frame(format_select_frame)
         avif_frame.pack(side=tk.LEFT, padx=(30, 10))
         
-        self.avif_radio = ttk.Radiobutton(avif_frame, text="AVIF", 
-                                           variable=self.format_var, value="avif",
-                                           command=self.on_format_change)
-        self.avif_radio.pack(side=tk.LEFT)
+        self.avif_check = ttk.Checkbutton(avif_frame, text="AVIF", 
+                                          variable=self.avif_var,
+                                          command=lambda: self.on_format_change("avif"))
+        self.avif_check.pack(side=tk.LEFT)
         
         if AVIF_SUPPORTED:
             ttk.Label(format_select_frame, text="(压缩率更高，较新格式)", 
@@ -77,7 +126,21 @@ class ImageConverter:
         else:
             ttk.Label(format_select_frame, text="(未安装 pillow-avif-plugin)", 
                       foreground="red").pack(side=tk.LEFT)
-            self.avif_radio.config(state=tk.DISABLED)
+            self.avif_check.config(state=tk.DISABLED)
+        
+        # 响应式宽度和命名规则
+        sizes_frame = ttk.Frame(format_frame)
+        sizes_frame.pack(fill=tk.X, pady=(8, 0))
+        
+        ttk.Label(sizes_frame, text="输出宽度:").pack(side=tk.LEFT, padx=(10, 5))
+        self.widths_entry = ttk.Entry(sizes_frame, width=20)
+        self.widths_entry.pack(side=tk.LEFT)
+        ttk.Label(sizes_frame, text="(如 320,640,1280；留空为原始尺寸)", 
+                  foreground="gray").pack(side=tk.LEFT, padx=5)
+        
+        ttk.Label(sizes_frame, text="命名:").pack(side=tk.LEFT, padx=(10, 5))
+        self.name_template_entry = ttk.Entry(sizes_frame, width=20)
+        self.name_template_entry.pack(side=tk.LEFT, fill=tk.X, expand=True)
         
         # ========== 设置选项 ==========
         settings_frame = ttk.LabelFrame(main_frame, text="转换设置", padding="10")
@@ -139,8 +202,34 @@ class ImageConverter:
                         variable=self.skip_larger_var).pack(side=tk.LEFT, padx=5)
         
         self.resize_large_var = tk.BooleanVar(value=False)
-        ttk.Checkbutton(options_frame3, text="缩小大图片 (>4K)", 
-                        variable=self.resize_large_var).pack(side=tk.LEFT, padx=5)
+        ttk.Checkbutton(options_frame3, text="缩小大图片, 最大边长:", 
+                        variable=self.resize_large_var).pack(side=tk.LEFT, padx=(5, 0))
+        self.max_size_var = tk.IntVar(value=3840)
+        ttk.Spinbox(options_frame3, from_=16, to=65535, increment=64, width=6,
+                    textvariable=self.max_size_var).pack(side=tk.LEFT)
+        ttk.Label(options_frame3, text="px").pack(side=tk.LEFT, padx=(2, 5))
+        
+        self.incremental_var = tk.BooleanVar(value=True)
+        ttk.Checkbutton(options_frame3, text="增量转换 (跳过未变化的文件)", 
+                        variable=self.incremental_var).pack(side=tk.LEFT, padx=5)
+        
+        # 选项 - 第四行
+        options_frame4 = ttk.Frame(settings_frame)
+        options_frame4.pack(fill=tk.X, pady=2)
+        
+        ttk.Label(options_frame4, text="并行进程数:").pack(side=tk.LEFT, padx=5)
+        self.workers_var = tk.IntVar(value=os.cpu_count() or 1)
+        ttk.Spinbox(options_frame4, from_=1, to=256, width=5,
+                    textvariable=self.workers_var).pack(side=tk.LEFT)
+        ttk.Label(options_frame4, text="(1 = 单进程)", 
+                  foreground="gray").pack(side=tk.LEFT, padx=5)
+        
+        ttk.Label(options_frame4, text="内存预算(MB):").pack(side=tk.LEFT, padx=(20, 5))
+        self.memory_budget_var = tk.IntVar(value=0)
+        ttk.Spinbox(options_frame4, from_=0, to=1048576, increment=512, width=8,
+                    textvariable=self.memory_budget_var).pack(side=tk.LEFT)
+        ttk.Label(options_frame4, text="(0 = 不限制)", 
+                  foreground="gray").pack(side=tk.LEFT, padx=5)
         
         # ========== 按钮 ==========
         btn_frame = ttk.Frame(main_frame)
@@ -194,12 +283,11 @@ class ImageConverter:
         self.log_text.tag_config('skip', foreground='purple')
         self.log_text.tag_config('warning', foreground='#CC6600')
     
-    def on_format_change(self):
+    def on_format_change(self, fmt):
         """格式变更时的处理"""
-        fmt = self.format_var.get()
-        if fmt == "avif":
+        if fmt == "avif" and self.avif_var.get():
             self.log("已选择 AVIF 格式 - 压缩率更高，但编码速度较慢", 'info')
-        else:
+        elif fmt == "webp" and self.webp_var.get():
             self.log("已选择 WebP 格式 - 兼容性好，编码速度快", 'info')
         
     def set_quality(self, value):
@@ -232,8 +320,74 @@ class ImageConverter:
             self.output_entry.insert(0, folder)
             
     def log(self, message, tag=None):
-        self.log_text.insert(tk.END, message + "\n", tag)
-        self.log_text.see(tk.END)
+        """记录一行日志 (可在任意线程中调用)"""
+        with self.log_lock:
+            if self.log_file is not None:
+                self.log_file.write(message + "\n")
+        self.events.put(('log', message, tag))
+        
+    def process_events(self):
+        """主线程定时处理转换线程发来的事件"""
+        lines = deque(maxlen=LOG_MAX_LINES)
+        finished = None
+        try:
+            while True:
+                event = self.events.get_nowait()
+                if event[0] == 'log':
+                    lines.append(event[1:])
+                elif event[0] == 'finished':
+                    finished = event
+        except queue.Empty:
+            pass
+        
+        if lines:
+            for message, tag in lines:
+                self.log_text.insert(tk.END, message + "\n", tag)
+            # 只保留最近的 LOG_MAX_LINES 行
+            line_count = int(self.log_text.index('end-1c').split('.')[0])
+            if line_count > LOG_MAX_LINES:
+                self.log_text.delete('1.0', f'{line_count - LOG_MAX_LINES + 1}.0')
+            self.log_text.see(tk.END)
+        
+        # 合并后的进度和统计，只显示最新状态
+        state = self.progress_state
+        if state is not None and state != self.shown_progress_state:
+            self.shown_progress_state = state
+            done, total, scanning, filename, stats_text = state
+            self.progress['maximum'] = max(total, 1)
+            self.progress['value'] = done
+            self.progress_label.config(text=f"{done}/{total}{'+' if scanning else ''}")
+            if filename and self.is_converting:
+                self.status_label.config(text=f"处理中: {filename}", foreground="blue")
+            if stats_text:
+                self.stats_label.config(text=stats_text)
+        
+        if finished is not None:
+            self.reset_ui()
+            if finished[1]:
+                messagebox.showinfo("完成", finished[1])
+        
+        self.root.after(UI_REFRESH_MS, self.process_events)
+        
+    def open_log_file(self):
+        """在用户日志目录中创建本次转换的完整日志文件，无法创建时返回 None"""
+        log_dir = user_log_dir()
+        try:
+            os.makedirs(log_dir, exist_ok=True)
+            prune_logs(log_dir, LOG_KEEP_RUNS - 1)
+            path = os.path.join(log_dir, time.strftime("img_to_webp_%Y%m%d_%H%M%S.log"))
+            log_file = open(path, 'w', encoding='utf-8')
+        except OSError:
+            return None
+        with self.log_lock:
+            self.log_file = log_file
+        return path
+        
+    def close_log_file(self):
+        with self.log_lock:
+            if self.log_file is not None:
+                self.log_file.close()
+                self.log_file = None
         
     def clear_log(self):
         self.log_text.delete(1.0, tk.END)
@@ -252,251 +406,149 @@ class ImageConverter:
             messagebox.showerror("错误", "源目录不存在!")
             return
         
+        if not (self.webp_var.get() or self.avif_var.get()):
+            messagebox.showerror("错误", "请至少选择一种输出格式!")
+            return
+        
         # 检查 AVIF 支持
-        if self.format_var.get() == "avif" and not AVIF_SUPPORTED:
+        if self.avif_var.get() and not AVIF_SUPPORTED:
             messagebox.showerror("错误", "AVIF 格式需要安装 pillow-avif-plugin\n\n请运行: pip install pillow-avif-plugin")
             return
+        
+        # 在主线程中读取界面设置
+        try:
+            settings = self.get_settings()
+        except ValueError as e:
+            messagebox.showerror("错误", str(e))
+            return
             
         self.is_converting = True
+        self.progress_state = (0, 0, True, None, None)
         self.convert_btn.config(state=tk.DISABLED)
         self.stop_btn.config(state=tk.NORMAL)
         
-        thread = threading.Thread(target=self.convert_images, args=(source, output), daemon=True)
+        thread = threading.Thread(target=self.convert_images, args=(source, output, settings), daemon=True)
         thread.start()
         
     def stop_conversion(self):
         self.is_converting = False
         self.status_label.config(text="正在停止...", foreground="orange")
         
-    def convert_images(self, source, output):
-        # 获取输出格式
-        output_format = self.format_var.get()  # "webp" 或 "avif"
-        format_ext = f".{output_format}"
-        
-        # 支持的图片格式
-        supported_formats = {'.jpg', '.jpeg', '.png', '.bmp', '.gif', '.tiff', '.tif', '.ico', '.ppm', '.pgm', '.pbm'}
-        target_formats = {'.webp', '.avif'}
-        
-        # 创建输出目录
-        if not os.path.exists(output):
-            os.makedirs(output)
+    def get_settings(self):
+        """从界面控件读取转换设置"""
+        try:
+            workers = max(1, int(self.workers_var.get()))
+        except (tk.TclError, ValueError):
+            workers = 1
+        try:
+            max_size = max(16, int(self.max_size_var.get()))
+        except (tk.TclError, ValueError):
+            max_size = 3840
+        try:
+            memory_budget = max(0, int(self.memory_budget_var.get()))
+        except (tk.TclError, ValueError):
+            memory_budget = 0
+        output_formats = tuple(fmt for fmt, var in (("webp", self.webp_var), ("avif", self.avif_var))
+                               if var.get())
+        widths = parse_widths(self.widths_entry.get())
+        return ConvertSettings(
+            output_formats=output_formats,
+            widths=widths,
+            name_template=check_name_template(self.name_template_entry.get(), widths, output_formats),
+            quality=int(self.quality_var.get()),
+            lossless=self.lossless_var.get(),
+            recursive=self.recursive_var.get(),
+            keep_structure=self.keep_structure_var.get(),
+            skip_larger=self.skip_larger_var.get(),
+            resize_large=self.resize_large_var.get(),
+            max_size=max_size,
+            workers=workers,
+            memory_budget=memory_budget,
+            incremental=self.incremental_var.get(),
+        )
+        
+    def convert_images(self, source, output, settings):
+        """转换线程: 只通过 log() 和 progress_state 与界面交互"""
+        formats = format_label(settings.output_formats)  # 如 "WEBP+AVIF"
+        stats = ConversionStats()
+        report = RunReport(settings)
+        total = 0
+        scanning = True
+        message = None
+        
+        # 边扫描边转换，进度总数随发现的文件增加
+        def on_discovered(count, finished):
+            nonlocal total, scanning
+            total = count
+            scanning = not finished
+            if finished and total:
+                self.log(f"文件扫描完成，共找到 {total} 个图片文件", 'info')
+        
+        try:
+            # 源或输出为 zip / tar 压缩包时直接读写压缩包
+            archive = is_archive(source) or is_archive(output)
+            log_path = self.open_log_file()
+            self.log(f"开始转换为 {formats} (进程数: {settings.workers})，正在扫描图片文件...", 'info')
+            if log_path:
+                self.log(f"完整日志: {log_path}", 'info')
+            convert = convert_archive if archive else convert_tree
+            results = convert(source, output, settings,
+                              should_stop=lambda: not self.is_converting,
+                              on_discovered=on_discovered)
+            for result in results:
+                stats.add(result)
+                report.add(result)
+                for line, tag in describe_result(result, settings.output_formats):
+                    self.log(line, tag)
+                
+                # 更新进度和统计 (由界面定时器显示)
+                stats_text = f"总计: {stats.size_summary()}" if stats.original_size > 0 else None
+                self.progress_state = (stats.done, total, scanning, result.filename, stats_text)
             
-        # 收集所有图片文件
-        files = []
-        if self.recursive_var.get():
-            for root_dir, dirs, filenames in os.walk(source):
-                for filename in filenames:
-                    ext = os.path.splitext(filename)[1].lower()
-                    if ext in supported_formats or ext in target_formats:
-                        full_path = os.path.join(root_dir, filename)
-                        rel_path = os.path.relpath(root_dir, source)
-                        files.append((full_path, filename, rel_path))
-        else:
-            for filename in os.listdir(source):
-                filepath = os.path.join(source, filename)
-                if os.path.isfile(filepath):
-                    ext = os.path.splitext(filename)[1].lower()
-                    if ext in supported_formats or ext in target_formats:
-                        files.append((filepath, filename, '.'))
-                        
-        total = len(files)
-        if total == 0:
-            self.log("未找到任何图片文件!", 'error')
-            self.reset_ui()
-            return
+            self.progress_state = (stats.done, total, scanning, None, None)
+            if total == 0:
+                self.log("未找到任何图片文件!", 'error')
+                return
             
-        self.progress['maximum'] = total
-        self.progress['value'] = 0
-        self.log(f"找到 {total} 个图片文件，开始转换为 {output_format.upper()}...", 'info')
-        
-        converted_count = 0
-        copied_count = 0
-        skipped_count = 0
-        error_count = 0
-        total_original_size = 0
-        total_new_size = 0
-        
-        quality = int(self.quality_var.get())
-        lossless = self.lossless_var.get()
-        keep_structure = self.keep_structure_var.get()
-        skip_larger = self.skip_larger_var.get()
-        resize_large = self.resize_large_var.get()
-        
-        for i, (filepath, filename, rel_path) in enumerate(files):
             if not self.is_converting:
                 self.log("转换已停止!", 'info')
-                break
-                
-            name, ext = os.path.splitext(filename)
-            original_size = os.path.getsize(filepath)
-            
-            # 确定输出路径
-            if keep_structure and rel_path != '.':
-                out_dir = os.path.join(output, rel_path)
-                if not os.path.exists(out_dir):
-                    os.makedirs(out_dir)
-            else:
-                out_dir = output
                 
-            try:
-                # 如果已经是目标格式，直接复制
-                if ext.lower() == format_ext:
-                    output_path = os.path.join(out_dir, filename)
-                    output_path = self.get_unique_path(output_path)
-                    shutil.copy2(filepath, output_path)
-                    copied_count += 1
-                    total_original_size += original_size
-                    total_new_size += original_size
-                    self.log(f"[复制] {filename} (已是{output_format.upper()}格式)", 'copy')
-                    
-                # 如果是另一种目标格式，也复制到输出目录
-                elif ext.lower() in target_formats:
-                    output_path = os.path.join(out_dir, filename)
-                    output_path = self.get_unique_path(output_path)
-                    shutil.copy2(filepath, output_path)
-                    copied_count += 1
-                    total_original_size += original_size
-                    total_new_size += original_size
-                    self.log(f"[复制] {filename}", 'copy')
-                    
-                else:
-                    # 转换图片
-                    img = Image.open(filepath)
-                    
-                    # 缩小大图片
-                    if resize_large:
-                        max_size = 3840  # 4K
-                        if img.width > max_size or img.height > max_size:
-                            ratio = min(max_size / img.width, max_size / img.height)
-                            new_size = (int(img.width * ratio), int(img.height * ratio))
-                            img = img.resize(new_size, Image.Resampling.LANCZOS)
-                            self.log(f"  ↳ 缩小: {img.width}x{img.height}", 'info')
-                    
-                    # 处理不同的图像模式
-                    if img.mode == 'P':
-                        if 'transparency' in img.info:
-                            img = img.convert('RGBA')
-                        else:
-                            img = img.convert('RGB')
-                    elif img.mode == 'LA':
-                        img = img.convert('RGBA')
-                    elif img.mode not in ('RGB', 'RGBA'):
-                        img = img.convert('RGB')
-                    
-                    # 如果没有透明通道，转为RGB可以更好压缩
-                    if img.mode == 'RGBA':
-                        extrema = img.getextrema()
-                        if len(extrema) >= 4 and extrema[3][0] == 255:
-                            img = img.convert('RGB')
-                    
-                    output_path = os.path.join(out_dir, name + format_ext)
-                    output_path = self.get_unique_path(output_path)
-                    
-                    # 根据格式保存
-                    if output_format == "webp":
-                        if lossless:
-                            img.save(output_path, 'WEBP', lossless=True, quality=100, method=6)
-                        else:
-                            img.save(output_path, 'WEBP', quality=quality, method=6)
-                    else:  # AVIF
-                        if lossless:
-                            # AVIF 无损
-                            img.save(output_path, 'AVIF', quality=100, speed=6)
-                        else:
-                            # AVIF 有损 - speed 越低压缩越好但越慢
-                            img.save(output_path, 'AVIF', quality=quality, speed=6)
-                    
-                    new_size = os.path.getsize(output_path)
-                    
-                    # 检查是否变大了
-                    if skip_larger and new_size >= original_size:
-                        os.remove(output_path)
-                        
-                        # 复制原文件
-                        original_output = os.path.join(out_dir, filename)
-                        original_output = self.get_unique_path(original_output)
-                        shutil.copy2(filepath, original_output)
-                        
-                        skipped_count += 1
-                        total_original_size += original_size
-                        total_new_size += original_size
-                        self.log(f"[跳过] {filename} ({output_format.upper()}更大: {self.format_size(original_size)} → {self.format_size(new_size)})", 'skip')
-                    else:
-                        ratio = (1 - new_size / original_size) * 100
-                        converted_count += 1
-                        total_original_size += original_size
-                        total_new_size += new_size
-                        
-                        if ratio >= 0:
-                            self.log(f"[转换] {filename} → {os.path.basename(output_path)} "
-                                    f"({self.format_size(original_size)} → {self.format_size(new_size)}, "
-                                    f"节省 {ratio:.1f}%)", 'success')
-                        else:
-                            self.log(f"[转换] {filename} → {os.path.basename(output_path)} "
-                                    f"({self.format_size(original_size)} → {self.format_size(new_size)}, "
-                                    f"增大 {-ratio:.1f}%)", 'warning')
-                    
-                    img.close()
-                    
-            except Exception as e:
-                error_count += 1
-                self.log(f"[错误] {filename}: {str(e)}", 'error')
-                
-            # 更新进度
-            self.progress['value'] = i + 1
-            self.progress_label.config(text=f"{i + 1}/{total}")
-            self.status_label.config(text=f"处理中: {filename}", foreground="blue")
-            
-            # 更新统计
-            if total_original_size > 0:
-                overall_ratio = (1 - total_new_size / total_original_size) * 100
-                self.stats_label.config(
-                    text=f"总计: {self.format_size(total_original_size)} → {self.format_size(total_new_size)} (节省 {overall_ratio:.1f}%)"
-                )
-            
-            self.root.update_idletasks()
+            # 完成
+            self.log("-" * 60, 'info')
             
-        # 完成
-        self.log("-" * 60, 'info')
-        
-        summary = f"转换完成! 格式: {output_format.upper()}\n  转换: {converted_count} | 复制: {copied_count} | 跳过: {skipped_count} | 错误: {error_count}"
-        if total_original_size > 0:
-            overall_ratio = (1 - total_new_size / total_original_size) * 100
-            summary += f"\n  总大小: {self.format_size(total_original_size)} → {self.format_size(total_new_size)} (节省 {overall_ratio:.1f}%)"
-        self.log(summary, 'info')
-        
-        self.reset_ui()
-        
-        if self.is_converting:
-            msg = (f"转换完成! 格式: {output_format.upper()}\n\n"
-                   f"✅ 转换: {converted_count} 个文件\n"
-                   f"📋 复制: {copied_count} 个文件\n"
-                   f"⏭ 跳过: {skipped_count} 个文件 (转换后更大)\n"
-                   f"❌ 错误: {error_count} 个文件\n\n")
-            if total_original_size > 0:
-                overall_ratio = (1 - total_new_size / total_original_size) * 100
-                saved = total_original_size - total_new_size
-                msg += f"💾 总节省: {self.format_size(saved)} ({overall_ratio:.1f}%)"
-            messagebox.showinfo("完成", msg)
-        
-    def get_unique_path(self, path):
-        """获取唯一的文件路径，避免覆盖"""
-        if not os.path.exists(path):
-            return path
+            summary = (f"转换完成! 格式: {formats}\n  转换: {stats.converted} | 复制: {stats.copied} "
+                       f"| 跳过: {stats.skipped} | 未变: {stats.unchanged} | 错误: {stats.errors}")
+            if stats.original_size > 0:
+                summary += f"\n  总大小: {stats.size_summary()}"
+            memory = stats.memory_summary()
+            if memory:
+                summary += f"\n  峰值内存: {memory}"
+            report.finish()
+            timing = report.stage_summary()
+            if timing:
+                summary += f"\n  耗时: {report.elapsed:.1f}s ({timing})"
+            if log_path:
+                # 运行报告与日志文件同名，扩展名为 .report.json
+                report_path = os.path.splitext(log_path)[0] + ".report.json"
+                report.write_json(report_path)
+                summary += f"\n  运行报告: {report_path}"
+            self.log(summary, 'info')
             
-        base, ext = os.path.splitext(path)
-        counter = 1
-        while os.path.exists(f"{base}_{counter}{ext}"):
-            counter += 1
-        return f"{base}_{counter}{ext}"
-        
-    def format_size(self, size):
-        """格式化文件大小"""
-        for unit in ['B', 'KB', 'MB', 'GB']:
-            if size < 1024:
-                return f"{size:.1f}{unit}"
-            size /= 1024
-        return f"{size:.1f}TB"
+            if self.is_converting:
+                message = (f"转换完成! 格式: {formats}\n\n"
+                           f"✅ 转换: {stats.converted} 个文件\n"
+                           f"📋 复制: {stats.copied} 个文件\n"
+                           f"⏭ 跳过: {stats.skipped} 个文件 (转换后更大)\n"
+                           f"♻ 未变: {stats.unchanged} 个文件 (上次已转换)\n"
+                           f"❌ 错误: {stats.errors} 个文件\n\n")
+                if stats.original_size > 0:
+                    saved = stats.original_size - stats.new_size
+                    message += f"💾 总节省: {format_size(saved)} ({stats.saved_ratio:.1f}%)"
+        except Exception as e:
+            self.log(f"[错误] {e}", 'error')
+        finally:
+            self.close_log_file()
+            self.events.put(('finished', message))
         
     def reset_ui(self):
         self.is_converting = False
@@ -512,4 +564,6 @@ def main():
 
 
 if __name__ == "__main__":
+    # PyInstaller 打包后多进程需要此调用
+    multiprocessing.freeze_support()
     main()
\ No newline at end of file
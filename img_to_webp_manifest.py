@@ -0,0 +1,214 @@
+"""转换清单 (增量转换)
+
+在输出目录中保存一个 SQLite 数据库，记录每个源文件上次转换时的
+大小、修改时间、设置摘要和输出文件。再次运行时，未变化的文件直接跳过，
+只有新增或修改过的文件才会重新编码。
+
+另一张表按内容哈希记录转换过的内容和输出文件，移动、改名或复制的
+相同文件可以直接沿用已有的输出 (见 img_to_webp_dedup)。
+"""
+import hashlib
+import json
+import os
+import sqlite3
+
+MANIFEST_NAME = '.img_to_webp_manifest.sqlite'
+
+# 影响输出内容的设置项，任何一项变化都会使旧的转换结果失效
+_OUTPUT_SETTINGS = ('output_formats', 'widths', 'name_template', 'quality', 'lossless',
+                    'skip_larger', 'resize_large', 'max_size', 'keep_structure',
+                    'predict_threshold')
+
+
+def source_hash(settings_key, source):
+    """源目录记录的键: 设置摘要加上源目录的绝对路径
+
+    不同源目录中相对路径相同的文件转换到同一个输出目录时，各自的记录互不影响，
+    不会沿用 (覆盖) 另一个源目录的输出文件。
+    """
+    data = f"{settings_key}\0{os.path.realpath(source)}".encode('utf-8')
+    return hashlib.sha1(data).hexdigest()[:16]
+
+
+def root_hash(source):
+    """源目录的摘要 (与设置无关)，用于查找同一源文件在其他设置下的输出"""
+    return hashlib.sha1(os.path.realpath(source).encode('utf-8')).hexdigest()[:16]
+
+
+def settings_hash(settings):
+    """计算影响输出内容的设置摘要"""
+    values = {name: getattr(settings, name) for name in _OUTPUT_SETTINGS}
+    if values['lossless']:
+        # 无损模式下质量参数不起作用
+        values['quality'] = None
+    if not values['resize_large']:
+        values['max_size'] = None
+    if not values['predict_threshold'] or settings.verify_prediction:
+        # 不使用预测跳过时与旧版本的设置摘要保持一致
+        del values['predict_threshold']
+    data = json.dumps(values, sort_keys=True).encode('utf-8')
+    return hashlib.sha1(data).hexdigest()[:16]
+
+
+class ConversionManifest:
+    """输出目录中的转换清单
+
+    源文件以 (源文件相对路径, 设置摘要和源目录) 为键，内容以 (内容哈希, 设置摘要) 为键，
+    相同内容在不同源目录之间也可以沿用输出。打开时一次性读入当前设置下的
+    全部记录，之后的查询都是 O(1) 的字典查找。
+
+    设置改变后，同一源目录在其他设置下的输出也作为上次的输出返回，重新转换时覆盖或删除
+    这些文件，而不是在旧输出旁边另写一套 name_1；记录新结果时删除其他设置下的记录。
+    """
+
+    # 每记录多少条提交一次事务
+    COMMIT_EVERY = 200
+
+    def __init__(self, output_dir, settings, source):
+        self.output_dir = output_dir
+        self.settings_key = settings_hash(settings)
+        self.source_key = source_hash(self.settings_key, source)
+        self.root_key = root_hash(source)
+        self.path = os.path.join(output_dir, MANIFEST_NAME)
+        self.conn = sqlite3.connect(self.path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            " source TEXT NOT NULL,"
+            " settings TEXT NOT NULL,"  # 设置摘要和源目录 (source_hash)
+            " size INTEGER NOT NULL,"
+            " mtime_ns INTEGER NOT NULL,"
+            " output TEXT NOT NULL,"  # 输出文件相对路径，多个输出以换行分隔
+            " status TEXT NOT NULL,"
+            " root TEXT,"  # 源目录 (root_hash)
+            " PRIMARY KEY (source, settings))"
+        )
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(files)")}
+        if 'root' not in columns:
+            # 旧版本的清单: 已有记录没有源目录，不参与其他设置下输出的查找
+            self.conn.execute("ALTER TABLE files ADD COLUMN root TEXT")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS content ("
+            " key TEXT NOT NULL,"  # 内容哈希 (只复制的文件带 ':copy' 后缀)
+            " settings TEXT NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " status TEXT NOT NULL,"
+            " outputs TEXT NOT NULL,"  # 每行一个输出: 格式 宽度 状态 编码大小 文件大小 修改时间 相对路径，以制表符分隔
+            " PRIMARY KEY (key, settings))"
+        )
+        self.conn.commit()
+        rows = self.conn.execute(
+            "SELECT source, size, mtime_ns, output FROM files WHERE settings = ?",
+            (self.source_key,))
+        self.entries = {source: (size, mtime_ns, output.split('\n'))
+                        for source, size, mtime_ns, output in rows}
+        rows = self.conn.execute(
+            "SELECT source, output FROM files WHERE root = ? AND settings != ?",
+            (self.root_key, self.source_key))
+        self.replaced = {}  # 源文件 -> 其他设置下的输出
+        for source, output in rows:
+            self.replaced.setdefault(source, []).extend(output.split('\n'))
+        rows = self.conn.execute(
+            "SELECT key, size, status, outputs FROM content WHERE settings = ?",
+            (self.settings_key,))
+        self.contents = {key: (size, status, outputs) for key, size, status, outputs in rows}
+        self.content_sizes = {size for size, _, _ in self.contents.values()}
+        self._uncommitted = 0
+
+    def _abs_output(self, output):
+        return os.path.join(self.output_dir, *output.split('/'))
+
+    def is_unchanged(self, source, size, mtime_ns):
+        """源文件未变化且上次的输出文件都仍然存在时返回 True"""
+        entry = self.entries.get(source)
+        if entry is None or entry[0] != size or entry[1] != mtime_ns:
+            return False
+        return all(os.path.exists(self._abs_output(output)) for output in entry[2])
+
+    def previous_outputs(self, source):
+        """返回该源文件上次的输出路径列表 (绝对路径，包括其他设置下的输出)，没有则返回空列表"""
+        entry = self.entries.get(source)
+        outputs = list(entry[2]) if entry is not None else []
+        outputs.extend(self.replaced.get(source, ()))
+        return [self._abs_output(output) for output in dict.fromkeys(outputs)]
+
+    def record(self, source, size, mtime_ns, output_paths, status):
+        outputs = [os.path.relpath(path, self.output_dir).replace(os.sep, '/') for path in output_paths]
+        self.entries[source] = (size, mtime_ns, outputs)
+        self.conn.execute(
+            "INSERT OR REPLACE INTO files (source, settings, size, mtime_ns, output, status, root)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (source, self.source_key, size, mtime_ns, '\n'.join(outputs), status, self.root_key))
+        if self.replaced.pop(source, None) is not None:
+            # 其他设置下的输出已被本次的输出覆盖或删除，旧记录不再有效
+            self.conn.execute("DELETE FROM files WHERE source = ? AND root = ? AND settings != ?",
+                              (source, self.root_key, self.source_key))
+        self._tick()
+
+    def forget(self, source):
+        if self.entries.pop(source, None) is None:
+            return
+        self.conn.execute("DELETE FROM files WHERE source = ? AND settings = ?",
+                          (source, self.source_key))
+        self._tick()
+
+    def has_content_size(self, size):
+        """是否记录过该大小的内容 (大小不同的文件不需要计算哈希)"""
+        return size in self.content_sizes
+
+    def lookup_content(self, key):
+        """查找以前转换过的相同内容
+
+        返回 (状态, [(路径, 格式, 宽度, 编码大小, 状态), ...])；没有记录或输出文件已被
+        删除、修改时返回 None。
+        """
+        entry = self.contents.get(key)
+        if entry is None:
+            return None
+        _, status, text = entry
+        outputs = []
+        for line in text.split('\n'):
+            fmt, width, output_status, size, file_size, mtime_ns, output = line.split('\t', 6)
+            path = self._abs_output(output)
+            try:
+                st = os.stat(path)
+            except OSError:
+                return None
+            if st.st_size != int(file_size) or st.st_mtime_ns != int(mtime_ns):
+                return None
+            outputs.append((path, fmt or None, int(width) if width else None, int(size), output_status))
+        return status, outputs
+
+    def record_content(self, key, size, status, outputs):
+        """记录内容的转换结果，outputs 为 (路径, 格式, 宽度, 编码大小, 状态) 序列"""
+        lines = []
+        for path, fmt, width, output_size, output_status in outputs:
+            try:
+                st = os.stat(path)
+            except OSError:
+                return
+            rel = os.path.relpath(path, self.output_dir).replace(os.sep, '/')
+            lines.append('\t'.join((fmt or '', str(width or ''), output_status, str(output_size),
+                                    str(st.st_size), str(st.st_mtime_ns), rel)))
+        text = '\n'.join(lines)
+        self.contents[key] = (size, status, text)
+        self.content_sizes.add(size)
+        self.conn.execute(
+            "INSERT OR REPLACE INTO content (key, settings, size, status, outputs) VALUES (?, ?, ?, ?, ?)",
+            (key, self.settings_key, size, status, text))
+        self._tick()
+
+    def _tick(self):
+        self._uncommitted += 1
+        if self._uncommitted >= self.COMMIT_EVERY:
+            self.commit()
+
+    def commit(self):
+        if self._uncommitted:
+            self.conn.commit()
+            self._uncommitted = 0
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
@@ -0,0 +1,271 @@
+"""转换耗时统计与运行报告
+
+StageTimer 在转换单个文件时 (通常在工作进程中) 按阶段记录墙钟时间和
+CPU 时间，以及读写的字节数，结果随 ConvertResult 一起返回主进程。
+RunReport 在主进程中汇总全部结果，输出 JSON / CSV 报告: 各阶段的总耗时和
+百分位数、最慢的文件，以及跳过、复制和错误的原因。
+检验预测模式下还会统计各阈值下预测跳过的准确率和召回率。
+动画单独统计帧数、编码耗时和峰值内存。
+"""
+import csv
+import json
+import time
+from collections import Counter, deque, namedtuple
+from contextlib import contextmanager
+from dataclasses import asdict
+from types import SimpleNamespace
+
+# 单个文件的耗时统计
+# stages: ((阶段, 格式或复制方式或 None, 墙钟秒数, CPU 秒数), ...)，同一阶段和格式的多次耗时已累加
+FileMetrics = namedtuple('FileMetrics', ['stages', 'bytes_read', 'bytes_written', 'wall', 'cpu'])
+
+# 阶段名称 (按转换顺序排列)
+STAGE_LABELS = {
+    'predict': '预测',
+    'decode': '解码',
+    'normalize': '模式转换',
+    'resize': '缩放',
+    'encode': '编码',
+    'write': '写入',
+    'copy': '复制',
+}
+
+PERCENTILES = (50, 90, 99)
+
+# 检验预测准确率时统计的置信度阈值
+PREDICTION_THRESHOLDS = (0.5, 0.6, 0.7, 0.8, 0.9)
+
+# 报告中的秒数保留到微秒
+_DIGITS = 6
+
+
+class StageTimer:
+    """按阶段累计单个文件的耗时
+
+    CPU 时间使用 thread_time()，单线程模式下不会混入扫描线程的 CPU 时间。
+    """
+
+    def __init__(self):
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self._stages = {}  # (阶段, 格式) -> [墙钟秒数, CPU 秒数]
+        self._wall = time.perf_counter()
+        self._cpu = time.thread_time()
+
+    @contextmanager
+    def stage(self, name, output_format=None):
+        """记录一个阶段的耗时；可在阶段内设置返回对象的 variant (如复制时实际使用的方式)"""
+        wall = time.perf_counter()
+        cpu = time.thread_time()
+        current = SimpleNamespace(variant=output_format)
+        try:
+            yield current
+        finally:
+            entry = self._stages.setdefault((name, current.variant), [0.0, 0.0])
+            entry[0] += time.perf_counter() - wall
+            entry[1] += time.thread_time() - cpu
+
+    def metrics(self):
+        stages = tuple((name, fmt, wall, cpu) for (name, fmt), (wall, cpu) in self._stages.items())
+        return FileMetrics(stages, self.bytes_read, self.bytes_written,
+                           time.perf_counter() - self._wall, time.thread_time() - self._cpu)
+
+
+def percentile(values, p):
+    """已排序列表的百分位数 (线性插值)"""
+    if not values:
+        return 0.0
+    k = (len(values) - 1) * p / 100
+    low = int(k)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (k - low)
+
+
+def _distribution(values):
+    values = sorted(values)
+    summary = {'count': len(values), 'total': round(sum(values), _DIGITS)}
+    for p in PERCENTILES:
+        summary[f'p{p}'] = round(percentile(values, p), _DIGITS)
+    summary['max'] = round(values[-1], _DIGITS) if values else 0.0
+    return summary
+
+
+def _stage_key(name, output_format):
+    return f"{name}:{output_format}" if output_format else name
+
+
+class RunReport:
+    """汇总一次转换的耗时和结果，生成机器可读的报告
+
+    slowest: 报告中列出的最慢文件数
+    max_rows: 最多保留多少个文件的明细 (CSV 行、耗时样本、预测和动画记录)，超出时只保留最近的；
+        文件数、各阶段总耗时等累计值仍包含全部文件。None 表示不限制，长时间运行的监视模式需要指定
+    """
+
+    CSV_FIELDS = ['file', 'status', 'reason', 'effort', 'frames', 'original_size', 'new_size',
+                  'bytes_read', 'bytes_written', 'wall', 'cpu']
+
+    def __init__(self, settings=None, slowest=10, max_rows=None):
+        self.settings = settings
+        self.slowest = slowest
+        self.max_rows = max_rows
+        self.started = time.time()
+        self.finished = None
+        self.files = 0
+        self.timed_files = 0  # 有耗时记录 (实际读写过) 的文件数
+        self._timed_total = 0.0  # 这些文件的墙钟秒数之和
+        self.rows = deque(maxlen=max_rows)  # 每个文件一行 (dict)
+        self.reasons = Counter()  # (状态, 原因) -> 文件数
+        self.efforts = Counter()  # 编码强度 -> 文件数
+        self.predictions = deque(maxlen=max_rows)  # (置信度, 实际是否变大)，只包含实际编码过的文件
+        self.animations = deque(maxlen=max_rows)  # 动画文件的行 (包含帧数、编码秒数和峰值内存)
+        self._animation_totals = Counter()  # 'files' / 'frames' / 'encode' 的累计值
+        self._stage_walls = {}  # 阶段键 -> [每个文件的墙钟秒数]
+        self._stage_count = Counter()  # 阶段键 -> 文件数
+        self._stage_total = Counter()  # 阶段键 -> 墙钟秒数
+        self._stage_cpu = Counter()  # 阶段键 -> CPU 秒数
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.peak_rss = 0
+
+    def add(self, result):
+        self.files += 1
+        reason = result.reason
+        if result.status == 'error' and not reason:
+            reason = 'error'
+        self.reasons[(result.status, reason or '')] += 1
+        if result.peak_rss and result.peak_rss > self.peak_rss:
+            self.peak_rss = result.peak_rss
+
+        if result.effort is not None:
+            self.efforts[result.effort] += 1
+        if result.prediction is not None and result.reason != 'predicted' and result.status in ('convert', 'skip'):
+            # 所有输出都比原文件大时才算作 "不会变小"
+            self.predictions.append((result.prediction, result.status == 'skip'))
+
+        row = {'file': result.filepath, 'status': result.status, 'reason': reason or '',
+               'effort': '' if result.effort is None else result.effort,
+               'frames': result.frames or '',
+               'original_size': result.original_size, 'new_size': result.new_size,
+               'bytes_read': 0, 'bytes_written': 0, 'wall': 0.0, 'cpu': 0.0}
+        metrics = result.metrics
+        if metrics is not None:
+            row.update(bytes_read=metrics.bytes_read, bytes_written=metrics.bytes_written,
+                       wall=round(metrics.wall, _DIGITS), cpu=round(metrics.cpu, _DIGITS))
+            self.bytes_read += metrics.bytes_read
+            self.bytes_written += metrics.bytes_written
+            for name, fmt, wall, cpu in metrics.stages:
+                key = _stage_key(name, fmt)
+                row[key] = round(wall, _DIGITS)
+                self._stage_walls.setdefault(key, deque(maxlen=self.max_rows)).append(wall)
+                self._stage_count[key] += 1
+                self._stage_total[key] += wall
+                self._stage_cpu[key] += cpu
+        if row['wall'] > 0:
+            self.timed_files += 1
+            self._timed_total += metrics.wall
+        self.rows.append(row)
+        if result.frames and result.status != 'error':
+            encode = sum(wall for name, _, wall, _ in metrics.stages if name == 'encode') if metrics else 0.0
+            self.animations.append({'file': result.filepath, 'frames': result.frames,
+                                    'encode': round(encode, _DIGITS), 'wall': row['wall'],
+                                    'peak_rss': result.peak_rss})
+            self._animation_totals.update(files=1, frames=result.frames, encode=encode)
+
+    def finish(self):
+        self.finished = time.time()
+
+    @property
+    def elapsed(self):
+        return (self.finished or time.time()) - self.started
+
+    def _ordered_stages(self):
+        order = list(STAGE_LABELS)
+        return sorted(self._stage_walls, key=lambda key: (order.index(key.split(':')[0]), key))
+
+    def to_dict(self):
+        timed = [row for row in self.rows if row['wall'] > 0]
+        elapsed = self.elapsed
+        stages = {}
+        for key in self._ordered_stages():
+            # 百分位数根据保留的样本计算，文件数和总耗时包含全部文件
+            stages[key] = _distribution(self._stage_walls[key])
+            stages[key].update(count=self._stage_count[key], total=round(self._stage_total[key], _DIGITS),
+                               cpu=round(self._stage_cpu[key], _DIGITS))
+        slowest = sorted(timed, key=lambda row: row['wall'], reverse=True)[:self.slowest]
+        return {
+            'started': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.started)),
+            'elapsed': round(elapsed, _DIGITS),
+            'settings': asdict(self.settings) if self.settings is not None else None,
+            'files': self.files,
+            'files_per_second': round(self.timed_files / elapsed, 3) if elapsed > 0 else 0.0,
+            'bytes_read': self.bytes_read,
+            'bytes_written': self.bytes_written,
+            'peak_rss': self.peak_rss or None,
+            'status': [{'status': status, 'reason': reason, 'count': count}
+                       for (status, reason), count in sorted(self.reasons.items())],
+            'effort': {str(level): count for level, count in sorted(self.efforts.items(), reverse=True)},
+            'prediction': self.prediction_summary() if self.predictions else None,
+            'animations': self.animation_summary() if self.animations else None,
+            'file_time': dict(_distribution([row['wall'] for row in timed]), count=self.timed_files,
+                              total=round(self._timed_total, _DIGITS)),
+            'stages': stages,
+            'slowest': slowest,
+        }
+
+    def write_json(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False, indent=2)
+
+    def write_csv(self, path):
+        """每个文件一行，各阶段的墙钟秒数按阶段键单独成列"""
+        fields = self.CSV_FIELDS + self._ordered_stages()
+        with open(path, 'w', encoding='utf-8', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=fields, restval='')
+            writer.writeheader()
+            writer.writerows(self.rows)
+
+    def stage_summary(self):
+        """各阶段总耗时说明 (如 "解码 1.2s | 编码:webp 3.4s")，没有耗时记录时返回 None"""
+        parts = []
+        for key in self._ordered_stages():
+            name, _, fmt = key.partition(':')
+            label = STAGE_LABELS.get(name, name) + (f":{fmt.upper()}" if fmt else '')
+            parts.append(f"{label} {self._stage_total[key]:.1f}s")
+        return " | ".join(parts) or None
+
+    def prediction_summary(self, thresholds=PREDICTION_THRESHOLDS):
+        """各阈值下的预测效果
+
+        precision: 预测跳过的文件中实际变大的比例；recall: 实际变大的文件中被预测到的比例
+        """
+        larger = sum(1 for _, grew in self.predictions if grew)
+        rows = []
+        for threshold in thresholds:
+            predicted = [grew for score, grew in self.predictions if score >= threshold]
+            correct = sum(predicted)
+            rows.append({
+                'threshold': threshold,
+                'predicted': len(predicted),
+                'correct': correct,
+                'precision': round(correct / len(predicted), 4) if predicted else None,
+                'recall': round(correct / larger, 4) if larger else None,
+            })
+        return {'files': len(self.predictions), 'larger': larger, 'thresholds': rows}
+
+    def animation_summary(self):
+        """动画的总帧数和编码耗时，以及编码最慢的动画 (peak_rss 为工作进程的峰值内存)"""
+        totals = self._animation_totals
+        frames = totals['frames']
+        encode = totals['encode']
+        return {
+            'files': totals['files'],
+            'frames': frames,
+            'encode': round(encode, _DIGITS),
+            'frames_per_second': round(frames / encode, 3) if encode > 0 else None,
+            'slowest': sorted(self.animations, key=lambda row: row['encode'], reverse=True)[:self.slowest],
+        }
+
+    def effort_summary(self):
+        """各编码强度的文件数 (如 "6×120, 4×35")"""
+        return ", ".join(f"{level}×{count}" for level, count in sorted(self.efforts.items(), reverse=True))
@@ -0,0 +1,458 @@
+"""本地 HTTP 转换服务
+
+其他服务可以通过 HTTP 按需转换单张图片，不必每次启动进程、导入 PIL 和 AVIF 插件。
+
+用法示例:
+    python img_to_webp_server.py --port 8765 --workers 4
+    curl --data-binary @photo.jpg "http://127.0.0.1:8765/convert?format=avif&quality=70" -o photo.avif
+
+接口:
+    POST /convert   请求体为图片内容，查询参数 format (webp / avif)、quality (1-100)、
+                    lossless (0 / 1)、width (输出宽度，可选)、effort (编码强度 0-6，可选)；
+                    响应为编码后的图片
+    GET /metrics    请求数、缓存命中率、在途请求数和延迟百分位数 (JSON)
+    GET /healthz    进程池可用时返回 ok，否则返回 503
+
+请求交给启动时创建的常驻进程池 (已预先加载编码器)。在途请求达到上限时立即返回
+503 和 Retry-After，而不是无限排队。相同内容和参数的结果保存在 LRU 缓存中。
+"""
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from img_to_webp_archive import convert_member
+from img_to_webp_core import (AVIF_SUPPORTED, MAX_EFFORT, ConvertJob, format_size, init_warm_worker,
+                              parse_formats)
+from img_to_webp_report import percentile
+
+CONTENT_TYPES = {'webp': 'image/webp', 'avif': 'image/avif'}
+
+# 计算延迟百分位数时保留的最近请求数
+LATENCY_WINDOW = 1024
+
+
+class ServiceBusy(Exception):
+    """在途请求已达上限"""
+
+
+class ConversionFailed(Exception):
+    """图片无法解码或编码"""
+
+
+class WorkerCrashed(Exception):
+    """工作进程异常退出 (如内存不足被系统终止、解码器崩溃)，进程池已重建"""
+
+
+class ResponseCache:
+    """编码结果的 LRU 缓存，键为内容哈希和转换参数，按总字节数限制大小"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, key):
+        with self._lock:
+            data = self._items.get(key)
+            if data is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return data
+
+    def put(self, key, data):
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._items.pop(key, None)
+            if previous is not None:
+                self.size -= len(previous)
+            self._items[key] = data
+            self.size += len(data)
+            while self.size > self.max_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self.size -= len(evicted)
+
+
+class ConversionService:
+    """常驻进程池、背压、缓存和指标 (与 HTTP 无关，也可以直接调用 convert())
+
+    max_pending: 同时在途 (读取请求体、排队或执行中) 的请求数上限，默认为进程数的 2 倍
+    cache_bytes: 响应缓存的大小上限，0 表示不缓存
+    warm_formats: 工作进程启动时预先加载的输出格式
+    """
+
+    def __init__(self, workers=None, max_pending=0, cache_bytes=64 * 1024 * 1024, warm_formats=('webp',)):
+        self.workers = workers or os.cpu_count() or 1
+        self.max_pending = max_pending or self.workers * 2
+        self.cache = ResponseCache(cache_bytes)
+        self.started = time.time()
+        self.requests = 0
+        self.rejected = 0
+        self.errors = 0
+        self.restarts = 0  # 工作进程异常退出后重建进程池的次数
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.warm_formats = tuple(warm_formats)
+        self._latency = deque(maxlen=LATENCY_WINDOW)  # 每个请求的处理秒数 (含缓存命中)
+        self._convert = deque(maxlen=LATENCY_WINDOW)  # 未命中缓存时工作进程中的转换秒数
+        self._lock = threading.Lock()
+        self._pool_lock = threading.Lock()  # 重建进程池时持有
+        self._executor = self._start_pool()
+
+    def _start_pool(self):
+        executor = ProcessPoolExecutor(max_workers=self.workers, initializer=init_warm_worker,
+                                       initargs=(self.warm_formats,))
+        try:
+            # 预先启动全部工作进程，第一个请求不需要等待进程启动
+            for future in [executor.submit(os.getpid) for _ in range(self.workers)]:
+                future.result()
+        except BaseException:
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
+        return executor
+
+    def _restart(self, broken):
+        """工作进程异常退出后重建进程池；多个请求同时发现时只重建一次"""
+        with self._pool_lock:
+            if self._executor is not broken:
+                return
+            broken.shutdown(wait=False, cancel_futures=True)
+            self._executor = self._start_pool()
+            with self._lock:
+                self.restarts += 1
+
+    def healthy(self):
+        """进程池是否可用；发现工作进程已退出时立即重建，重建失败返回 False"""
+        executor = self._executor
+        # ProcessPoolExecutor 没有公开的状态接口，工作进程退出后 _broken 为原因说明
+        if not getattr(executor, '_broken', False):
+            return True
+        try:
+            self._restart(executor)
+        except (OSError, BrokenProcessPool):
+            return False
+        return True
+
+    def close(self):
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+    def convert(self, data, output_format='webp', quality=85, lossless=False, width=None, effort=MAX_EFFORT,
+                reserved=False):
+        """转换一张图片，返回 (编码后的内容, 是否命中缓存)
+
+        在途请求已达上限时抛出 ServiceBusy，图片无法转换时抛出 ConversionFailed，
+        工作进程在转换期间异常退出时重建进程池并抛出 WorkerCrashed。
+        reserved: 调用方已经通过 reserve() 占用了在途名额
+        """
+        started = time.perf_counter()
+        if lossless:
+            quality = 100
+        key = (hashlib.blake2b(data, digest_size=20).hexdigest(), output_format, quality, lossless, width, effort)
+        with self._lock:
+            self.requests += 1
+        output = self.cache.get(key)
+        cached = output is not None
+        if not cached:
+            try:
+                if reserved:
+                    output = self._run(data, output_format, quality, lossless, width, effort)
+                else:
+                    with self.reserve():
+                        output = self._run(data, output_format, quality, lossless, width, effort)
+            except (ConversionFailed, WorkerCrashed):
+                self._record(started)
+                raise
+            self.cache.put(key, output)
+        self._record(started)
+        return output, cached
+
+    @contextmanager
+    def reserve(self):
+        """占用一个在途名额，已达上限时抛出 ServiceBusy
+
+        HTTP 处理在读取请求体之前占用名额，上限同时限制了读入内存的请求体数量；
+        在名额内调用 convert() 时传入 reserved=True。
+        """
+        with self._lock:
+            if self.in_flight >= self.max_pending:
+                self.rejected += 1
+                raise ServiceBusy(f"在途请求已达上限 ({self.max_pending})")
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+    def _record(self, started):
+        # 被拒绝的请求不计入延迟
+        with self._lock:
+            self._latency.append(time.perf_counter() - started)
+
+    def _run(self, data, output_format, quality, lossless, width, effort):
+        # 输出不写入磁盘，输出路径只作为 payloads 中的标识；始终返回编码结果，不比较大小
+        job = ConvertJob(filepath='<request>', filename='request', out_dir='',
+                         targets=((output_format, width, output_format),), output_path=None,
+                         fallback_path=None, quality=quality, lossless=lossless, skip_larger=False,
+                         resize_large=False, max_size=0, previous_outputs=(), mem_cost=0,
+                         effort=effort, data=data)
+        executor = self._executor
+        try:
+            result, payloads = executor.submit(convert_member, job).result()
+        except BrokenProcessPool:
+            with self._lock:
+                self.errors += 1
+            try:
+                self._restart(executor)
+            except (OSError, BrokenProcessPool) as e:
+                raise WorkerCrashed(f"工作进程异常退出，重建进程池失败: {e}") from None
+            raise WorkerCrashed("工作进程异常退出，进程池已重建") from None
+        if result.status == 'error':
+            with self._lock:
+                self.errors += 1
+            if result.reason == 'UnidentifiedImageError':
+                raise ConversionFailed("无法识别的图片格式")
+            raise ConversionFailed(result.error)
+        if result.metrics is not None:
+            with self._lock:
+                self._convert.append(result.metrics.wall)
+        return payloads[0][1]
+
+    def metrics(self):
+        with self._lock:
+            latency = sorted(self._latency)
+            convert = sorted(self._convert)
+            lookups = self.cache.hits + self.cache.misses
+            return {
+                'uptime': round(time.time() - self.started, 3),
+                'workers': self.workers,
+                'requests': self.requests,
+                'rejected': self.rejected,
+                'errors': self.errors,
+                'restarts': self.restarts,
+                'in_flight': self.in_flight,
+                'queued': max(0, self.in_flight - self.workers),
+                'max_in_flight': self.max_in_flight,
+                'max_pending': self.max_pending,
+                'cache': {
+                    'entries': len(self.cache),
+                    'bytes': self.cache.size,
+                    'max_bytes': self.cache.max_bytes,
+                    'hits': self.cache.hits,
+                    'misses': self.cache.misses,
+                    'hit_rate': round(self.cache.hits / lookups, 4) if lookups else None,
+                },
+                'latency_ms': _percentiles(latency),
+                'convert_ms': _percentiles(convert),
+            }
+
+
+def _percentiles(values):
+    """已排序的秒数 -> 毫秒百分位数"""
+    if not values:
+        return None
+    summary = {'count': len(values)}
+    for p in (50, 90, 99):
+        summary[f'p{p}'] = round(percentile(values, p) * 1000, 3)
+    summary['max'] = round(values[-1] * 1000, 3)
+    return summary
+
+
+def _parse_params(query):
+    """解析 /convert 的查询参数，参数无效时抛出 ValueError"""
+    params = {key: values[-1] for key, values in parse_qs(query).items()}
+    output_format = params.get('format', 'webp').lower()
+    if output_format not in CONTENT_TYPES:
+        raise ValueError(f"不支持的输出格式: {output_format}")
+    if output_format == 'avif' and not AVIF_SUPPORTED:
+        raise ValueError("AVIF 格式需要安装 pillow-avif-plugin")
+    quality = int(params.get('quality', 85))
+    if not 1 <= quality <= 100:
+        raise ValueError("quality 应在 1-100 之间")
+    lossless = params.get('lossless', '0').lower() in ('1', 'true', 'yes')
+    width = int(params['width']) if params.get('width') else None
+    if width is not None and width <= 0:
+        raise ValueError("width 应为正整数")
+    effort = int(params.get('effort', MAX_EFFORT))
+    if not 0 <= effort <= MAX_EFFORT:
+        raise ValueError(f"effort 应在 0-{MAX_EFFORT} 之间")
+    return output_format, quality, lossless, width, effort
+
+
+class ConversionHandler(BaseHTTPRequestHandler):
+    server_version = "img_to_webp"
+    protocol_version = "HTTP/1.1"
+
+    def _send(self, code, body, content_type='application/json; charset=utf-8', headers=()):
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _error(self, code, message, headers=()):
+        body = json.dumps({'error': message}, ensure_ascii=False).encode('utf-8')
+        self._send(code, body, headers=headers)
+
+    def do_GET(self):
+        path = urlsplit(self.path).path
+        if path == '/healthz':
+            if self.server.service.healthy():
+                self._send(200, b'ok\n', 'text/plain; charset=utf-8')
+            else:
+                self._send(503, "工作进程不可用\n".encode('utf-8'), 'text/plain; charset=utf-8')
+        elif path == '/metrics':
+            body = json.dumps(self.server.service.metrics(), ensure_ascii=False, indent=2).encode('utf-8')
+            self._send(200, body)
+        else:
+            self._error(404, "未知路径")
+
+    def do_POST(self):
+        # 提前返回时请求体尚未读取，必须关闭连接，否则请求体会被当作下一个请求解析
+        url = urlsplit(self.path)
+        if url.path != '/convert':
+            self.close_connection = True
+            self._error(404, "未知路径")
+            return
+        length = self.headers.get('Content-Length')
+        if length is None:
+            self.close_connection = True
+            self._error(411, "需要 Content-Length")
+            return
+        try:
+            length = int(length)
+        except ValueError:
+            length = -1
+        if length < 0:
+            self.close_connection = True
+            self._error(400, "无效的 Content-Length")
+            return
+        if length > self.server.max_body:
+            self.close_connection = True
+            self._error(413, f"图片超过 {format_size(self.server.max_body)}")
+            return
+        try:
+            output_format, quality, lossless, width, effort = _parse_params(url.query)
+        except ValueError as e:
+            self.close_connection = True
+            self._error(400, str(e))
+            return
+
+        service = self.server.service
+        started = time.perf_counter()
+        try:
+            # 先占用在途名额再读取请求体，繁忙时不把请求体读入内存
+            with service.reserve():
+                data = self.rfile.read(length)
+                if len(data) < length:
+                    # 客户端在发送完请求体之前断开
+                    self.close_connection = True
+                    return
+                output, cached = service.convert(data, output_format, quality, lossless, width, effort,
+                                                 reserved=True)
+        except ServiceBusy as e:
+            self.close_connection = True
+            self._error(503, str(e), headers=[('Retry-After', '1')])
+            return
+        except ConversionFailed as e:
+            self._error(422, str(e))
+            return
+        except WorkerCrashed as e:
+            self._error(500, str(e))
+            return
+        elapsed = (time.perf_counter() - started) * 1000
+        self._send(200, output, CONTENT_TYPES[output_format], headers=[
+            ('X-Cache', 'hit' if cached else 'miss'),
+            ('X-Original-Size', str(len(data))),
+            ('X-Convert-Time-Ms', f"{elapsed:.1f}"),
+        ])
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class ConversionServer(ThreadingHTTPServer):
+    """每个连接一个线程的 HTTP 服务，转换由 service 的进程池执行
+
+    address 的端口为 0 时由系统分配，实际端口见 server_address。
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address, service, max_body=64 * 1024 * 1024, verbose=False):
+        super().__init__(address, ConversionHandler)
+        self.service = service
+        self.max_body = max_body
+        self.verbose = verbose
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="本地 HTTP 图片转换服务")
+    parser.add_argument('--host', default='127.0.0.1', help="监听地址 (默认: 127.0.0.1，只接受本机连接)")
+    parser.add_argument('--port', type=int, default=8765, help="监听端口 (默认: 8765)")
+    parser.add_argument('-j', '--workers', type=int, default=os.cpu_count() or 1,
+                        help="工作进程数 (默认: CPU 核心数)")
+    parser.add_argument('--max-pending', type=int, default=0, metavar='N',
+                        help="同时在途的转换数上限，超出时返回 503 (默认: 进程数的 2 倍)")
+    parser.add_argument('--cache-mb', type=int, default=64, help="响应缓存大小 (MB)，0 表示不缓存 (默认: 64)")
+    parser.add_argument('--max-body-mb', type=int, default=64, help="请求图片的大小上限 (MB) (默认: 64)")
+    parser.add_argument('-f', '--format', dest='output_formats', type=parse_formats,
+                        default=('webp',), help="启动时预先加载的输出格式，如 webp,avif (默认: webp)")
+    parser.add_argument('--verbose', action='store_true', help="输出每个请求的访问日志")
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if "avif" in args.output_formats and not AVIF_SUPPORTED:
+        parser.error("AVIF 格式需要安装 pillow-avif-plugin (pip install pillow-avif-plugin)")
+
+    service = ConversionService(max(1, args.workers), max(0, args.max_pending),
+                                max(0, args.cache_mb) * 1024 * 1024, args.output_formats)
+    try:
+        server = ConversionServer((args.host, args.port), service, max(1, args.max_body_mb) * 1024 * 1024,
+                                  args.verbose)
+    except OSError as e:
+        service.close()
+        print(f"无法监听 {args.host}:{args.port}: {e}", file=sys.stderr)
+        return 1
+    host, port = server.server_address[:2]
+    print(f"转换服务已启动: http://{host}:{port} (进程数: {service.workers}，"
+          f"在途上限: {service.max_pending})，按 Ctrl+C 结束", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("转换服务已停止", flush=True)
+    finally:
+        server.server_close()
+        service.close()
+    return 0
+
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    sys.exit(main())
@@ -0,0 +1,369 @@
+"""监视模式: 持续监视源目录，新图片写入完成后立即转换
+
+Linux 上通过 inotify (ctypes 调用 libc，无需额外依赖) 接收目录事件；其他平台或
+inotify 不可用时退回轮询: 每次只 stat 已知的目录，修改时间变化的目录才重新 scandir，
+不会反复扫描整个目录树。
+
+仍在写入的文件不会被转换: 文件在 settle 秒内没有新的事件、大小和修改时间也不再
+变化时才视为写入完成。进程池在开始监视前启动并预先加载编码器，之后一直保留，
+新文件不需要等待进程启动。
+"""
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import time
+
+from img_to_webp_core import (SUPPORTED_FORMATS, TARGET_FORMATS, WAITING, ConversionSession, FileDiscovery,
+                              SourceFile, create_engine)
+
+# inotify 事件 (linux/inotify.h)
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+_WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+# struct inotify_event: wd, mask, cookie, len，之后是 len 字节的文件名 (以 \0 填充)
+_EVENT = struct.Struct('iIII')
+
+DEFAULT_SETTLE = 0.3
+DEFAULT_POLL_INTERVAL = 1.0
+
+
+def _is_candidate(name):
+    """是否为需要转换的图片文件名 (忽略隐藏文件和临时文件)"""
+    if name.startswith(('.', '~')):
+        return False
+    ext = os.path.splitext(name)[1].lower()
+    return ext in SUPPORTED_FORMATS or ext in TARGET_FORMATS
+
+
+class _TreeFilter:
+    """判断路径是否在监视范围内: 不递归时只包含源目录本身，始终排除输出目录"""
+
+    def __init__(self, source, recursive, exclude=()):
+        self.source = os.path.abspath(source)
+        self.recursive = recursive
+        self.exclude = [os.path.abspath(path) for path in exclude]
+
+    def excluded(self, path):
+        return any(path == root or path.startswith(root + os.sep) for root in self.exclude)
+
+    def watch_dir(self, path):
+        if self.excluded(path):
+            return False
+        return self.recursive or path == self.source
+
+    def iter_dirs(self, top):
+        """top 及其下所有需要监视的目录"""
+        stack = [top]
+        while stack:
+            path = stack.pop()
+            if not self.watch_dir(path):
+                continue
+            yield path
+            if not self.recursive:
+                continue
+            try:
+                with os.scandir(path) as it:
+                    stack.extend(entry.path for entry in it if entry.is_dir(follow_symlinks=False))
+            except OSError:
+                continue
+
+
+def _list_files(path):
+    """目录中的图片文件路径"""
+    try:
+        with os.scandir(path) as it:
+            return [entry.path for entry in it if _is_candidate(entry.name) and entry.is_file()]
+    except OSError:
+        return []
+
+
+class InotifyWatcher:
+    """基于 inotify 的目录监视 (仅 Linux)
+
+    每个目录一个 watch，新建或移入的子目录会立即加入监视并列出其中已有的文件
+    (子目录创建后、加入监视前写入的文件不会产生事件)。事件队列溢出时重新列出全部目录。
+    """
+
+    method = 'inotify'
+
+    def __init__(self, source, recursive=True, exclude=()):
+        self.filter = _TreeFilter(source, recursive, exclude)
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        self._fd = fd
+        self._dirs = {}  # watch 描述符 -> 目录路径
+        try:
+            for path in self.filter.iter_dirs(self.filter.source):
+                self._watch(path, strict=path == self.filter.source)
+        except OSError:
+            self.close()
+            raise
+
+    def _watch(self, path, strict=False):
+        wd = self._add_watch(self._fd, os.fsencode(path), _WATCH_MASK | IN_ONLYDIR)
+        if wd < 0:
+            err = ctypes.get_errno()
+            # 监视数量达到上限时无法可靠地监视，由调用方退回轮询
+            if strict or err == errno.ENOSPC:
+                raise OSError(err, f"inotify_add_watch: {os.strerror(err)}", path)
+            return False
+        # 同一目录在树内改名后再次加入会得到相同的描述符，更新为新路径
+        self._dirs[wd] = path
+        return True
+
+    def _add_tree(self, top):
+        """开始监视新出现的目录树，返回其中已有的文件"""
+        files = []
+        for path in self.filter.iter_dirs(top):
+            if self._watch(path):
+                files.extend(_list_files(path))
+        return files
+
+    def _rescan(self):
+        files = []
+        for path in list(self._dirs.values()):
+            files.extend(_list_files(path))
+        return files
+
+    def poll(self, timeout):
+        """等待最多 timeout 秒，返回有变化的文件路径列表"""
+        try:
+            readable, _, _ = select.select([self._fd], [], [], timeout)
+        except InterruptedError:
+            return []
+        if not readable:
+            return []
+        data = bytearray()
+        while True:
+            try:
+                chunk = os.read(self._fd, 65536)
+            except BlockingIOError:
+                break
+            if not chunk:
+                break
+            data += chunk
+
+        changed = []
+        offset = 0
+        while offset + _EVENT.size <= len(data):
+            wd, mask, _, length = _EVENT.unpack_from(data, offset)
+            name = bytes(data[offset + _EVENT.size:offset + _EVENT.size + length]).rstrip(b'\0')
+            offset += _EVENT.size + length
+            if mask & IN_Q_OVERFLOW:
+                changed.extend(self._rescan())
+                continue
+            if mask & IN_IGNORED:
+                self._dirs.pop(wd, None)
+                continue
+            directory = self._dirs.get(wd)
+            if directory is None or not name:
+                continue
+            path = os.path.join(directory, os.fsdecode(name))
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO) and self.filter.recursive:
+                    changed.extend(self._add_tree(path))
+            elif _is_candidate(os.path.basename(path)):
+                changed.append(path)
+        return changed
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+
+class PollingWatcher:
+    """轮询监视: 每次只 stat 已知的目录，修改时间变化的目录才重新列出
+
+    新建、移入和改名的文件会使所在目录的修改时间变化；原地覆盖已有文件不会，
+    轮询模式下不会发现这类修改 (inotify 模式可以)。
+    """
+
+    method = 'polling'
+
+    def __init__(self, source, recursive=True, exclude=()):
+        self.filter = _TreeFilter(source, recursive, exclude)
+        self._dirs = {}  # 目录 -> (修改时间, {文件名: (大小, 修改时间)})
+        for path in self.filter.iter_dirs(self.filter.source):
+            self._list(path)
+
+    def _list(self, path):
+        """重新列出目录，返回新出现或有变化的文件，以及新出现的子目录"""
+        try:
+            mtime_ns = os.stat(path).st_mtime_ns
+            with os.scandir(path) as it:
+                entries = list(it)
+        except OSError:
+            self._dirs.pop(path, None)
+            return [], []
+        _, known = self._dirs.get(path, (None, {}))
+        files = {}
+        changed = []
+        subdirs = []
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    if entry.path not in self._dirs:
+                        subdirs.append(entry.path)
+                elif _is_candidate(entry.name) and entry.is_file():
+                    st = entry.stat()
+                    files[entry.name] = (st.st_size, st.st_mtime_ns)
+                    if known.get(entry.name) != files[entry.name]:
+                        changed.append(entry.path)
+            except OSError:
+                continue
+        self._dirs[path] = (mtime_ns, files)
+        return changed, subdirs
+
+    def poll(self, timeout):
+        time.sleep(timeout)
+        changed = []
+        for path, (mtime_ns, _) in list(self._dirs.items()):
+            try:
+                if os.stat(path).st_mtime_ns == mtime_ns:
+                    continue
+            except OSError:
+                self._dirs.pop(path, None)
+                continue
+            files, subdirs = self._list(path)
+            changed.extend(files)
+            if not self.filter.recursive:
+                continue
+            for subdir in subdirs:
+                for new_dir in self.filter.iter_dirs(subdir):
+                    files, _ = self._list(new_dir)
+                    changed.extend(files)
+        return changed
+
+    def close(self):
+        pass
+
+
+def create_watcher(source, recursive=True, exclude=(), polling=False):
+    """优先使用 inotify，不可用时 (非 Linux、监视数量超出上限等) 使用轮询"""
+    if not polling and hasattr(select, 'select') and os.name == 'posix':
+        try:
+            return InotifyWatcher(source, recursive, exclude)
+        except (OSError, AttributeError):
+            pass
+    return PollingWatcher(source, recursive, exclude)
+
+
+class SettleTracker:
+    """等待文件写入完成: settle 秒内没有新的事件，且大小和修改时间不再变化"""
+
+    def __init__(self, settle=DEFAULT_SETTLE):
+        self.settle = settle
+        self._pending = {}  # 路径 -> (大小, 修改时间, 最后一次变化的时刻)
+
+    def __len__(self):
+        return len(self._pending)
+
+    def touch(self, path, now=None):
+        """文件有新的事件，重新开始计时"""
+        now = time.monotonic() if now is None else now
+        try:
+            st = os.stat(path)
+        except OSError:
+            self._pending.pop(path, None)
+            return
+        self._pending[path] = (st.st_size, st.st_mtime_ns, now)
+
+    def timeout(self, limit, now=None):
+        """距离下一个文件可能写入完成的秒数，最多 limit"""
+        if not self._pending:
+            return limit
+        now = time.monotonic() if now is None else now
+        earliest = min(since for _, _, since in self._pending.values())
+        return max(0.0, min(limit, earliest + self.settle - now))
+
+    def ready(self, now=None):
+        """取出已写入完成的文件，返回 (路径, os.stat_result) 列表"""
+        now = time.monotonic() if now is None else now
+        ready = []
+        for path, (size, mtime_ns, since) in list(self._pending.items()):
+            if now - since < self.settle:
+                continue
+            try:
+                st = os.stat(path)
+            except OSError:
+                del self._pending[path]
+                continue
+            if (st.st_size, st.st_mtime_ns) != (size, mtime_ns):
+                # 事件之后仍在写入 (如轮询模式，或写入方没有触发新事件)
+                self._pending[path] = (st.st_size, st.st_mtime_ns, now)
+                continue
+            del self._pending[path]
+            ready.append((path, st))
+        return ready
+
+
+def watch_tree(source, output, settings, should_stop=None, settle=DEFAULT_SETTLE,
+               poll_interval=DEFAULT_POLL_INTERVAL, polling=False, on_watching=None):
+    """先转换源目录中已有的文件，然后持续监视，按完成顺序逐个返回 ConvertResult
+
+    should_stop: 无参数的回调，返回 True 时停止监视 (最迟 poll_interval 秒后生效)
+    settle: 文件多少秒内没有变化才视为写入完成
+    polling: 不使用 inotify，始终轮询
+    on_watching: 已有文件转换完成、开始监视时以监视方式 ('inotify' / 'polling') 调用
+    """
+    if should_stop is None:
+        should_stop = lambda: False
+    source = os.path.abspath(source)
+    # 输出目录在源目录内时不监视输出目录，避免转换自己的输出
+    exclude = [os.path.abspath(output)]
+    if settings.profile_dir:
+        exclude.append(os.path.abspath(settings.profile_dir))
+    # 先开始监视再转换已有文件，转换期间新写入的文件不会遗漏
+    watcher = create_watcher(source, settings.recursive, exclude, polling)
+    engine = None
+    session = None
+    try:
+        engine = create_engine(settings.workers, settings.memory_budget * 1024 * 1024,
+                               warm_formats=settings.output_formats)
+        session = ConversionSession(source, output, settings, engine)
+
+        discovery = FileDiscovery(source, settings.recursive)
+        try:
+            existing = (item for item in discovery
+                        if item is WAITING or not watcher.filter.excluded(item.filepath))
+            yield from session.run(existing, should_stop, lambda: discovery.count)
+        finally:
+            discovery.close()
+        # 监视模式可能长时间运行并被强制结束，每批文件转换后立即提交转换清单
+        session.commit()
+        if on_watching is not None and not should_stop():
+            on_watching(watcher.method)
+
+        tracker = SettleTracker(settle)
+        while not should_stop():
+            for path in watcher.poll(tracker.timeout(poll_interval)):
+                tracker.touch(path)
+            batch = []
+            for path, st in tracker.ready():
+                directory, filename = os.path.split(path)
+                rel_path = os.path.relpath(directory, source)
+                batch.append(SourceFile(path, filename, rel_path, st.st_size, st.st_mtime_ns))
+            if batch:
+                yield from session.run(batch, should_stop, lambda: len(batch))
+                session.commit()
+    finally:
+        if session is not None:
+            session.close()
+        if engine is not None:
+            engine.close()
+        watcher.close()
@@ -0,0 +1,31 @@
+"""测试公用的夹具
+
+各模块是仓库根目录下的独立文件 (不是包)，测试时把根目录加入 sys.path。
+"""
+import os
+import sys
+
+import pytest
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def make_image(tmp_path):
+    """在 tmp_path 下生成图片，返回路径 (str)
+
+    noise=True 时生成噪声图像 (转换后明显变小)，否则为纯色图像。
+    """
+
+    def make(rel_path, size=(64, 48), color=(200, 30, 30), noise=False, **options):
+        path = tmp_path / rel_path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        if noise:
+            img = Image.effect_noise(size, 60).convert('RGB')
+        else:
+            img = Image.new('RGB', size, color)
+        img.save(path, **options)
+        return str(path)
+
+    return make
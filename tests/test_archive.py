@@ -0,0 +1,77 @@
+"""压缩包的输入和输出"""
+import io
+import tarfile
+import zipfile
+
+from PIL import Image
+
+from img_to_webp_archive import _member_path, archive_kind, convert_archive
+from img_to_webp_core import ConvertSettings
+
+
+def _png(color):
+    buf = io.BytesIO()
+    Image.new('RGB', (32, 32), color).save(buf, 'PNG')
+    return buf.getvalue()
+
+
+def test_archive_kind():
+    assert archive_kind("a.zip") == 'zip'
+    assert archive_kind("a.TAR.GZ") == 'tar'
+    assert archive_kind("a.tgz") == 'tar'
+    assert archive_kind("a.png") is None
+
+
+def test_member_path():
+    assert _member_path("a.png") == ('.', 'a.png')
+    assert _member_path("./x/y/a.png") == ('x/y', 'a.png')
+    assert _member_path("../a.png") is None
+    assert _member_path("/etc/a.png") is None
+    assert _member_path("C:/a.png") is None
+
+
+def test_zip_to_zip(tmp_path):
+    source = tmp_path / "in.zip"
+    with zipfile.ZipFile(source, 'w') as zf:
+        zf.writestr("a.png", _png((255, 0, 0)))
+        zf.writestr("sub/a.png", _png((0, 255, 0)))
+        zf.writestr("../evil.png", _png((0, 0, 255)))
+        zf.writestr("notes.txt", b"text")
+    output = tmp_path / "out.zip"
+    settings = ConvertSettings(skip_larger=False)
+    results = list(convert_archive(str(source), str(output), settings))
+    assert sorted(r.status for r in results) == ['convert', 'convert']
+    with zipfile.ZipFile(output) as zf:
+        names = sorted(zf.namelist())
+        # 不保留目录结构时同名成员依次加上 _1
+        assert names == ['a.webp', 'a_1.webp']
+        for name in names:
+            assert Image.open(io.BytesIO(zf.read(name))).format == 'WEBP'
+
+
+def test_directory_to_tar_keeps_structure(tmp_path, make_image):
+    make_image("src/a.png")
+    make_image("src/sub/b.png")
+    (tmp_path / "src" / "c.webp").write_bytes(b"RIFF....WEBP")
+    output = tmp_path / "out.tar.gz"
+    settings = ConvertSettings(keep_structure=True, skip_larger=False)
+    results = list(convert_archive(str(tmp_path / "src"), str(output), settings))
+    assert sorted(r.status for r in results) == ['convert', 'convert', 'copy']
+    with tarfile.open(output) as tf:
+        assert sorted(tf.getnames()) == ['a.webp', 'c.webp', 'sub/b.webp']
+        assert tf.extractfile('c.webp').read() == b"RIFF....WEBP"
+
+
+def test_stop_keeps_converted_members(tmp_path):
+    source = tmp_path / "in.zip"
+    with zipfile.ZipFile(source, 'w') as zf:
+        for i in range(5):
+            zf.writestr(f"{i}.png", _png((i, 0, 0)))
+    output = tmp_path / "out.zip"
+    done = []
+    results = convert_archive(str(source), str(output), ConvertSettings(skip_larger=False),
+                              should_stop=lambda: len(done) >= 2)
+    for result in results:
+        done.append(result)
+    with zipfile.ZipFile(output) as zf:
+        assert len(zf.namelist()) == len(done) < 5
@@ -0,0 +1,78 @@
+"""命令行和界面参数的解析与检查"""
+import time
+
+import pytest
+
+from img_to_webp_core import (check_name_template, default_name_template, parse_deadline, parse_formats,
+                              parse_widths)
+
+
+def test_parse_formats():
+    assert parse_formats("webp") == ('webp',)
+    assert parse_formats(" AVIF , webp,avif ") == ('avif', 'webp')
+    with pytest.raises(ValueError):
+        parse_formats("png")
+    with pytest.raises(ValueError):
+        parse_formats(" , ")
+
+
+def test_parse_widths():
+    assert parse_widths("") == ()
+    assert parse_widths("1280, 320，640,320") == (320, 640, 1280)
+    for text in ("0", "-5", "12px"):
+        with pytest.raises(ValueError):
+            parse_widths(text)
+
+
+@pytest.mark.parametrize("text, seconds", [("600", 600), ("90s", 90), ("30m", 1800), ("2h", 7200),
+                                           ("1.5h", 5400)])
+def test_parse_deadline_duration(text, seconds):
+    now = 1_700_000_000.0
+    assert parse_deadline(text, now) == now + seconds
+
+
+def test_parse_deadline_clock_time():
+    now = time.time()
+    deadline = parse_deadline("18:30", now)
+    assert now < deadline <= now + 24 * 3600
+    local = time.localtime(deadline)
+    assert (local.tm_hour, local.tm_min) == (18, 30)
+
+
+@pytest.mark.parametrize("text", ["", "0", "-10", "abc", "25:00", "12:60", "1:2:3", "m"])
+def test_parse_deadline_invalid(text):
+    with pytest.raises(ValueError):
+        parse_deadline(text, 0)
+
+
+def test_default_name_template():
+    assert default_name_template(()) == "{name}.{ext}"
+    assert default_name_template((320,)) == "{name}-{width}w.{ext}"
+
+
+def test_check_name_template_accepts_valid_rules():
+    assert check_name_template("", (), ('webp',)) == ""
+    assert check_name_template("  {name}.{ext} ", (), ('webp',)) == "{name}.{ext}"
+    assert check_name_template("{name}_{width:05d}.{ext}", (320, 640), ('webp', 'avif'))
+    # 只有一种格式和一个宽度时 {width}、{ext} 可以省略
+    assert check_name_template("{name}-small.webp", (320,), ('webp',))
+
+
+@pytest.mark.parametrize("template, widths, formats", [
+    ("{name}.{size}", (), ('webp',)),  # 未知字段
+    ("{base}.{ext}", (), ('webp',)),  # 没有 {name}
+    ("{name}.{ext}", (320, 640), ('webp',)),  # 多个宽度缺少 {width}
+    ("{name}-{width}.webp", (320,), ('webp', 'avif')),  # 多种格式缺少 {ext}
+    ("{name}.{ext", (), ('webp',)),  # 括号不完整
+    ("{name}-{width:d}.{ext}", (), ('webp',)),  # 格式说明对空宽度无效
+])
+def test_check_name_template_rejects_invalid_rules(template, widths, formats):
+    with pytest.raises(ValueError):
+        check_name_template(template, widths, formats)
+
+
+@pytest.mark.parametrize("template", ["../{name}.{ext}", "{name}/{width}.{ext}", "/tmp/{name}.{ext}",
+                                      "{name}\\x.{ext}", "{name}..{ext}"])
+def test_check_name_template_rejects_directories(template):
+    with pytest.raises(ValueError):
+        check_name_template(template, (320,), ('webp',))
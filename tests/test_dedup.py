@@ -0,0 +1,155 @@
+"""相同内容的源文件去重"""
+import os
+
+from img_to_webp_core import ConvertResult, ConvertSettings, SourceFile
+from img_to_webp_dedup import ContentIndex, content_hash
+from img_to_webp_manifest import ConversionManifest
+
+
+class Job:
+    """只有 classify() 用到的字段"""
+
+    def __init__(self, copy=False):
+        self.targets = () if copy else (('webp', None, 'out.webp'),)
+
+
+def _source(tmp_path, name, data):
+    path = tmp_path / name
+    path.write_bytes(data)
+    return SourceFile(str(path), name, '.', len(data), 0)
+
+
+def _result(item, status='convert', outputs=(), digest=None):
+    return ConvertResult(status, item.filepath, item.filename, None, None, item.size, item.size, None, None,
+                         outputs=list(outputs), content_hash=digest)
+
+
+def test_content_hash_streams_file(tmp_path):
+    path = tmp_path / "a.bin"
+    path.write_bytes(b"abc" * 1000)
+    assert content_hash(str(path)) == content_hash(str(path))
+    assert len(content_hash(str(path))) == 40
+
+
+def test_unique_sizes_are_not_hashed(tmp_path):
+    index = ContentIndex()
+    a = _source(tmp_path, "a.png", b"a")
+    b = _source(tmp_path, "b.png", b"bb")
+    assert index.classify(a, Job()) == (None, None)
+    assert index.classify(b, Job()) == (None, None)
+    assert index._hashes == {}
+
+
+def test_duplicate_waits_for_encoder(tmp_path):
+    index = ContentIndex()
+    a = _source(tmp_path, "a.png", b"same")
+    b = _source(tmp_path, "b.png", b"same")
+    c = _source(tmp_path, "c.png", b"same")
+    job_b = Job()
+    assert index.classify(a, Job()) == (None, None)
+    assert index.classify(b, job_b) == ('wait', None)
+    outputs = [('a.webp', 'webp', None, 3, 'convert')]
+    assert index.completed(_result(a, outputs=outputs)) == [job_b]
+    # 编码完成后相同内容直接沿用
+    assert index.classify(c, Job()) == ('ready', ('convert', outputs))
+    assert index._pending == {} and index._hashes == {}
+
+
+def test_failed_encoding_is_not_reused(tmp_path):
+    index = ContentIndex()
+    a = _source(tmp_path, "a.png", b"same")
+    b = _source(tmp_path, "b.png", b"same")
+    index.classify(a, Job())
+    index.classify(_source(tmp_path, "x.png", b"sam2"), Job())
+    index.completed(_result(a, status='error'))
+    assert index.classify(b, Job()) == (None, None)
+
+
+def test_unique_file_is_hashed_when_a_twin_appears(tmp_path):
+    index = ContentIndex()
+    a = _source(tmp_path, "a.png", b"same")
+    assert index.classify(a, Job()) == (None, None)
+    outputs = [('a.webp', 'webp', None, 3, 'convert')]
+    assert index.completed(_result(a, outputs=outputs)) == []
+    b = _source(tmp_path, "b.png", b"same")
+    assert index.classify(b, Job()) == ('ready', ('convert', outputs))
+
+
+def test_copy_and_encode_are_separate(tmp_path):
+    index = ContentIndex()
+    a = _source(tmp_path, "a.webp", b"same")
+    b = _source(tmp_path, "b.png", b"same")
+    assert index.classify(a, Job(copy=True)) == (None, None)
+    # 内容相同，但一个只复制、一个需要编码，不能互相沿用
+    assert index.classify(b, Job()) == (None, None)
+
+
+def test_missing_file_is_encoded(tmp_path):
+    index = ContentIndex()
+    a = _source(tmp_path, "a.png", b"same")
+    b = _source(tmp_path, "b.png", b"same")
+    index.classify(a, Job())
+    os.remove(b.filepath)
+    assert index.classify(b, Job()) == (None, None)
+
+
+def test_completed_ignores_unknown_files(tmp_path):
+    index = ContentIndex()
+    a = _source(tmp_path, "a.png", b"same")
+    assert index.completed(_result(a)) == []
+
+
+def test_tables_are_bounded(tmp_path, monkeypatch):
+    monkeypatch.setattr(ContentIndex, 'MAX_CONTENTS', 5)
+    monkeypatch.setattr(ContentIndex, 'MAX_SIZES', 8)
+    index = ContentIndex()
+    for i in range(40):
+        # 每两个文件内容相同
+        item = _source(tmp_path, f"{i}.png", b"x" * (i // 2 + 1))
+        action, _ = index.classify(item, Job())
+        if action is None:
+            index.completed(_result(item, outputs=[(f"{i}.webp", 'webp', None, 1, 'convert')]))
+    assert len(index._sizes) <= 8
+    assert len(index._done) <= 5
+    assert len(index._unhashed) <= 5
+    assert index._pending == {} and index._hashes == {} and index._encoding == {}
+    assert index._waiting == {}
+
+
+def test_manifest_reuses_content_across_runs(tmp_path):
+    out = tmp_path / "out"
+    out.mkdir()
+    output = out / "a.webp"
+    output.write_bytes(b"webp")
+    settings = ConvertSettings()
+
+    manifest = ConversionManifest(str(out), settings, str(tmp_path))
+    index = ContentIndex(manifest)
+    a = _source(tmp_path, "a.png", b"same")
+    assert index.classify(a, Job()) == (None, None)
+    # 有清单时大小唯一的文件由工作进程计算哈希
+    assert index.needs_digest(a.filepath)
+    outputs = [(str(output), 'webp', None, 4, 'convert')]
+    index.completed(_result(a, outputs=outputs, digest=content_hash(a.filepath)))
+    manifest.close()
+
+    manifest = ConversionManifest(str(out), settings, str(tmp_path))
+    index = ContentIndex(manifest)
+    moved = _source(tmp_path, "moved.png", b"same")
+    assert index.classify(moved, Job()) == ('ready', ('convert', outputs))
+    manifest.close()
+
+
+def test_copy_jobs_are_hashed_after_copy(tmp_path):
+    out = tmp_path / "out"
+    out.mkdir()
+    output = out / "a.webp"
+    output.write_bytes(b"same")
+    manifest = ConversionManifest(str(out), ConvertSettings(), str(tmp_path))
+    index = ContentIndex(manifest)
+    a = _source(tmp_path, "a.webp", b"same")
+    index.classify(a, Job(copy=True))
+    # 工作进程没有计算哈希，完成后由主进程流式计算并记录
+    index.completed(_result(a, status='copy', outputs=[(str(output), None, None, 4, 'copy')]))
+    assert manifest.lookup_content(content_hash(a.filepath) + ":copy") is not None
+    manifest.close()
@@ -0,0 +1,80 @@
+"""编码强度控制"""
+import pytest
+
+import img_to_webp_core
+from img_to_webp_core import MAX_EFFORT, TINY_FILE_SIZE, EffortController
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def run(monkeypatch):
+    """以固定间隔完成 count 个文件"""
+    clock = Clock()
+    monkeypatch.setattr(img_to_webp_core.time, 'monotonic', clock)
+
+    def run(controller, count, interval):
+        for _ in range(count):
+            clock.now += interval
+            controller.observe(remaining=100)
+
+    return run
+
+
+def test_inactive_by_default():
+    controller = EffortController()
+    assert not controller.active
+    assert controller.effort_for(10 * 1024 * 1024) == MAX_EFFORT
+
+
+def test_slow_rate_lowers_effort_once_per_window(run):
+    controller = EffortController(target_rate=10)
+    assert controller.active
+    # 每秒 1 张，远低于目标: 每个窗口降低一级
+    run(controller, EffortController.WINDOW - 1, 1.0)
+    assert controller.effort == MAX_EFFORT
+    run(controller, 1, 1.0)
+    assert controller.effort == MAX_EFFORT - 1
+    run(controller, EffortController.WINDOW, 1.0)
+    assert controller.effort == MAX_EFFORT - 2
+    run(controller, EffortController.WINDOW * 10, 1.0)
+    assert controller.effort == 0
+
+
+def test_fast_rate_raises_effort(run):
+    controller = EffortController(target_rate=10)
+    controller.effort = 2
+    run(controller, EffortController.WINDOW, 0.01)
+    assert controller.effort == 3
+    run(controller, EffortController.WINDOW * 10, 0.01)
+    assert controller.effort == MAX_EFFORT
+
+
+def test_rate_within_headroom_keeps_effort(run):
+    controller = EffortController(target_rate=10)
+    controller.effort = 3
+    # 每秒 12 张: 达到目标但不到 HEADROOM 倍
+    run(controller, EffortController.WINDOW * 3, 1 / 12)
+    assert controller.effort == 3
+
+
+def test_tiny_files_use_max_effort():
+    controller = EffortController(target_rate=10)
+    controller.effort = 0
+    assert controller.effort_for(TINY_FILE_SIZE - 1) == MAX_EFFORT
+    assert controller.effort_for(TINY_FILE_SIZE) == 0
+
+
+def test_deadline_target(monkeypatch):
+    monkeypatch.setattr(img_to_webp_core.time, 'time', lambda: 1000.0)
+    controller = EffortController(target_rate=1, deadline=1100.0)
+    assert controller.target(500) == 5
+    assert controller.target(10) == 1
+    controller.deadline = 900.0
+    assert controller.target(1) == float('inf')
@@ -0,0 +1,115 @@
+"""转换清单"""
+import os
+import sqlite3
+
+from img_to_webp_core import ConvertSettings
+from img_to_webp_manifest import MANIFEST_NAME, ConversionManifest
+
+
+def _write(path, data=b"x"):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(data)
+    return str(path)
+
+
+def test_record_and_is_unchanged(tmp_path):
+    out = tmp_path / "out"
+    out.mkdir()
+    output = _write(out / "a.webp")
+    manifest = ConversionManifest(str(out), ConvertSettings(), str(tmp_path / "src"))
+    assert not manifest.is_unchanged("a.png", 10, 1)
+    assert manifest.previous_outputs("a.png") == []
+    manifest.record("a.png", 10, 1, [output], 'convert')
+    manifest.close()
+
+    manifest = ConversionManifest(str(out), ConvertSettings(), str(tmp_path / "src"))
+    assert manifest.is_unchanged("a.png", 10, 1)
+    assert not manifest.is_unchanged("a.png", 11, 1)
+    assert not manifest.is_unchanged("a.png", 10, 2)
+    assert manifest.previous_outputs("a.png") == [output]
+    # 输出文件被删除后需要重新转换
+    os.remove(output)
+    assert not manifest.is_unchanged("a.png", 10, 1)
+    manifest.forget("a.png")
+    assert manifest.previous_outputs("a.png") == []
+    manifest.close()
+
+
+def test_source_directories_are_separate(tmp_path):
+    out = tmp_path / "out"
+    output = _write(out / "a.webp")
+    first = ConversionManifest(str(out), ConvertSettings(), str(tmp_path / "one"))
+    first.record("a.png", 10, 1, [output], 'convert')
+    first.close()
+    second = ConversionManifest(str(out), ConvertSettings(), str(tmp_path / "two"))
+    assert not second.is_unchanged("a.png", 10, 1)
+    assert second.previous_outputs("a.png") == []
+    second.close()
+
+
+def test_settings_change_replaces_outputs(tmp_path):
+    out = tmp_path / "out"
+    src = str(tmp_path / "src")
+    output = _write(out / "a.webp")
+    manifest = ConversionManifest(str(out), ConvertSettings(quality=85), src)
+    manifest.record("a.png", 10, 1, [output], 'convert')
+    manifest.close()
+
+    manifest = ConversionManifest(str(out), ConvertSettings(quality=70), src)
+    assert not manifest.is_unchanged("a.png", 10, 1)
+    # 其他设置下的输出作为上次的输出返回，重新转换时覆盖而不是另写 a_1.webp
+    assert manifest.previous_outputs("a.png") == [output]
+    manifest.record("a.png", 10, 1, [output], 'convert')
+    manifest.close()
+
+    conn = sqlite3.connect(str(out / MANIFEST_NAME))
+    assert conn.execute("SELECT COUNT(*) FROM files WHERE source = 'a.png'").fetchone() == (1,)
+    conn.close()
+    manifest = ConversionManifest(str(out), ConvertSettings(quality=85), src)
+    assert manifest.previous_outputs("a.png") == [output]
+    assert not manifest.is_unchanged("a.png", 10, 1)
+    manifest.close()
+
+
+def test_content_records(tmp_path):
+    out = tmp_path / "out"
+    output = _write(out / "a.webp", b"webp data")
+    manifest = ConversionManifest(str(out), ConvertSettings(), str(tmp_path / "src"))
+    assert not manifest.has_content_size(100)
+    assert manifest.lookup_content("abc") is None
+    manifest.record_content("abc", 100, 'convert', [(output, 'webp', None, 9, 'convert')])
+    manifest.close()
+
+    manifest = ConversionManifest(str(out), ConvertSettings(), str(tmp_path / "other"))
+    assert manifest.has_content_size(100)
+    assert manifest.lookup_content("abc") == ('convert', [(output, 'webp', None, 9, 'convert')])
+    # 输出文件被修改后不再沿用
+    with open(output, 'ab') as f:
+        f.write(b"changed")
+    assert manifest.lookup_content("abc") is None
+    manifest.close()
+
+    manifest = ConversionManifest(str(out), ConvertSettings(quality=50), str(tmp_path / "src"))
+    assert manifest.lookup_content("abc") is None
+    manifest.close()
+
+
+def test_migrates_manifest_without_root_column(tmp_path):
+    out = tmp_path / "out"
+    output = _write(out / "a.webp")
+    conn = sqlite3.connect(str(out / MANIFEST_NAME))
+    conn.execute(
+        "CREATE TABLE files (source TEXT NOT NULL, settings TEXT NOT NULL, size INTEGER NOT NULL,"
+        " mtime_ns INTEGER NOT NULL, output TEXT NOT NULL, status TEXT NOT NULL,"
+        " PRIMARY KEY (source, settings))")
+    conn.execute("INSERT INTO files VALUES ('old.png', 'xyz', 1, 1, 'old.webp', 'convert')")
+    conn.commit()
+    conn.close()
+
+    manifest = ConversionManifest(str(out), ConvertSettings(), str(tmp_path / "src"))
+    assert manifest.previous_outputs("old.png") == []
+    manifest.record("a.png", 10, 1, [output], 'convert')
+    manifest.close()
+    manifest = ConversionManifest(str(out), ConvertSettings(), str(tmp_path / "src"))
+    assert manifest.is_unchanged("a.png", 10, 1)
+    manifest.close()
@@ -0,0 +1,44 @@
+"""输出文件名登记表"""
+import os
+
+from img_to_webp_core import OutputNameRegistry
+
+
+def test_reserve_assigns_unique_names(tmp_path):
+    names = OutputNameRegistry()
+    out = str(tmp_path)
+    assert names.reserve(out, "a.webp") == os.path.join(out, "a.webp")
+    assert names.reserve(out, "a.webp") == os.path.join(out, "a_1.webp")
+    assert names.reserve(out, "a.webp") == os.path.join(out, "a_2.webp")
+    assert names.reserve(out, "b.webp") == os.path.join(out, "b.webp")
+
+
+def test_reserve_skips_existing_files(tmp_path):
+    (tmp_path / "a.webp").write_bytes(b"x")
+    (tmp_path / "a_1.webp").write_bytes(b"x")
+    names = OutputNameRegistry()
+    assert names.reserve(str(tmp_path), "a.webp") == str(tmp_path / "a_2.webp")
+
+
+def test_reserve_reuses_previous_outputs(tmp_path):
+    (tmp_path / "a.webp").write_bytes(b"x")
+    (tmp_path / "a_3.webp").write_bytes(b"x")
+    out = str(tmp_path)
+    names = OutputNameRegistry()
+    # 同一源文件上次的输出可以再次使用
+    assert names.reserve(out, "a.webp", [str(tmp_path / "a_3.webp")]) == str(tmp_path / "a_3.webp")
+    # 不属于该文件名的上次输出不能沿用
+    assert names.reserve(out, "a.webp", [str(tmp_path / "b.webp")]) == str(tmp_path / "a_1.webp")
+    # 其他目录中的上次输出不能沿用
+    other = tmp_path / "sub"
+    other.mkdir()
+    (other / "a.webp").write_bytes(b"x")
+    assert names.reserve(out, "a.webp", [str(other / "a.webp")]) == str(tmp_path / "a_2.webp")
+
+
+def test_directories_are_independent(tmp_path):
+    names = OutputNameRegistry()
+    first = tmp_path / "x"
+    second = tmp_path / "y"
+    assert names.reserve(str(first), "a.webp") == str(first / "a.webp")
+    assert names.reserve(str(second), "a.webp") == str(second / "a.webp")
@@ -0,0 +1,235 @@
+"""评审中发现的问题的回归测试"""
+import errno
+import os
+import socket
+import threading
+import time
+from collections import namedtuple
+
+import pytest
+
+import img_to_webp_core
+from img_to_webp_core import (WAITING, ConvertResult, ConvertSettings, FileDiscovery, OutputFile,
+                              ProcessPoolEngine, SourceFile, atomic_copy, convert_file, convert_tree,
+                              describe_result)
+
+
+# 引擎只用到任务的 mem_cost
+MarkerJob = namedtuple('MarkerJob', ['path', 'mem_cost'])
+
+
+def _slow_worker(job):
+    # 模块级函数，可以发送到工作进程
+    time.sleep(0.3)
+    with open(job.path, 'w') as f:
+        f.write("done")
+    return job.path
+
+
+def test_stop_returns_running_jobs(tmp_path):
+    """停止时已在运行的任务写出了输出，必须返回结果 (否则不会记入转换清单)"""
+    jobs = [MarkerJob(str(tmp_path / f"{i}.marker"), 0) for i in range(20)]
+    yielded = []
+    engine = ProcessPoolEngine(workers=2)
+    for result in engine.run(jobs, lambda: len(yielded) >= 1, _slow_worker):
+        yielded.append(result)
+    engine.close()
+    written = sorted(str(path) for path in tmp_path.glob("*.marker"))
+    assert 1 <= len(yielded) < len(jobs)
+    assert sorted(yielded) == written
+
+
+def _outputs(out):
+    return sorted(name for name in os.listdir(out) if not name.startswith('.'))
+
+
+def test_settings_change_overwrites_outputs(tmp_path, make_image):
+    make_image("src/photo.png", noise=True)
+    make_image("src/sub/logo.png", noise=True, size=(80, 60))
+    src, out = str(tmp_path / "src"), str(tmp_path / "out")
+
+    list(convert_tree(src, out, ConvertSettings(quality=85)))
+    assert _outputs(out) == ['logo.webp', 'photo.webp']
+    # 改变质量后覆盖原来的输出，而不是另写 photo_1.webp
+    results = list(convert_tree(src, out, ConvertSettings(quality=70)))
+    assert {r.status for r in results} == {'convert'}
+    assert _outputs(out) == ['logo.webp', 'photo.webp']
+
+    # 改为多种格式和宽度时删除不再需要的旧输出
+    settings = ConvertSettings(output_formats=('webp', 'avif'), widths=(16, 32))
+    list(convert_tree(src, out, settings))
+    expected = sorted(f"{name}-{width}w.{ext}" for name in ('logo', 'photo') for width in (16, 32)
+                      for ext in ('webp', 'avif'))
+    assert _outputs(out) == expected
+
+    list(convert_tree(src, out, ConvertSettings(quality=85)))
+    assert _outputs(out) == ['logo.webp', 'photo.webp']
+    results = list(convert_tree(src, out, ConvertSettings(quality=85)))
+    assert {r.status for r in results} == {'unchanged'}
+
+
+def test_sources_sharing_an_output_directory(tmp_path, make_image):
+    make_image("one/photo.png", noise=True)
+    make_image("two/photo.png", noise=True, size=(70, 50))
+    out = str(tmp_path / "out")
+    for source in ("one", "two"):
+        list(convert_tree(str(tmp_path / source), out, ConvertSettings()))
+    assert _outputs(out) == ['photo.webp', 'photo_1.webp']
+    for source in ("one", "two"):
+        results = list(convert_tree(str(tmp_path / source), out, ConvertSettings()))
+        assert [r.status for r in results] == ['unchanged']
+    assert _outputs(out) == ['photo.webp', 'photo_1.webp']
+
+
+def test_discovery_does_not_block_on_slow_scan(tmp_path, monkeypatch):
+    path = tmp_path / "a.png"
+    path.write_bytes(b"x")
+    release = threading.Event()
+
+    def slow_scan(source, recursive=True):
+        yield SourceFile(str(path), "a.png", '.', 1, 0)
+        release.wait(10)
+
+    monkeypatch.setattr(img_to_webp_core, 'iter_source_files', slow_scan)
+    discovery = FileDiscovery(str(tmp_path))
+    items = iter(discovery)
+    assert next(items).filename == "a.png"
+    # 扫描没有新文件时产生 WAITING，而不是一直阻塞
+    assert next(items) is WAITING
+    release.set()
+    assert list(items) in ([], [WAITING])
+    discovery.close()
+
+
+def test_stop_during_slow_scan(tmp_path, monkeypatch, make_image):
+    make_image("src/a.png")
+    release = threading.Event()
+
+    def slow_scan(source, recursive=True):
+        path = str(tmp_path / "src" / "a.png")
+        yield SourceFile(path, "a.png", '.', os.path.getsize(path), os.stat(path).st_mtime_ns)
+        release.wait(30)
+
+    monkeypatch.setattr(img_to_webp_core, 'iter_source_files', slow_scan)
+    results = []
+    started = time.monotonic()
+    for result in convert_tree(str(tmp_path / "src"), str(tmp_path / "out"), ConvertSettings(),
+                               should_stop=lambda: time.monotonic() - started > 0.5):
+        results.append(result)
+    release.set()
+    assert time.monotonic() - started < 5
+    assert [r.filename for r in results] == ["a.png"]
+
+
+def test_describe_result_compares_each_output():
+    outputs = [OutputFile('/out/a-640w.webp', 'webp', 640, 600, 'convert'),
+               OutputFile('/out/a-640w.avif', 'avif', 640, 500, 'convert'),
+               OutputFile('/out/a-320w.webp', 'webp', 320, 200, 'convert')]
+    result = ConvertResult('convert', '/src/a.png', 'a.png', outputs[0].path, 'a-640w.webp', 1000, 600,
+                           None, None, outputs)
+    # 输出大小之和超过原文件，但每个输出都更小，不应标记为警告
+    [(message, tag)] = describe_result(result, ('webp', 'avif'))
+    assert tag == 'success'
+    assert "a-320w.webp" in message and "节省 80.0%" in message
+
+
+class RecordingEngine:
+    """在当前进程中执行并记录提交的任务"""
+
+    def __init__(self):
+        self.jobs = []
+
+    def run(self, jobs, should_stop, worker=convert_file):
+        for job in jobs:
+            if job is WAITING:
+                continue
+            if isinstance(job, ConvertResult):
+                yield job
+                continue
+            self.jobs.append(job)
+            yield worker(job)
+
+    def close(self):
+        pass
+
+
+def test_copy_jobs_do_not_hash_in_worker(tmp_path, make_image):
+    make_image("src/a.png", noise=True)
+    make_image("src/b.webp", noise=True, size=(50, 40))
+    make_image("src/c.webp", noise=True, size=(50, 41))
+    engine = RecordingEngine()
+    session = img_to_webp_core.ConversionSession(str(tmp_path / "src"), str(tmp_path / "out"),
+                                                 ConvertSettings(), engine=engine)
+    files = list(img_to_webp_core.iter_source_files(str(tmp_path / "src")))
+    results = list(session.run(files))
+    session.close()
+    assert sorted(r.status for r in results) == ['convert', 'copy', 'copy']
+    hashed = {job.filename: job.hash_content for job in engine.jobs}
+    # 只复制的文件由主进程在复制后计算哈希，工作进程中不读入内容
+    assert hashed == {'a.png': True, 'b.webp': False, 'c.webp': False}
+
+
+def test_copy_file_range_returning_zero_falls_back(tmp_path, monkeypatch):
+    if not hasattr(os, 'copy_file_range'):
+        pytest.skip("copy_file_range 不可用")
+    src = tmp_path / "a.webp"
+    src.write_bytes(os.urandom(100000))
+    monkeypatch.setattr(os, 'copy_file_range', lambda *args: 0)
+    monkeypatch.setattr(img_to_webp_core, '_passthrough_unsupported', {})
+    dst = tmp_path / "b.webp"
+    method = atomic_copy(str(src), str(dst), 'copy_range')
+    assert method != 'copy_range'
+    assert dst.read_bytes() == src.read_bytes()
+
+
+def test_check_copied_rejects_short_copy(tmp_path):
+    path = tmp_path / "a"
+    path.write_bytes(b"12345")
+    with open(path, 'rb') as f:
+        img_to_webp_core._check_copied(f.fileno(), 5, 'test')
+        with pytest.raises(OSError) as info:
+            img_to_webp_core._check_copied(f.fileno(), 0, 'test')
+    assert info.value.errno == errno.ENOTSUP
+
+
+@pytest.fixture
+def server():
+    from img_to_webp_server import ConversionServer, ConversionService
+
+    service = ConversionService(workers=1, max_pending=1)
+    httpd = ConversionServer(('127.0.0.1', 0), service)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+    service.close()
+
+
+def _exchange(address, data, timeout=5):
+    """发送原始请求，读取直到服务端关闭连接"""
+    with socket.create_connection(address, timeout=timeout) as sock:
+        sock.sendall(data)
+        chunks = []
+        while chunk := sock.recv(65536):
+            chunks.append(chunk)
+    return b"".join(chunks)
+
+
+def test_server_early_error_closes_connection(server):
+    inner = b"GET /metrics HTTP/1.1\r\nHost: x\r\n\r\n"
+    request = (b"POST /unknown HTTP/1.1\r\nHost: x\r\nContent-Length: %d\r\n\r\n" % len(inner)) + inner
+    response = _exchange(server.server_address, request)
+    # 未读取的请求体不能被当作下一个请求处理
+    assert response.startswith(b"HTTP/1.0 404") or response.startswith(b"HTTP/1.1 404")
+    assert response.count(b"HTTP/1.") == 1
+
+
+def test_server_rejects_busy_before_reading_body(server):
+    with server.service.reserve():
+        # 只发送请求头: 繁忙时不等待请求体就返回 503
+        request = b"POST /convert HTTP/1.1\r\nHost: x\r\nContent-Length: 100000\r\n\r\n"
+        response = _exchange(server.server_address, request)
+    assert b" 503 " in response.split(b"\r\n", 1)[0]
+    assert server.service.rejected == 1
+    assert server.service.in_flight == 0
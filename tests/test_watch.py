@@ -0,0 +1,55 @@
+"""监视模式中等待文件写入完成"""
+import os
+
+from img_to_webp_watch import SettleTracker
+
+
+def test_file_is_ready_after_settle(tmp_path):
+    path = tmp_path / "a.png"
+    path.write_bytes(b"data")
+    tracker = SettleTracker(settle=2)
+    tracker.touch(str(path), now=100)
+    assert len(tracker) == 1
+    assert tracker.timeout(10, now=100) == 2
+    assert tracker.ready(now=101) == []
+    ready = tracker.ready(now=102)
+    assert [p for p, _ in ready] == [str(path)]
+    assert ready[0][1].st_size == 4
+    assert len(tracker) == 0
+    assert tracker.timeout(10, now=102) == 10
+
+
+def test_new_event_restarts_timer(tmp_path):
+    path = tmp_path / "a.png"
+    path.write_bytes(b"data")
+    tracker = SettleTracker(settle=2)
+    tracker.touch(str(path), now=100)
+    tracker.touch(str(path), now=101.5)
+    assert tracker.ready(now=102) == []
+    assert tracker.timeout(10, now=102) == 1.5
+    assert len(tracker.ready(now=103.5)) == 1
+
+
+def test_change_without_event_restarts_timer(tmp_path):
+    path = tmp_path / "a.png"
+    path.write_bytes(b"data")
+    tracker = SettleTracker(settle=2)
+    tracker.touch(str(path), now=100)
+    # 没有新事件但文件仍在写入 (轮询模式)
+    with open(path, 'ab') as f:
+        f.write(b"more")
+    assert tracker.ready(now=102) == []
+    assert len(tracker) == 1
+    assert len(tracker.ready(now=104)) == 1
+
+
+def test_missing_files_are_dropped(tmp_path):
+    path = tmp_path / "a.png"
+    tracker = SettleTracker(settle=2)
+    tracker.touch(str(path), now=100)
+    assert len(tracker) == 0
+    path.write_bytes(b"data")
+    tracker.touch(str(path), now=100)
+    os.remove(path)
+    assert tracker.ready(now=103) == []
+    assert len(tracker) == 0